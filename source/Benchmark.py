@@ -0,0 +1,257 @@
+# Benchmark harness
+#
+# Times and memory-profiles the public methods of a referral network backend on the
+# synthetic graphs of source.Generators, plus the simulation and optimization functions,
+# and compares the results against a stored baseline:
+#
+#   python -m source.Benchmark --sizes 1000 100000 --output results.json
+#   python -m source.Benchmark --baseline benchmarks/baseline.json
+#
+# Times are the best of `repeat` runs; memory is the tracemalloc peak of one extra run.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.Generators import GENERATORS, build_network
+from source.Optimization import min_bonus_for_target
+from source.ReferralNetwork import ReferralNetwork
+from source.Simulation import MAX_SIMULATION_DAYS, days_to_target, growth_curve_cache, simulate
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+DEFAULT_REPEAT = 3
+
+# Ratio over the baseline above which a result is flagged
+DEFAULT_THRESHOLD = 1.5
+
+# Timings and allocations below these floors are too noisy to compare
+MIN_SECONDS = 1e-3
+MIN_BYTES = 64 * 1024
+
+# Calls made by the per-user benchmarks
+CALLS_PER_SAMPLE = 1_000
+
+BACKENDS = {
+    'dict': ReferralNetwork,
+    'compact': CompactReferralNetwork,
+}
+
+
+class BenchmarkResult(NamedTuple):
+
+    name: str
+    shape: str
+    users: int
+    seconds: float
+    peak_bytes: int
+
+
+class Regression(NamedTuple):
+
+    name: str
+    shape: str
+    users: int
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+
+        return self.current / self.baseline
+
+
+def _measure(function, repeat):
+
+    # function is called once per run and may do its own setup before returning a
+    # zero-argument callable to time, so state-changing methods start from fresh inputs
+    best = float('inf')
+    for _ in range(repeat):
+        timed = function()
+        start = time.perf_counter()
+        timed()
+        best = min(best, time.perf_counter() - start)
+
+    timed = function()
+    tracemalloc.start()
+    try:
+        timed()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return best, peak_bytes
+
+
+def _network_benchmarks(network_class, referrals, seed):
+
+    # Yields (name, function) pairs; see _measure for the function protocol
+    rng = random.Random(seed)
+    network = build_network(referrals, network_class)
+    users = list(network.graph)
+    sample = [rng.choice(users) for _ in range(CALLS_PER_SAMPLE)]
+    new_users = iter(range(-1, -10 ** 9, -1))
+
+    yield 'add_referrals', lambda: lambda: build_network(referrals, network_class)
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, 'referrals.csv')
+        with open(csv_path, 'w') as file:
+            file.writelines(f"{referrer},{candidate}\n" for referrer, candidate in referrals)
+        yield 'add_referrals_from_file', lambda: lambda: network_class().add_referrals_from_file(csv_path)
+
+        snapshot_path = os.path.join(directory, 'network.snapshot')
+        yield 'save', lambda: lambda: network.save(snapshot_path)
+        yield 'load', lambda: lambda: network_class.load(snapshot_path)
+
+    yield 'get_direct_referrals', lambda: lambda: [network.get_direct_referrals(user) for user in sample]
+    yield 'get_total_referral_count', lambda: lambda: [network.get_total_referral_count(user) for user in sample]
+    yield 'get_top_k_referrers', lambda: lambda: network.get_top_k_referrers(10)
+    yield 'get_influencers_by_unique_reach', lambda: lambda: network.get_influencers_by_unique_reach(10)
+    yield 'get_influencers_by_flow_centrality', lambda: lambda: network.get_influencers_by_flow_centrality()
+
+    # These grow the network, so they run last and always add users it has not seen
+    def add_users():
+        batch = [next(new_users) for _ in range(CALLS_PER_SAMPLE)]
+        return lambda: [network.add_user(user) for user in batch]
+
+    def add_referrals_one_by_one():
+        batch = [(rng.choice(sample), next(new_users)) for _ in range(CALLS_PER_SAMPLE)]
+        return lambda: [network.add_referral(referrer, candidate) for referrer, candidate in batch]
+
+    yield 'add_user', add_users
+    yield 'add_referral', add_referrals_one_by_one
+
+
+def _simulation_benchmarks():
+
+    def cold_cache(function):
+        def setup():
+            growth_curve_cache.clear()
+            return function
+        return setup
+
+    for p in (0.01, 0.1, 1.0):
+        yield f'simulate(p={p})', lambda p=p: lambda: simulate(p, MAX_SIMULATION_DAYS)
+
+    targets = [10 ** exponent for exponent in range(1, 8)]
+    yield 'days_to_target', cold_cache(lambda: [days_to_target(p / 100, target) for p in range(1, 51) for target in targets])
+    yield 'days_to_target(cached)', lambda: lambda: [days_to_target(p / 100, target) for p in range(1, 51) for target in targets]
+
+    adoption_prob = lambda bonus: bonus / 1000.0
+    queries = [(days, target) for days in (7, 30, 90, 365) for target in (100, 1000, 10 ** 5)]
+    yield 'min_bonus_for_target', cold_cache(lambda: [min_bonus_for_target(days, target, adoption_prob) for days, target in queries])
+
+
+def run_benchmarks(shapes=tuple(GENERATORS), sizes=DEFAULT_SIZES, network_class=ReferralNetwork, repeat=DEFAULT_REPEAT, seed=0, simulation=True, log=None):
+
+    results = []
+
+    def record(name, shape, users, function):
+        seconds, peak_bytes = _measure(function, repeat)
+        result = BenchmarkResult(name, shape, users, seconds, peak_bytes)
+        results.append(result)
+        if log is not None:
+            print(f"{shape:>24} {users:>9} {name:<36} {seconds * 1e3:>12.3f} ms {peak_bytes / 2 ** 20:>10.2f} MiB", file=log)
+
+    for shape in shapes:
+        for users in sizes:
+            referrals = list(GENERATORS[shape](users))
+            # add_referral prints rejected referrals; the generators never produce any
+            with contextlib.redirect_stdout(io.StringIO()):
+                for name, function in _network_benchmarks(network_class, referrals, seed):
+                    record(name, shape, users, function)
+
+    if simulation:
+        # The cold-cache benchmarks clear the shared growth curve cache
+        for name, function in _simulation_benchmarks():
+            record(name, 'simulation', 0, function)
+
+    return results
+
+
+def results_to_json(results, network_class=ReferralNetwork) -> dict:
+
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': network_class.__name__,
+        },
+        'results': [result._asdict() for result in results],
+    }
+
+
+def results_from_json(document: dict) -> list[BenchmarkResult]:
+
+    return [BenchmarkResult(**result) for result in document['results']]
+
+
+def compare_to_baseline(results, baseline, threshold=DEFAULT_THRESHOLD) -> list[Regression]:
+
+    # Results missing from the baseline are new benchmarks, not regressions
+    previous = {(result.name, result.shape, result.users): result for result in baseline}
+    regressions = []
+
+    for result in results:
+        old = previous.get((result.name, result.shape, result.users))
+        if old is None:
+            continue
+        for metric, floor in (('seconds', MIN_SECONDS), ('peak_bytes', MIN_BYTES)):
+            baseline_value = max(getattr(old, metric), floor)
+            current_value = max(getattr(result, metric), floor)
+            if current_value > threshold * baseline_value:
+                regressions.append(Regression(result.name, result.shape, result.users, metric, baseline_value, current_value))
+
+    return regressions
+
+
+def main(argv=None) -> int:
+
+    parser = argparse.ArgumentParser(description="Benchmark the referral network and simulation functions.")
+    parser.add_argument('--shapes', nargs='+', choices=sorted(GENERATORS), default=list(GENERATORS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES))
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='dict')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-simulation', dest='simulation', action='store_false')
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare against the results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    network_class = BACKENDS[args.backend]
+    results = run_benchmarks(args.shapes, args.sizes, network_class, args.repeat, args.seed, args.simulation, log=sys.stdout)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results_to_json(results, network_class), file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = results_from_json(json.load(file))
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression.shape} {regression.users} {regression.name} {regression.metric}: "
+                f"{regression.baseline:.6g} -> {regression.current:.6g} ({regression.ratio:.2f}x)"
+            )
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
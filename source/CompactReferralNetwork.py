@@ -0,0 +1,1010 @@
+# Parts 1, 2 & 3: array-backed backend
+
+import bisect
+import itertools
+import math
+import time
+from array import array
+from collections.abc import Mapping, Sequence
+from source.Ingestion import (
+    ALREADY_REFERRED, BULK_CHUNK_SIZE, CYCLE, MALFORMED, SELF_REFERRAL, IngestionReport, Rejection, parse_referral, read_referrals,
+)
+from source.ReferralNetwork import (
+    BFS, DFS, RANKING_PATCH_LIMIT, AncestorIndex, ReachIndex, ReferralWindow, UniqueReachRanker, _iter_pages, _offset_page, _select_page,
+    _merge_events, _TimeIndex,
+)
+from source.Snapshot import NO_USER, Snapshot, write_snapshot
+
+
+class CompactReferralNetwork:
+
+    def __init__(self):
+
+        # User names are interned to dense integer ids in insertion order
+        self._ids = {}
+        self._names = []
+
+        # The forest is stored as parent / first-child / next-sibling links, with a
+        # last-child array so new referrals are appended in O(1) and keep their order
+        self._parents = array('i')
+        self._first_children = array('i')
+        self._last_children = array('i')
+        self._next_siblings = array('i')
+
+        # Reach counts with queued, not yet applied referrals; see ReferralNetwork
+        self._reach_counts = array('i')
+        self._pending_reach = []
+        self._reach_ranking = None
+        self._reach_index = None
+        self._ancestor_index = None
+        self._unique_reach_ranker = None
+        self._referral_count = 0
+
+        # Ids are positions in every column, so a removed user's id is retired rather than
+        # reused: its name becomes None and it stays behind as a lone root with no reach
+        self._removed_count = 0
+
+        # Union-find pointers to an ancestor (or the user itself) for the cycle check
+        self._tree_roots = array('i')
+
+        # Set when the arrays are read-only views of a memory-mapped snapshot
+        self._read_only = False
+
+        # Write-ahead log that new users and accepted referrals are appended to, if any
+        self._log = None
+
+        # Referral time by candidate id (NaN for roots and untimed referrals), and the
+        # candidate ids sorted by that time; see ReferralNetwork
+        self._referral_times = array('d')
+        self._event_times = array('d')
+        self._event_ids = array('i')
+        self._pending_events = []
+        self._time_index = None
+
+        # Read-only dict-like views, so callers written against ReferralNetwork keep working
+        self.graph = _GraphView(self)
+        self.referrers = _ReferrersView(self)
+        self.reach_counts = _ReachCountsView(self)
+
+    def _intern(self, user):
+
+        user_id = self._ids.get(user)
+        if user_id is None:
+            user_id = len(self._names)
+            self._ids[user] = user_id
+            self._names.append(user)
+            for column in (self._parents, self._first_children, self._last_children, self._next_siblings):
+                column.append(NO_USER)
+            self._reach_counts.append(0)
+            self._tree_roots.append(user_id)
+            self._referral_times.append(math.nan)
+            if self._reach_ranking is not None:
+                self._reach_ranking.append(user_id)
+            self._reach_index = None
+            if self._ancestor_index is not None:
+                self._ancestor_index.add_user(user)
+            if self._log is not None:
+                self._log.append_user(user)
+        return user_id
+
+    # Part 1: Referral Graph
+
+    def add_user(self, user):
+
+        self._check_writable()
+        self._intern(user)
+
+    def add_referral(self, referrer, candidate, timestamp=None):
+
+        self._check_writable()
+        rejection = self._validate_referral(referrer, candidate)
+        if rejection == SELF_REFERRAL:
+            print(f"Error: Users cannot refer themselves ({referrer} -> {candidate})")
+            return False
+        if rejection == ALREADY_REFERRED:
+            print(f"Error: Candidate '{candidate}' has already been referred")
+            return False
+        if rejection == CYCLE:
+            print(f"Error: Adding this referral would create a cycle ({referrer} -> {candidate})")
+            return False
+
+        self._link(self._ids[referrer], self._ids[candidate], time.time() if timestamp is None else timestamp)
+        return True
+
+    def add_referrals(self, referrals):
+
+        # Bulk ingestion; see ReferralNetwork.add_referrals
+        self._check_writable()
+        report = IngestionReport()
+
+        for row, referral in enumerate(referrals, start=1):
+            referral = parse_referral(referral)
+            if referral is None:
+                report.rejected.append(Rejection(row, None, None, MALFORMED))
+                continue
+            referrer, candidate, timestamp = referral
+
+            rejection = self._validate_referral(referrer, candidate)
+            if rejection is not None:
+                report.rejected.append(Rejection(row, referrer, candidate, rejection))
+                continue
+
+            self._link(self._ids[referrer], self._ids[candidate], time.time() if timestamp is None else timestamp)
+            report.accepted += 1
+
+        return report
+
+    def add_referrals_from_file(self, path):
+
+        return self.add_referrals(read_referrals(path))
+
+    # Removing users and moving referrals; see ReferralNetwork
+
+    def remove_user(self, user, promote_referrals=True):
+
+        # See ReferralNetwork.remove_user. The user's id becomes a tombstone, which listings
+        # skip and snapshots and shards leave out by renumbering the remaining ids.
+        self._check_writable()
+        user_id = self._ids.get(user)
+        if user_id is None:
+            print(f"Error: Unknown user '{user}'")
+            return False
+
+        self._sync_reach_counts()
+        referrer_id = self._parents[user_id]
+        child_ids = list(self._iter_children(user_id))
+        ranker = self._unique_reach_ranker
+        if ranker is not None:
+            ranker.touch(user_id)
+            for affected_id in itertools.chain((referrer_id,) if referrer_id != NO_USER else (), child_ids):
+                ranker.touch(affected_id)
+        new_referrer_id = referrer_id if promote_referrals else NO_USER
+
+        if referrer_id != NO_USER:
+            self._replace_child(referrer_id, user_id, child_ids if promote_referrals else [])
+            self._add_upstream_reach(referrer_id, -1 if promote_referrals else -1 - self._reach_counts[user_id])
+            self._referral_count -= 1
+
+        self._remove_referral_time(user_id)
+        for child_id in child_ids:
+            self._parents[child_id] = new_referrer_id
+            if new_referrer_id == NO_USER:
+                self._next_siblings[child_id] = NO_USER
+                self._referral_count -= 1
+                self._remove_referral_time(child_id)
+            self._relink_tree(child_id, new_referrer_id)
+
+        self._remove_ranked_user(user_id)
+        for column in (self._parents, self._first_children, self._last_children, self._next_siblings):
+            column[user_id] = NO_USER
+        self._reach_counts[user_id] = 0
+        self._tree_roots[user_id] = user_id
+        del self._ids[user]
+        self._names[user_id] = None
+        self._removed_count += 1
+        self._reach_index = None
+        self._time_index = None
+        if self._ancestor_index is not None:
+            # The index shares the ids and names, so only its rows need retiring
+            self._ancestor_index.link(user_id, user_id)
+
+        if self._log is not None:
+            self._log.append_removal(user, promote_referrals)
+        return True
+
+    def move_referral(self, candidate, referrer, timestamp=None):
+
+        self._check_writable()
+        candidate_id = self._ids.get(candidate)
+        if candidate_id is None:
+            print(f"Error: Unknown user '{candidate}'")
+            return False
+        if referrer == candidate:
+            print(f"Error: Users cannot refer themselves ({referrer} -> {candidate})")
+            return False
+        referrer_id = self._intern(referrer)
+        if self._is_upstream(candidate_id, referrer_id):
+            print(f"Error: Adding this referral would create a cycle ({referrer} -> {candidate})")
+            return False
+
+        self._sync_reach_counts()
+        timestamp = time.time() if timestamp is None else timestamp
+        size = 1 + self._reach_counts[candidate_id]
+        old_referrer_id = self._parents[candidate_id]
+        if old_referrer_id != NO_USER:
+            self._unlink_child(old_referrer_id, candidate_id)
+            self._add_upstream_reach(old_referrer_id, -size)
+            self._referral_count -= 1
+        self._remove_referral_time(candidate_id)
+
+        self._parents[candidate_id] = referrer_id
+        if self._first_children[referrer_id] == NO_USER:
+            self._first_children[referrer_id] = candidate_id
+        else:
+            self._next_siblings[self._last_children[referrer_id]] = candidate_id
+        self._last_children[referrer_id] = candidate_id
+        self._referral_count += 1
+        self._add_upstream_reach(referrer_id, size)
+        self._add_referral_time(candidate_id, timestamp)
+        self._relink_tree(candidate_id, referrer_id)
+        self._reach_index = None
+        self._time_index = None
+        if self._unique_reach_ranker is not None:
+            self._unique_reach_ranker.touch(candidate_id)
+            if old_referrer_id != NO_USER:
+                self._unique_reach_ranker.touch(old_referrer_id)
+
+        if self._log is not None:
+            self._log.append_move(referrer, candidate, timestamp)
+        return True
+
+    def _is_upstream(self, ancestor_id, user_id):
+
+        while user_id != ancestor_id:
+            if user_id == NO_USER:
+                return False
+            user_id = self._parents[user_id]
+        return True
+
+    def _unlink_child(self, parent_id, child_id):
+
+        self._replace_child(parent_id, child_id, [])
+        self._parents[child_id] = NO_USER
+
+    def _replace_child(self, parent_id, child_id, replacement_ids):
+
+        # Puts replacement_ids, already linked to each other as siblings, in child_id's
+        # place in parent_id's list. The list is singly linked, so the child's predecessor
+        # is found by a walk.
+        previous_id = NO_USER
+        current_id = self._first_children[parent_id]
+        while current_id != child_id:
+            previous_id, current_id = current_id, self._next_siblings[current_id]
+        next_id = self._next_siblings[child_id]
+        if replacement_ids:
+            self._next_siblings[replacement_ids[-1]] = next_id
+            next_id = replacement_ids[0]
+        if previous_id == NO_USER:
+            self._first_children[parent_id] = next_id
+        else:
+            self._next_siblings[previous_id] = next_id
+        if self._last_children[parent_id] == child_id:
+            self._last_children[parent_id] = replacement_ids[-1] if replacement_ids else previous_id
+        self._next_siblings[child_id] = NO_USER
+
+    def _add_upstream_reach(self, user_id, delta):
+
+        while user_id != NO_USER:
+            self._set_reach(user_id, self._reach_counts[user_id] + delta)
+            user_id = self._parents[user_id]
+
+    def _ranking_key(self, user_id):
+
+        return -self._reach_counts[user_id], user_id
+
+    def _set_reach(self, user_id, reach):
+
+        # See ReferralNetwork._set_reach; ids are the insertion order, so they break ties
+        ranking = self._reach_ranking
+        if ranking is None:
+            self._reach_counts[user_id] = reach
+            return
+        del ranking[bisect.bisect_left(ranking, self._ranking_key(user_id), key=self._ranking_key)]
+        self._reach_counts[user_id] = reach
+        ranking.insert(bisect.bisect_left(ranking, self._ranking_key(user_id), key=self._ranking_key), user_id)
+
+    def _remove_ranked_user(self, user_id):
+
+        if self._reach_ranking is not None:
+            del self._reach_ranking[bisect.bisect_left(self._reach_ranking, self._ranking_key(user_id), key=self._ranking_key)]
+
+    def _relink_tree(self, candidate_id, referrer_id):
+
+        # See ReferralNetwork._relink_tree
+        descendant_ids = []
+        level = [candidate_id]
+        while level:
+            level = [child_id for user_id in level for child_id in self._iter_children(user_id)]
+            descendant_ids += level
+        for descendant_id in descendant_ids:
+            self._tree_roots[descendant_id] = candidate_id
+        if referrer_id == NO_USER:
+            referrer_id = candidate_id
+        self._tree_roots[candidate_id] = referrer_id
+
+        index = self._ancestor_index
+        if index is None:
+            return
+        if len(descendant_ids) > len(index) // 4:
+            self._ancestor_index = None
+            return
+        index.link(referrer_id, candidate_id, descendant_ids)
+
+    def _remove_referral_time(self, candidate_id):
+
+        timestamp = self._referral_times[candidate_id]
+        if math.isnan(timestamp):
+            return
+        self._referral_times[candidate_id] = math.nan
+        self._sync_referral_times()
+        position = bisect.bisect_left(self._event_times, timestamp)
+        while self._event_ids[position] != candidate_id:
+            position += 1
+        del self._event_times[position]
+        del self._event_ids[position]
+
+    def _check_writable(self):
+
+        if self._read_only:
+            raise TypeError("This network is a read-only memory-mapped snapshot; load it with use_mmap=False to modify it")
+
+    def _validate_referral(self, referrer, candidate):
+
+        # Constraint 1
+        if referrer == candidate:
+            return SELF_REFERRAL
+
+        # Constraint 2
+        candidate_id = self._ids.get(candidate)
+        if candidate_id is not None and self._parents[candidate_id] != NO_USER:
+            return ALREADY_REFERRED
+
+        referrer_id = self._intern(referrer)
+        candidate_id = self._intern(candidate)
+
+        # Constraint 3
+        if self._creates_cycle(referrer_id, candidate_id):
+            return CYCLE
+
+        return None
+
+    def _link(self, referrer_id, candidate_id, timestamp):
+
+        self._parents[candidate_id] = referrer_id
+        if self._first_children[referrer_id] == NO_USER:
+            self._first_children[referrer_id] = candidate_id
+        else:
+            self._next_siblings[self._last_children[referrer_id]] = candidate_id
+        self._last_children[referrer_id] = candidate_id
+        self._referral_count += 1
+        self._tree_roots[candidate_id] = referrer_id
+        event_position = self._add_referral_time(candidate_id, timestamp)
+        self._reach_index = None
+        if self._ancestor_index is not None:
+            self._extend_ancestor_index(referrer_id, candidate_id)
+        if self._time_index is not None:
+            # See ReferralNetwork._link
+            if self._first_children[candidate_id] != NO_USER:
+                self._time_index = None
+            else:
+                self._time_index.link(referrer_id, candidate_id, event_position)
+        if self._unique_reach_ranker is not None:
+            self._unique_reach_ranker.touch(candidate_id)
+
+        self._pending_reach.append(candidate_id)
+        if len(self._pending_reach) >= BULK_CHUNK_SIZE:
+            self._sync_reach_counts()
+
+        if self._log is not None:
+            self._log.append_referral(self._names[referrer_id], self._names[candidate_id], timestamp)
+
+    def _extend_ancestor_index(self, referrer_id, candidate_id):
+
+        # See ReferralNetwork._extend_ancestor_index
+        index = self._ancestor_index
+        descendant_ids = []
+        level = [candidate_id]
+        while level and len(descendant_ids) <= len(index) // 4:
+            level = [child_id for user_id in level for child_id in self._iter_children(user_id)]
+            descendant_ids += level
+        if len(descendant_ids) > len(index) // 4:
+            self._ancestor_index = None
+            return
+        index.link(referrer_id, candidate_id, descendant_ids)
+
+    def _add_referral_time(self, candidate_id, timestamp):
+
+        if timestamp is None or math.isnan(timestamp):
+            return
+        self._referral_times[candidate_id] = timestamp
+        if self._event_times and timestamp < self._event_times[-1]:
+            self._pending_events.append((timestamp, candidate_id))
+            return
+        self._event_times.append(timestamp)
+        self._event_ids.append(candidate_id)
+        return len(self._event_times) - 1
+
+    def _sync_referral_times(self):
+
+        # See ReferralNetwork._sync_referral_times
+        if not self._pending_events:
+            return
+        events, self._pending_events = self._pending_events, []
+        positions = _merge_events(self._event_times, self._event_ids, events)
+        if self._time_index is not None:
+            self._time_index.merge(positions, [candidate_id for _, candidate_id in events])
+
+    def _replay_referral(self, referrer, candidate, timestamp=None):
+
+        # Applies a logged referral, which was validated before it was logged; reach counts
+        # stay queued as in ReferralNetwork._replay_referral
+        referrer_id = self._ids[referrer]
+        candidate_id = self._ids[candidate]
+        self._parents[candidate_id] = referrer_id
+        if self._first_children[referrer_id] == NO_USER:
+            self._first_children[referrer_id] = candidate_id
+        else:
+            self._next_siblings[self._last_children[referrer_id]] = candidate_id
+        self._last_children[referrer_id] = candidate_id
+        self._referral_count += 1
+        self._tree_roots[candidate_id] = referrer_id
+        self._add_referral_time(candidate_id, timestamp)
+        self._reach_index = None
+        self._ancestor_index = None
+        self._unique_reach_ranker = None
+        self._time_index = None
+        self._pending_reach.append(candidate_id)
+
+    def _sync_reach_counts(self):
+
+        pending_candidate_ids = self._pending_reach
+        if not pending_candidate_ids:
+            return
+        self._pending_reach = []
+
+        # Same per-referral deltas, recount fallback and ranking patches as
+        # ReferralNetwork._sync_reach_counts
+        deltas = [1 + self._reach_counts[candidate_id] for candidate_id in pending_candidate_ids]
+
+        budget = len(self._names)
+        patches = RANKING_PATCH_LIMIT
+        for candidate_id, delta in zip(pending_candidate_ids, deltas):
+            current_id = self._parents[candidate_id]
+            while current_id != NO_USER:
+                if self._reach_ranking is None:
+                    self._reach_counts[current_id] += delta
+                else:
+                    self._set_reach(current_id, self._reach_counts[current_id] + delta)
+                    patches -= 1
+                    if patches < 0:
+                        self._reach_ranking = None
+                budget -= 1
+                current_id = self._parents[current_id]
+
+            if budget < 0:
+                self._rebuild_reach_counts()
+                self._reach_ranking = None
+                break
+
+    def _rebuild_reach_counts(self):
+
+        # Reversed pre-order visits every user after all of its referrals
+        for user_id in reversed(self._get_euler_tour()):
+            self._reach_counts[user_id] = sum(1 + self._reach_counts[child_id] for child_id in self._iter_children(user_id))
+
+    def _creates_cycle(self, referrer_id, candidate_id):
+
+        # The candidate is a root, so it is an ancestor exactly when it is the referrer's root
+        return self._find_root(referrer_id) == candidate_id
+
+    def _find_root(self, user_id):
+
+        tree_roots = self._tree_roots
+        root_id = user_id
+        while tree_roots[root_id] != root_id:
+            root_id = tree_roots[root_id]
+
+        # Path compression
+        while tree_roots[user_id] != root_id:
+            tree_roots[user_id], user_id = root_id, tree_roots[user_id]
+
+        return root_id
+
+    def get_direct_referrals(self, user):
+
+        user_id = self._ids.get(user)
+        if user_id is None:
+            return []
+        return [self._names[child_id] for child_id in self._iter_children(user_id)]
+
+    def get_direct_referrals_view(self, user):
+
+        return _ReferralsView(self, self._ids.get(user, NO_USER))
+
+    def iter_descendants(self, user, order=BFS, max_depth=None):
+
+        # See ReferralNetwork.iter_descendants; the walk runs on ids and only the yielded
+        # users are translated to names
+        if order not in (BFS, DFS):
+            raise ValueError(f"Unknown traversal order: {order!r}, expected {BFS!r} or {DFS!r}")
+        user_id = self._ids.get(user)
+        if user_id is None or max_depth is not None and max_depth < 1:
+            return
+
+        if order == BFS:
+            level = [user_id]
+            depth = 1
+            while level:
+                next_level = []
+                for parent_id in level:
+                    for child_id in self._iter_children(parent_id):
+                        yield self._names[child_id]
+                        if max_depth is None or depth < max_depth:
+                            next_level.append(child_id)
+                level = next_level
+                depth += 1
+            return
+
+        stack = [self._iter_children(user_id)]
+        while stack:
+            for child_id in stack[-1]:
+                yield self._names[child_id]
+                if max_depth is None or len(stack) < max_depth:
+                    stack.append(self._iter_children(child_id))
+                break
+            else:
+                stack.pop()
+
+    @property
+    def reach_index(self):
+
+        if self._reach_index is None:
+            self._sync_reach_counts()
+            order = self._get_euler_tour()
+            entry = array('i', bytes(4 * len(order)))
+            exit = array('i', bytes(4 * len(order)))
+            for position, user_id in enumerate(order):
+                entry[user_id] = position
+                exit[user_id] = position + 1 + self._reach_counts[user_id]
+            self._reach_index = _CompactReachIndex(order, entry, exit, self._ids, self._names)
+        return self._reach_index
+
+    @property
+    def ancestor_index(self):
+
+        if self._ancestor_index is None:
+            parents = array('i', (user_id if parent_id == NO_USER else parent_id for user_id, parent_id in enumerate(self._parents)))
+            self._ancestor_index = AncestorIndex(self._ids, self._names, parents, self._get_euler_tour())
+        return self._ancestor_index
+
+    @property
+    def unique_reach_ranker(self):
+
+        if self._unique_reach_ranker is None:
+            self._unique_reach_ranker = _CompactUniqueReachRanker(self)
+        return self._unique_reach_ranker
+
+    def get_referral_time(self, candidate):
+
+        candidate_id = self._ids.get(candidate)
+        if candidate_id is None or math.isnan(self._referral_times[candidate_id]):
+            return None
+        return self._referral_times[candidate_id]
+
+    def window(self, start, end):
+
+        return ReferralWindow(self._get_time_index(), start, end)
+
+    def _get_time_index(self):
+
+        self._sync_referral_times()
+        if self._time_index is None or self._time_index.outgrown():
+            index = self.reach_index
+            self._time_index = _CompactTimeIndex(self._names, index.entry, index.exit, self._event_times, self._event_ids, self._ids)
+        return self._time_index
+
+    def get_depth(self, user):
+
+        return self.ancestor_index.depth(user)
+
+    def get_ancestor(self, user, k):
+
+        return self.ancestor_index.ancestor(user, k)
+
+    def get_lowest_common_ancestor(self, first, second):
+
+        return self.ancestor_index.common_ancestor(first, second)
+
+    def get_distance(self, first, second):
+
+        return self.ancestor_index.distance(first, second)
+
+    def get_lowest_common_ancestors(self, pairs):
+
+        return self.ancestor_index.common_ancestors(pairs)
+
+    def get_distances(self, pairs):
+
+        return self.ancestor_index.distances(pairs)
+
+    def is_downstream(self, user, ancestor):
+
+        return self.reach_index.is_downstream(user, ancestor)
+
+    def iter_reach(self, user):
+
+        return self.reach_index.iter_reach(user)
+
+    # Snapshots
+
+    def save(self, path):
+
+        ids, columns = self._get_columns()
+        referred_ids = [user_id for user_id, parent_id in enumerate(self._parents) if parent_id != NO_USER]
+        referral_times = array('d', map(self._referral_times.__getitem__, referred_ids))
+        if ids is not self._ids:
+            referred_ids = [ids[self._names[user_id]] for user_id in referred_ids]
+        write_snapshot(path, list(ids) if ids is not self._ids else self._names, columns, referred_ids, referral_times)
+
+    def _get_columns(self):
+
+        self._sync_reach_counts()
+        columns = {
+            'parents': self._parents,
+            'first_children': self._first_children,
+            'last_children': self._last_children,
+            'next_siblings': self._next_siblings,
+        }
+        if not self._removed_count:
+            return self._ids, dict(columns, reach_counts=self._reach_counts)
+
+        # Tombstones are left out and the remaining ids renumbered densely, in order
+        kept_ids = self._get_user_ids()
+        new_ids = array('i', [NO_USER]) * len(self._names)
+        for new_id, user_id in enumerate(kept_ids):
+            new_ids[user_id] = new_id
+        new_ids.append(NO_USER)  # new_ids[NO_USER] stays NO_USER
+        columns = {name: array('i', (new_ids[column[user_id]] for user_id in kept_ids)) for name, column in columns.items()}
+        columns['reach_counts'] = array('i', map(self._reach_counts.__getitem__, kept_ids))
+        return {self._names[user_id]: new_id for new_id, user_id in enumerate(kept_ids)}, columns
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+
+        # With use_mmap the network reads straight from the shared, read-only pages of the
+        # file: nothing is decoded up front, and names are looked up in the on-disk hash table
+        snapshot = Snapshot(path, use_mmap=use_mmap)
+        network = cls()
+        network._parents = snapshot.parents
+        network._first_children = snapshot.first_children
+        network._last_children = snapshot.last_children
+        network._next_siblings = snapshot.next_siblings
+        network._reach_counts = snapshot.reach_counts
+        network._referral_count = snapshot.referral_count
+
+        if use_mmap:
+            network._snapshot = snapshot
+            network._names = snapshot.names
+            network._ids = snapshot.ids
+            network._tree_roots = None
+            network._read_only = True
+        else:
+            network._names = list(snapshot.names)
+            network._ids = {user: user_id for user_id, user in enumerate(network._names)}
+            # Parent links are valid union-find pointers: each one points at an ancestor
+            network._tree_roots = array('i', (user_id if parent_id == NO_USER else parent_id for user_id, parent_id in enumerate(snapshot.parents)))
+
+        network._referral_times = array('d', [math.nan]) * len(snapshot.parents)
+        if snapshot.referral_times is not None:
+            for candidate_id, timestamp in zip(snapshot.referral_order, snapshot.referral_times):
+                network._referral_times[candidate_id] = timestamp
+            # Stable, so equal times keep their order in the snapshot
+            event_ids = sorted((candidate_id for candidate_id in snapshot.referral_order if not math.isnan(network._referral_times[candidate_id])), key=network._referral_times.__getitem__)
+            network._event_ids = array('i', event_ids)
+            network._event_times = array('d', map(network._referral_times.__getitem__, event_ids))
+
+        return network
+
+    def _get_user_ids(self):
+
+        # Ids of the users in the network, in insertion order, without tombstones. Paging goes over
+        # them more than once, so this is a sequence rather than a generator
+        if not self._removed_count:
+            return range(len(self._names))
+        return [user_id for user_id, user in enumerate(self._names) if user is not None]
+
+    def _iter_children(self, user_id):
+
+        child_id = self._first_children[user_id]
+        while child_id != NO_USER:
+            yield child_id
+            child_id = self._next_siblings[child_id]
+
+    #  Part 2: Full Network Reach
+
+    def get_total_referral_count(self, user):
+
+        self._sync_reach_counts()
+        user_id = self._ids.get(user)
+        if user_id is None:
+            return 0
+        return self._reach_counts[user_id]
+
+    def get_top_k_referrers(self, k):
+
+        if k <= 0:
+            return []
+
+        self._sync_reach_counts()
+        if self._reach_ranking is None:
+            # sorted() is stable, so users with equal reach keep their insertion order
+            self._reach_ranking = sorted(self._get_user_ids(), key=self._reach_counts.__getitem__, reverse=True)
+
+        return [self._names[user_id] for user_id in self._reach_ranking[:k]]
+
+    def iter_top_referrers(self):
+
+        self._sync_reach_counts()
+        if self._reach_ranking is not None:
+            ranked_ids = iter(self._reach_ranking)
+        else:
+            ranked_ids = _iter_pages(self._get_user_ids(), self._reach_counts.__getitem__)
+        return map(self._names.__getitem__, ranked_ids)
+
+    def get_top_referrers_page(self, limit, cursor=None):
+
+        self._sync_reach_counts()
+        return self._named_page(_select_page(self._get_user_ids(), self._reach_counts.__getitem__, limit, cursor))
+
+    def _named_page(self, page):
+
+        return page._replace(items=[self._names[user_id] for user_id in page.items])
+
+    # Part 3: Identify Influencers
+
+    def _get_euler_tour(self):
+
+        # Pre-order walk over the sibling links; no stack is needed because every
+        # user knows its parent. Roots are visited in insertion order.
+        order = array('i')
+        for root_id in range(len(self._names)):
+            if self._parents[root_id] != NO_USER:
+                continue
+
+            current_id = root_id
+            while True:
+                order.append(current_id)
+                if self._first_children[current_id] != NO_USER:
+                    current_id = self._first_children[current_id]
+                    continue
+
+                # Climb until an unvisited sibling is found or we are back at the root
+                while current_id != root_id and self._next_siblings[current_id] == NO_USER:
+                    current_id = self._parents[current_id]
+                if current_id == root_id:
+                    break
+                current_id = self._next_siblings[current_id]
+
+        return order
+
+    #  Metric 1: Unique Reach Expansion
+    def get_influencers_by_unique_reach(self, k=None):
+
+        return list(itertools.islice(self.iter_influencers_by_unique_reach(), k))
+
+    def iter_influencers_by_unique_reach(self):
+
+        # The roots with referrals by reach, then id; see ReferralNetwork
+        self._sync_reach_counts()
+        reach_counts = self._reach_counts
+        roots = [user_id for user_id, parent_id in enumerate(self._parents) if parent_id == NO_USER and reach_counts[user_id]]
+        roots.sort(key=reach_counts.__getitem__, reverse=True)
+        return map(self._names.__getitem__, roots)
+
+    def get_influencers_by_unique_reach_page(self, limit, cursor=None):
+
+        return _offset_page(self.iter_influencers_by_unique_reach(), limit, cursor)
+
+    # Metric 2: Flow Centrality
+    def get_influencers_by_flow_centrality(self):
+
+        flow_scores = self._get_flow_scores()
+        ranked_ids = sorted(self._get_user_ids(), key=flow_scores.__getitem__, reverse=True)
+        return [self._names[user_id] for user_id in ranked_ids]
+
+    def iter_influencers_by_flow_centrality(self):
+
+        flow_scores = self._get_flow_scores()
+        return map(self._names.__getitem__, _iter_pages(self._get_user_ids(), flow_scores.__getitem__))
+
+    def get_influencers_by_flow_centrality_page(self, limit, cursor=None):
+
+        flow_scores = self._get_flow_scores()
+        return self._named_page(_select_page(self._get_user_ids(), flow_scores.__getitem__, limit, cursor))
+
+    def _get_flow_scores(self):
+
+        self._sync_reach_counts()
+
+        # Parents precede their referrals in the Euler tour, so depths fill in one pass
+        # (without building the ancestor index, which every later insert would maintain)
+        depths = array('i', bytes(4 * len(self._names)))
+        for user_id in self._get_euler_tour():
+            parent_id = self._parents[user_id]
+            if parent_id != NO_USER:
+                depths[user_id] = depths[parent_id] + 1
+
+        return [depth * reach for depth, reach in zip(depths, self._reach_counts)]
+
+
+class _CompactReachIndex(ReachIndex):
+
+    # entry and exit are indexed by user id and order holds ids; users are translated
+    # at the edges
+
+    def __init__(self, order, entry, exit, ids, names):
+
+        super().__init__(order, entry, exit)
+        self._ids = ids
+        self._names = names
+
+    def _key(self, user):
+
+        return self._ids.get(user)
+
+    def _user(self, key):
+
+        return self._names[key]
+
+
+class _CompactTimeIndex(_TimeIndex):
+
+    # Entry and exit are already arrays by id, so ids double as insertion positions. The
+    # names are the network's own, so new users need no registration.
+
+    def __init__(self, names, entries, exits, event_times, event_ids, ids):
+
+        super().__init__(names, entries, exits, event_times, event_ids, entries, exits)
+        self._ids = ids
+
+    def _key(self, user):
+
+        return self._ids.get(user)
+
+    def _tour_entry(self, key):
+
+        return self.entries[key] if key < len(self.entries) else None
+
+    def _position(self, key):
+
+        return key
+
+
+class _CompactUniqueReachRanker(UniqueReachRanker):
+
+    # The ranker on ids, which are already the insertion order; removed ids are tombstones
+
+    def _number_users(self):
+
+        pass
+
+    def _iter_roots(self):
+
+        return (user_id for user_id, parent_id in enumerate(self._network._parents) if parent_id == NO_USER)
+
+    def _is_known(self, key):
+
+        return self._network._names[key] is not None
+
+    def _forget(self, key):
+
+        pass
+
+    def _is_root(self, key):
+
+        return self._network._parents[key] == NO_USER
+
+    def _ordinal(self, key):
+
+        return key
+
+    def _user(self, key):
+
+        return self._network._names[key]
+
+
+class _ReferralsView(Sequence):
+
+    # Read-only, live view of one user's referrals along the sibling links. Length and
+    # indexing walk the links, so iterate where possible.
+
+    def __init__(self, network, user_id):
+
+        self._network = network
+        self._user_id = user_id
+
+    def __iter__(self):
+
+        if self._user_id == NO_USER:
+            return iter(())
+        return map(self._network._names.__getitem__, self._network._iter_children(self._user_id))
+
+    def __len__(self):
+
+        return sum(1 for _ in self)
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice) or index < 0:
+            return list(self)[index]
+        for position, user in enumerate(self):
+            if position == index:
+                return user
+        raise IndexError(index)
+
+    def __repr__(self):
+
+        return f'ReferralsView({list(self)!r})'
+
+
+class _GraphView(Mapping):
+
+    def __init__(self, network):
+
+        self._network = network
+
+    def __getitem__(self, user):
+
+        user_id = self._network._ids[user]
+        return [self._network._names[child_id] for child_id in self._network._iter_children(user_id)]
+
+    def __iter__(self):
+
+        return map(self._network._names.__getitem__, self._network._get_user_ids())
+
+    def __len__(self):
+
+        return len(self._network._names) - self._network._removed_count
+
+    def __contains__(self, user):
+
+        return user in self._network._ids
+
+
+class _ReferrersView(Mapping):
+
+    def __init__(self, network):
+
+        self._network = network
+
+    def __getitem__(self, user):
+
+        parent_id = self._network._parents[self._network._ids[user]]
+        if parent_id == NO_USER:
+            raise KeyError(user)
+        return self._network._names[parent_id]
+
+    def __iter__(self):
+
+        for user_id, parent_id in enumerate(self._network._parents):
+            if parent_id != NO_USER:
+                yield self._network._names[user_id]
+
+    def __len__(self):
+
+        return self._network._referral_count
+
+    def __contains__(self, user):
+
+        user_id = self._network._ids.get(user)
+        return user_id is not None and self._network._parents[user_id] != NO_USER
+
+
+class _ReachCountsView(Mapping):
+
+    def __init__(self, network):
+
+        self._network = network
+
+    def __getitem__(self, user):
+
+        self._network._sync_reach_counts()
+        return self._network._reach_counts[self._network._ids[user]]
+
+    def __iter__(self):
+
+        return map(self._network._names.__getitem__, self._network._get_user_ids())
+
+    def __len__(self):
+
+        return len(self._network._names) - self._network._removed_count
@@ -0,0 +1,80 @@
+# Synthetic referral networks for tests and benchmarks
+#
+# Every generator yields (referrer, candidate) pairs with integer user names, in an order
+# in which they are all accepted: each candidate is new and its referrer already exists,
+# so the result is always a forest. Randomised generators take a seed and are
+# reproducible across runs and platforms.
+
+import random
+
+from source.ReferralNetwork import ReferralNetwork
+
+
+def deep_chain(users: int):
+
+    # 0 -> 1 -> 2 -> ... -> users - 1, the worst case for anything recursive
+    for user in range(users - 1):
+        yield user, user + 1
+
+
+def wide_star(users: int, hubs: int = 1):
+
+    # hubs roots, every other user referred directly by one of them in turn
+    for user in range(hubs, users):
+        yield user % hubs, user
+
+
+def preferential_attachment_forest(users: int, seed: int = 0, root_probability: float = 0.01):
+
+    # Each new user is a new root with probability root_probability, otherwise it is
+    # referred by an existing user picked with probability proportional to 1 + the number
+    # of referrals that user has made, giving the heavy-tailed fan-out of real programs
+    rng = random.Random(seed)
+
+    # One entry per user plus one per referral made, sampled uniformly
+    weighted_referrers = [0]
+    for user in range(1, users):
+        if rng.random() >= root_probability:
+            referrer = weighted_referrers[rng.randrange(len(weighted_referrers))]
+            yield referrer, user
+            weighted_referrers.append(referrer)
+        weighted_referrers.append(user)
+
+
+def campaign_bursts(users: int, campaigns: int = 20, seed: int = 0, ambassadors: int = 10, recruit_share: float = 0.3):
+
+    # Users join in campaign-shaped bursts. Each campaign picks a few ambassadors among the
+    # existing users, who make most of its referrals; the rest come from people recruited
+    # earlier in the same campaign, so every burst is a wide, shallow fan-out
+    rng = random.Random(seed)
+    campaigns = max(1, min(campaigns, users))
+    next_user = 1
+
+    for campaign in range(campaigns):
+        campaign_end = 1 + (users - 1) * (campaign + 1) // campaigns
+        campaign_ambassadors = [rng.randrange(next_user) for _ in range(ambassadors)]
+        recruits = []
+
+        while next_user < campaign_end:
+            if recruits and rng.random() < recruit_share:
+                referrer = recruits[rng.randrange(len(recruits))]
+            else:
+                referrer = campaign_ambassadors[rng.randrange(len(campaign_ambassadors))]
+            yield referrer, next_user
+            recruits.append(next_user)
+            next_user += 1
+
+
+GENERATORS = {
+    'deep_chain': deep_chain,
+    'wide_star': wide_star,
+    'preferential_attachment': preferential_attachment_forest,
+    'campaign_bursts': campaign_bursts,
+}
+
+
+def build_network(referrals, network_class=ReferralNetwork):
+
+    network = network_class()
+    network.add_referrals(referrals)
+    return network
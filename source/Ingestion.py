@@ -0,0 +1,111 @@
+# Bulk referral ingestion: input readers and the rejection report
+
+import csv
+import json
+from dataclasses import dataclass, field
+from typing import NamedTuple
+
+# Reasons a referral is rejected, one per constraint
+SELF_REFERRAL = "self_referral"
+ALREADY_REFERRED = "already_referred"
+CYCLE = "cycle"
+# A row the reader could not parse: too few cells, bad JSON, a missing key or a bad timestamp
+MALFORMED = "malformed"
+
+# Accepted referrals are folded into the reach counts in chunks of this size
+BULK_CHUNK_SIZE = 100_000
+
+
+class Rejection(NamedTuple):
+
+    row: int
+    referrer: object
+    candidate: object
+    reason: str
+
+
+class MalformedRow(NamedTuple):
+
+    # Yielded by the readers in place of a row they could not parse, so that one corrupt
+    # line is reported as a rejection instead of aborting the whole load
+    content: object
+
+
+@dataclass
+class IngestionReport:
+
+    accepted: int = 0
+    rejected: list[Rejection] = field(default_factory=list)
+
+    @property
+    def total(self) -> int:
+
+        return self.accepted + len(self.rejected)
+
+
+def parse_referral(referral):
+
+    # Splits a row into (referrer, candidate, timestamp), or returns None when it is malformed
+    if isinstance(referral, MalformedRow):
+        return None
+    try:
+        if len(referral) == 2:
+            referrer, candidate = referral
+            return referrer, candidate, None
+        referrer, candidate, timestamp = referral
+    except (TypeError, ValueError):
+        return None
+    return referrer, candidate, timestamp
+
+
+def read_referrals_csv(path: str):
+
+    # Streams (referrer, candidate) rows, or (referrer, candidate, timestamp) when a third
+    # column holds the time of the referral; an optional "referrer,candidate[,timestamp]"
+    # header is skipped
+    with open(path, newline='') as file:
+        for row_number, row in enumerate(csv.reader(file), start=1):
+            if row_number == 1 and [cell.strip().lower() for cell in row] in (['referrer', 'candidate'], ['referrer', 'candidate', 'timestamp']):
+                continue
+            if not row:
+                continue
+            try:
+                if len(row) > 2 and row[2].strip():
+                    yield row[0], row[1], float(row[2])
+                else:
+                    yield row[0], row[1]
+            except (IndexError, ValueError):
+                yield MalformedRow(row)
+
+
+def read_referrals_jsonl(path: str):
+
+    # Each line is either {"referrer": ..., "candidate": ...} or a [referrer, candidate] pair,
+    # optionally with a "timestamp" key or a third element
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    if record.get('timestamp') is not None:
+                        referral = record['referrer'], record['candidate'], float(record['timestamp'])
+                    else:
+                        referral = record['referrer'], record['candidate']
+                elif len(record) > 2 and record[2] is not None:
+                    referral = record[0], record[1], float(record[2])
+                else:
+                    referral = record[0], record[1]
+            except (IndexError, KeyError, TypeError, ValueError):
+                referral = MalformedRow(line.rstrip('\n'))
+            yield referral
+
+
+def read_referrals(path: str):
+
+    if path.endswith('.csv'):
+        return read_referrals_csv(path)
+    if path.endswith('.jsonl'):
+        return read_referrals_jsonl(path)
+    raise ValueError(f"Unsupported referral file format: {path}")
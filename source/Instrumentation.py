@@ -0,0 +1,256 @@
+# Optional instrumentation for the network, simulation and optimization hot paths
+#
+# Disabled by default. Instrumented methods are then the plain functions, instrumented
+# module functions pay one attribute check per call, and traversal counters are only
+# reported when enabled:
+#
+#   from source.Instrumentation import instrumentation
+#   instrumentation.enable()
+#   ...
+#   print(instrumentation.to_prometheus())
+#
+#   with instrumentation.profile({'ReferralNetwork.get_influencers_by_unique_reach'}) as profile:
+#       ...
+#   print(profile.report())
+
+import bisect
+import cProfile
+import contextlib
+import functools
+import io
+import pstats
+import re
+import time
+
+# Histogram bucket upper bounds; values above the last bucket only count towards +Inf
+LATENCY_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1.0, 10.0)
+COUNT_BUCKETS = tuple(4 ** exponent for exponent in range(13))
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+
+        # Cumulative counts per upper bound, as in Prometheus
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': cumulative}
+
+
+class _ProfileSession:
+
+    # cProfile around either the whole block or only the selected instrumented calls
+
+    def __init__(self, operations):
+
+        self.operations = operations
+        self.profiler = cProfile.Profile()
+        self._depth = 0
+
+    def start(self):
+
+        if self._depth == 0:
+            self.profiler.enable()
+        self._depth += 1
+
+    def stop(self):
+
+        self._depth -= 1
+        if self._depth == 0:
+            self.profiler.disable()
+
+    def stats(self) -> pstats.Stats:
+
+        return pstats.Stats(self.profiler)
+
+    def report(self, sort: str = 'cumulative', limit: int = 20) -> str:
+
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+class _InstrumentedMethod:
+
+    def __init__(self, instrumentation, operation, function):
+
+        self.instrumentation = instrumentation
+        self.operation = operation
+        self.function = function
+
+    def __set_name__(self, owner, name):
+
+        instrumentation, operation, function = self.instrumentation, self.operation, self.function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return instrumentation._call(operation, function, args, kwargs)
+
+        instrumentation._methods.append((owner, name, function, wrapper))
+        setattr(owner, name, wrapper if instrumentation.enabled else function)
+
+
+class Instrumentation:
+
+    def __init__(self):
+
+        self._enabled = False
+        self.counters = {}
+        self.histograms = {}
+        self._profile = None
+        # (class, attribute name, plain function, instrumented function) per method
+        self._methods = []
+
+    @property
+    def enabled(self) -> bool:
+
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled: bool) -> None:
+
+        self._enabled = enabled
+        for owner, name, function, wrapper in self._methods:
+            setattr(owner, name, wrapper if enabled else function)
+
+    def enable(self) -> None:
+
+        self.enabled = True
+
+    def disable(self) -> None:
+
+        self.enabled = False
+
+    def reset(self) -> None:
+
+        self.counters.clear()
+        self.histograms.clear()
+
+    def increment(self, name: str, amount: int = 1) -> None:
+
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float, buckets=COUNT_BUCKETS) -> None:
+
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+    def timed(self, operation: str):
+
+        # Decorator counting calls to operation and recording their latency
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                return self._call(operation, function, args, kwargs)
+            return wrapper
+        return decorator
+
+    def timed_method(self, operation: str):
+
+        # Like timed, for methods defined in a class body. The class keeps the plain
+        # function while instrumentation is disabled, so disabled calls cost nothing;
+        # enabling swaps the instrumented version in.
+        def decorator(function):
+            return _InstrumentedMethod(self, operation, function)
+        return decorator
+
+    def _call(self, operation, function, args, kwargs):
+
+        self.increment(f'{operation}.calls')
+
+        # A session over the whole block is already running
+        profile = self._profile
+        if profile is not None and (profile.operations is None or operation not in profile.operations):
+            profile = None
+
+        if profile is not None:
+            profile.start()
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.observe(f'{operation}.seconds', time.perf_counter() - start, LATENCY_BUCKETS)
+            if profile is not None:
+                profile.stop()
+
+    @contextlib.contextmanager
+    def profile(self, operations=None):
+
+        # Enables instrumentation for the block and runs cProfile around the given
+        # operations (instrumented names such as 'simulate'), or the whole block if None
+        if self._profile is not None:
+            raise RuntimeError("A profile session is already active")
+
+        session = _ProfileSession(None if operations is None else set(operations))
+        was_enabled = self.enabled
+        self.enabled = True
+        self._profile = session
+        if operations is None:
+            session.start()
+        try:
+            yield session
+        finally:
+            if operations is None:
+                session.stop()
+            self._profile = None
+            self.enabled = was_enabled
+
+    def to_dict(self) -> dict:
+
+        return {
+            'counters': dict(self.counters),
+            'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+        }
+
+    def to_prometheus(self, prefix: str = 'referrals_') -> str:
+
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            metric = _metric_name(prefix, name) + '_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+
+        for name, histogram in sorted(self.histograms.items()):
+            metric = _metric_name(prefix, name)
+            lines.append(f'# TYPE {metric} histogram')
+            for bound, count in histogram.to_dict()['buckets']:
+                lines.append(f'{metric}_bucket{{le="{_format_bound(bound)}"}} {count}')
+            lines.append(f'{metric}_sum {histogram.sum}')
+            lines.append(f'{metric}_count {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(prefix, name):
+
+    # ReferralNetwork.add_referral.seconds -> referrals_referral_network_add_referral_seconds
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name)
+    return re.sub(r'[^a-zA-Z0-9_]', '_', prefix + name).lower()
+
+
+def _format_bound(bound):
+
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+instrumentation = Instrumentation()
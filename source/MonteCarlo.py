@@ -0,0 +1,124 @@
+# Part 4: Stochastic Network Growth Simulation
+#
+# Monte Carlo version of simulate(): instead of every active referrer making exactly p
+# referrals a day, each day's referrals are drawn at random, Binomial(active, p) for
+# p <= 1 and Poisson(active * p) above that. Cohorts still retire a fixed number of days
+# after they are created, as in the deterministic model. Once a trajectory has more than
+# EXACT_DRAW_LIMIT active referrers, its draws switch to the normal approximation of the
+# same distribution, so counts grow in float64 as far as simulate() does.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from source.Simulation import SimulationConfig, _cohort_lifetime, _resolve_config, np
+
+# Trajectories simulated per task. The random streams are tied to tasks rather than to
+# workers, so results only depend on the seed, never on the number of processes.
+TRAJECTORIES_PER_TASK = 256
+
+# Largest active count drawn exactly. Integer draws stay exact in float64 below 2 ** 53;
+# past this the normal approximation is indistinguishable from them.
+EXACT_DRAW_LIMIT = 2 ** 40
+
+
+@dataclass
+class MonteCarloResult:
+
+    mean: "np.ndarray"
+    percentiles: dict
+    # Day each trajectory reached target_total, or -1 if it did not within the horizon
+    days_to_target: "np.ndarray | None" = None
+
+
+def simulate_monte_carlo(
+    p: float,
+    days: int,
+    trajectories: int = 1000,
+    target_total: float | None = None,
+    seed: int | None = None,
+    workers: int | None = None,
+    percentiles: tuple = (5, 50, 95),
+    config: SimulationConfig | None = None,
+) -> MonteCarloResult:
+
+    if np is None:
+        raise ImportError("simulate_monte_carlo requires NumPy")
+
+    config = _resolve_config(config)
+    if config.initial_referrers != int(config.initial_referrers) or config.initial_referrers < 0:
+        raise ValueError(f"simulate_monte_carlo needs a whole number of initial referrers, got {config.initial_referrers}")
+    days = max(days, 0)
+    tasks = []
+    seeds = np.random.SeedSequence(seed).spawn((trajectories + TRAJECTORIES_PER_TASK - 1) // TRAJECTORIES_PER_TASK)
+    for task, task_seed in enumerate(seeds):
+        size = min(TRAJECTORIES_PER_TASK, trajectories - task * TRAJECTORIES_PER_TASK)
+        tasks.append((p, days, size, task_seed, config))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        chunks = [_simulate_trajectories(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            chunks = list(executor.map(_simulate_trajectories, *zip(*tasks)))
+
+    totals = np.concatenate(chunks) if chunks else np.zeros((0, days))
+
+    result = MonteCarloResult(
+        mean=totals.mean(axis=0) if trajectories else np.zeros(days),
+        percentiles={q: np.percentile(totals, q, axis=0) if trajectories else np.zeros(days) for q in percentiles},
+    )
+
+    if target_total is not None:
+        if target_total <= 0:
+            result.days_to_target = np.zeros(len(totals), dtype=int)
+        else:
+            reached = totals >= target_total
+            result.days_to_target = np.where(reached.any(axis=1), reached.argmax(axis=1) + 1, -1)
+
+    return result
+
+
+def _simulate_trajectories(p: float, days: int, trajectories: int, seed, config: SimulationConfig) -> "np.ndarray":
+
+    # Same ring-buffer cohort engine as simulate(), run for a block of independent
+    # trajectories at once. Cohort sizes are whole numbers held in float64.
+    rng = np.random.default_rng(seed)
+    cumulative_totals = np.zeros((trajectories, days))
+    if p <= 0 or days == 0:
+        return cumulative_totals
+
+    cohorts = np.zeros((trajectories, _cohort_lifetime(p, days + 1, config.referral_capacity)))
+    cohorts[:, 0] = config.initial_referrers
+    total_active_referrers = np.full(trajectories, float(config.initial_referrers))
+    cumulative_referrals = np.zeros(trajectories)
+
+    # Float overflow is expected on long horizons at high p and ends in inf or nan, as in simulate()
+    with np.errstate(over='ignore', invalid='ignore'):
+        for day in range(1, days + 1):
+            new_referrals_today = _draw_referrals(rng, total_active_referrers, p)
+            cumulative_referrals += new_referrals_today
+            cumulative_totals[:, day - 1] = cumulative_referrals
+
+            slot = day % cohorts.shape[1]
+            total_active_referrers -= cohorts[:, slot]
+            cohorts[:, slot] = new_referrals_today
+            total_active_referrers += new_referrals_today
+
+    return cumulative_totals
+
+
+def _draw_referrals(rng, active_referrers, p: float) -> "np.ndarray":
+
+    # Binomial(active, p) for p <= 1 and Poisson(active * p) above, exactly while the
+    # counts fit the integer samplers and by their normal approximation past that
+    large = ~(active_referrers <= EXACT_DRAW_LIMIT)
+    exact = np.where(large, 0, active_referrers).astype(np.int64)
+    draws = (rng.binomial(exact, p) if p <= 1 else rng.poisson(exact * p)).astype(np.float64)
+    if large.any():
+        mean = active_referrers[large] * p
+        variance = mean * (1 - p) if p <= 1 else mean
+        # Counts that overflow to infinity stay infinite, as in simulate()
+        approximate = np.where(np.isinf(mean), mean, np.rint(mean + np.sqrt(variance) * rng.standard_normal(len(mean))))
+        draws[large] = np.maximum(approximate, 0)
+    return draws
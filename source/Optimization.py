@@ -1,17 +1,174 @@
 # Part 5: Referral Bonus Optimization
 
+import bisect
+import functools
 import math
-from source.Simulation import days_to_target
+from source.Instrumentation import instrumentation
+from source.Simulation import SimulationConfig, _CohortEngine, _resolve_config, days_to_target, growth_curve_cache, np
 
 # A reasonable upper bound for the bonus search space.
 # We assume no bonus will ever need to be higher than this.
 MAX_BONUS_SEARCH_RANGE = 5000.0
 
-def min_bonus_for_target(days: int, target_hires: int, adoption_prob_func: callable, eps: float = 0.01) -> int | None:
+# Inverses registered for adoption functions, keyed by the function itself. An inverse
+# maps p to the smallest bonus whose adoption probability is at least p (math.inf if none).
+_adoption_inverses = {}
+
+
+def register_adoption_inverse(adoption_prob_func: callable, inverse: callable) -> None:
+
+    _adoption_inverses[adoption_prob_func] = inverse
+
+
+def register_adoption_table(adoption_prob_func: callable, bonuses, probabilities) -> None:
+
+    # Registers a monotone tabulation of the adoption function, inverted by linear
+    # interpolation between the tabulated points
+    bonuses, probabilities = list(bonuses), list(probabilities)
+    if len(bonuses) != len(probabilities) or not bonuses:
+        raise ValueError("An adoption table needs the same, non-zero number of bonuses and probabilities")
+    if any(b2 < b1 for b1, b2 in zip(bonuses, bonuses[1:])) or any(p2 < p1 for p1, p2 in zip(probabilities, probabilities[1:])):
+        raise ValueError("An adoption table must be non-decreasing in both bonus and probability")
+
+    def inverse(p):
+        index = bisect.bisect_left(probabilities, p)
+        if index == len(probabilities):
+            return math.inf
+        if index == 0 or probabilities[index] == p:
+            return bonuses[index]
+        p_low, p_high = probabilities[index - 1], probabilities[index]
+        return bonuses[index - 1] + (bonuses[index] - bonuses[index - 1]) * (p - p_low) / (p_high - p_low)
+
+    register_adoption_inverse(adoption_prob_func, inverse)
+
+
+def unregister_adoption_inverse(adoption_prob_func: callable) -> None:
+
+    _adoption_inverses.pop(adoption_prob_func, None)
+
+
+@instrumentation.timed('min_p_for_target')
+def min_p_for_target(days: int, target_hires: int, config: SimulationConfig | None = None, p_tol: float = 1e-9) -> float | None:
+
+    # Smallest adoption probability, to a relative tolerance of p_tol, that reaches
+    # target_hires within days, or None if none does. Results are memoized per query.
+    if target_hires <= 0:
+        return 0.0
+    return _min_p_for_target(days, target_hires, _resolve_config(config), p_tol)
+
+
+@functools.lru_cache(maxsize=4096)
+def _min_p_for_target(days: int, target_hires: int, config: SimulationConfig, p_tol: float) -> float | None:
+
+    days = min(days, config.max_simulation_days)
+    if days <= 0 or config.initial_referrers < 1:
+        return None
+
+    # The total after `days` grows monotonically and roughly geometrically with p, so the
+    # root of log(total / target) over log(p) is found by false position (Illinois
+    # variant), which needs far fewer simulations than bisecting p. Every simulation stops
+    # once the total is well past the target, which also keeps it from overflowing.
+    cap = target_hires * 1e3
+
+    simulations = 0
+
+    def evaluate(p):
+        nonlocal simulations
+        simulations += 1
+        engine = _CohortEngine(p, days, config)
+        total = 0.0
+        while engine.day < days and not engine.exhausted and total < cap:
+            total = engine.step()
+        return total >= target_hires, math.log(max(total, 1e-300) / target_hires)
+
+    # The initial referrers alone reach the target on day 1 once p is large enough
+    high_p = target_hires / config.initial_referrers
+    reached, high_error = evaluate(high_p)
+    while not reached:
+        high_p *= 2
+        reached, high_error = evaluate(high_p)
+
+    low_p = high_p
+    while reached:
+        low_p /= 1e3
+        reached, low_error = evaluate(low_p)
+
+    low_x, high_x = math.log(low_p), math.log(high_p)
+    tolerance = -math.log1p(-p_tol)
+    moved = 0
+    slow_steps = 0
+    while high_x - low_x > tolerance:
+        width = high_x - low_x
+        if slow_steps >= 3:
+            # Discontinuities (cohort lifetimes jump with p) can stall the interpolation
+            x = (low_x + high_x) / 2
+            slow_steps = 0
+        else:
+            x = (low_x * high_error - high_x * low_error) / (high_error - low_error)
+            # Aim just past the estimate so the end that did not move last gets close too
+            x += tolerance / 2 * moved
+            x = min(max(x, low_x + tolerance / 2), high_x - tolerance / 2)
+
+        reached, error = evaluate(math.exp(x))
+        if reached:
+            high_x, high_error = x, error
+            if moved == -1:
+                low_error /= 2
+            moved = -1
+        else:
+            low_x, low_error = x, error
+            if moved == 1:
+                high_error /= 2
+            moved = 1
+
+        slow_steps = slow_steps + 1 if high_x - low_x > width / 2 else 0
+
+    if instrumentation.enabled:
+        instrumentation.observe('min_p_for_target.simulations', simulations)
+    return math.exp(high_x)
+
+
+def _min_bonus_from_inverse(days: int, target_hires: int, inverse: callable, eps: float, config: SimulationConfig | None) -> int | None:
+
+    p = min_p_for_target(days, target_hires, config)
+    threshold_bonus = math.inf if p is None else inverse(p)
+
+    # Replays the bisection of min_bonus_for_target with "bonus works" known to mean
+    # bonus >= threshold_bonus, so the result rounds exactly as the search would
+    low_bonus = 0.0
+    high_bonus = MAX_BONUS_SEARCH_RANGE
+    min_working_bonus = float('inf')
+
+    while high_bonus - low_bonus > eps:
+        mid_bonus = (low_bonus + high_bonus) / 2
+        if mid_bonus >= threshold_bonus:
+            min_working_bonus = mid_bonus
+            high_bonus = mid_bonus
+        else:
+            low_bonus = mid_bonus
+
+    if min_working_bonus == float('inf'):
+        if MAX_BONUS_SEARCH_RANGE < threshold_bonus:
+            return None
+        min_working_bonus = MAX_BONUS_SEARCH_RANGE
+
+    return math.ceil(min_working_bonus / 10) * 10
+
+
+@instrumentation.timed('min_bonus_for_target')
+def min_bonus_for_target(days: int, target_hires: int, adoption_prob_func: callable, eps: float = 0.01, config: SimulationConfig | None = None) -> int | None:
     
     if target_hires <= 0:
         return 0
 
+    # With a registered inverse, the bonus comes from inverting the minimum p instead
+    inverse = _adoption_inverses.get(adoption_prob_func)
+    if inverse is not None:
+        return _min_bonus_from_inverse(days, target_hires, inverse, eps, config)
+
+    # Curves simulated during the search, as opposed to answered from the cache
+    cache_misses = growth_curve_cache.misses
+
     low_bonus = 0.0
     high_bonus = MAX_BONUS_SEARCH_RANGE
     min_working_bonus = float('inf')
@@ -21,7 +178,7 @@ def min_bonus_for_target(days: int, target_hires: int, adoption_prob_func: calla
         p = adoption_prob_func(mid_bonus)
 
         # Check if this bonus is sufficient
-        days_needed = days_to_target(p, target_hires)
+        days_needed = days_to_target(p, target_hires, config)
         if days_needed != -1 and days_needed <= days:
             # Try to find an even smaller bonus that also works.
             min_working_bonus = mid_bonus
@@ -30,14 +187,90 @@ def min_bonus_for_target(days: int, target_hires: int, adoption_prob_func: calla
             # This bonus is too low. We need to offer more.
             low_bonus = mid_bonus
 
+    if instrumentation.enabled:
+        instrumentation.observe('min_bonus_for_target.simulations', growth_curve_cache.misses - cache_misses)
+
     if min_working_bonus == float('inf'):
         # Check if the absolute max bonus works, as a last resort
         p_max = adoption_prob_func(MAX_BONUS_SEARCH_RANGE)
-        days_needed = days_to_target(p_max, target_hires)
+        days_needed = days_to_target(p_max, target_hires, config)
         if days_needed != -1 and days_needed <= days:
             min_working_bonus = MAX_BONUS_SEARCH_RANGE
         else:
             return None
 
     # Round the result UP to the nearest $10
-    return math.ceil(min_working_bonus / 10) * 10
\ No newline at end of file
+    return math.ceil(min_working_bonus / 10) * 10
+
+
+@instrumentation.timed('min_bonus_for_targets')
+def min_bonus_for_targets(queries, adoption_prob_func: callable, eps: float = 0.01, vectorized: bool = False, config: SimulationConfig | None = None) -> list[int | None]:
+
+    # Batch form of min_bonus_for_target for many (days, target_hires) queries against
+    # one adoption curve. Every query runs the same bisection as the scalar function,
+    # in lockstep, so each round's midpoints can be evaluated together. The adoption
+    # function is called once per distinct bonus (in one array call per round when
+    # vectorized and NumPy is available), and every distinct p is simulated once into
+    # a shared growth curve that answers all of its queries by bisect.
+    queries = list(queries)
+    if adoption_prob_func in _adoption_inverses:
+        return [min_bonus_for_target(days, target_hires, adoption_prob_func, eps, config) for days, target_hires in queries]
+
+    results = [None] * len(queries)
+    probabilities = {}
+
+    def bonus_works(bonus, days, target_hires):
+        p = probabilities[bonus]
+        if p <= 0:
+            return False
+        days_needed = growth_curve_cache.days_to_target(p, target_hires, config)
+        return days_needed != -1 and days_needed <= days
+
+    # Bisection state per query: [low_bonus, high_bonus, min_working_bonus]
+    searches = {}
+    for index, (_, target_hires) in enumerate(queries):
+        if target_hires <= 0:
+            results[index] = 0
+        else:
+            searches[index] = [0.0, MAX_BONUS_SEARCH_RANGE, float('inf')]
+
+    while searches:
+        mid_bonuses = {index: (low_bonus + high_bonus) / 2 for index, (low_bonus, high_bonus, _) in searches.items()}
+        _evaluate_adoption(adoption_prob_func, mid_bonuses.values(), probabilities, vectorized)
+
+        for index, mid_bonus in mid_bonuses.items():
+            search = searches[index]
+            if bonus_works(mid_bonus, *queries[index]):
+                search[1] = search[2] = mid_bonus
+            else:
+                search[0] = mid_bonus
+
+        finished = [index for index, (low_bonus, high_bonus, _) in searches.items() if high_bonus - low_bonus <= eps]
+
+        for index in finished:
+            min_working_bonus = searches.pop(index)[2]
+            if min_working_bonus == float('inf'):
+                # Check if the absolute max bonus works, as a last resort
+                _evaluate_adoption(adoption_prob_func, [MAX_BONUS_SEARCH_RANGE], probabilities, vectorized=False)
+                if not bonus_works(MAX_BONUS_SEARCH_RANGE, *queries[index]):
+                    continue
+                min_working_bonus = MAX_BONUS_SEARCH_RANGE
+
+            # Round the result UP to the nearest $10
+            results[index] = math.ceil(min_working_bonus / 10) * 10
+
+    return results
+
+
+def _evaluate_adoption(adoption_prob_func: callable, bonuses, probabilities: dict, vectorized: bool) -> None:
+
+    new_bonuses = sorted(set(bonuses) - probabilities.keys())
+    if not new_bonuses:
+        return
+
+    if vectorized and np is not None:
+        values = np.broadcast_to(np.asarray(adoption_prob_func(np.asarray(new_bonuses)), dtype=float), (len(new_bonuses),))
+        probabilities.update(zip(new_bonuses, values.tolist()))
+    else:
+        for bonus in new_bonuses:
+            probabilities[bonus] = adoption_prob_func(bonus)
@@ -1,6 +1,38 @@
 # Parts 1, 2 & 3
 
+import bisect
+import functools
+import heapq
+import itertools
+import math
+import operator
+import time
+from array import array
 from collections import deque
+from collections.abc import Sequence
+from typing import NamedTuple
+from source.Ingestion import (
+    ALREADY_REFERRED, BULK_CHUNK_SIZE, CYCLE, MALFORMED, SELF_REFERRAL, IngestionReport, Rejection, parse_referral, read_referrals,
+)
+from source.Instrumentation import instrumentation
+from source.Snapshot import NO_USER, Snapshot, write_snapshot
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Traversal orders of iter_descendants
+BFS = 'bfs'
+DFS = 'dfs'
+
+# Reach changes patched into a cached ranking per sync before a re-sort is cheaper
+RANKING_PATCH_LIMIT = 256
+
+# An extended time index is rebuilt once it holds more extended keys than this plus one
+# per 32 users of its tour, or a key longer than TIME_INDEX_MAX_KEY_LENGTH
+TIME_INDEX_EXTENSIONS = 256
+TIME_INDEX_MAX_KEY_LENGTH = 64
 
 class ReferralNetwork:
 
@@ -9,145 +41,828 @@ class ReferralNetwork:
         self.graph = {}
         self.referrers = {}
 
+        # Number of downstream users per user. Accepted referrals are queued and folded
+        # in on the next read, so inserts never walk the upstream chain.
+        self._reach_counts = {}
+        self._pending_reach = []
+        # Users sorted by reach, built on first use and then patched in place as reach
+        # counts change, and the Euler-tour reach index, rebuilt lazily after a change
+        self._reach_ranking = None
+        self._reach_index = None
+        # Insertion order of the users in the cached ranking, built with it, which breaks
+        # ties when a user is put back at its new position
+        self._ranking_ordinals = None
+        self._next_ranking_ordinal = 0
+        # Depths and ancestor jump tables, built on first use and then kept up to date
+        self._ancestor_index = None
+        # The unique-reach greedy, built on first use and then repaired as referrals arrive
+        self._unique_reach_ranker = None
+
+        # Union-find over tree membership: every user points at itself or at one of its
+        # ancestors, so following the pointers always ends at the root of its tree
+        self._tree_roots = {}
+
+        # Write-ahead log that new users and accepted referrals are appended to, if any
+        self._log = None
+
+        # When each candidate was referred, and the referred candidates sorted by that time
+        # (equal times in the order they were accepted) for the windowed analytics
+        self._referral_times = {}
+        self._event_times = []
+        self._event_candidates = []
+        # (timestamp, candidate) of referrals that arrived out of time order, merged into
+        # the sorted lists in one pass before they are next read
+        self._pending_events = []
+        # Keys of those referrals for the windows, built on first use and then extended
+        self._time_index = None
+
+    @property
+    def reach_counts(self):
+
+        self._sync_reach_counts()
+        return self._reach_counts
+
+    @property
+    def reach_index(self):
+
+        if self._reach_index is None:
+            reach_counts = self.reach_counts
+            order, entry = self._get_euler_tour()
+            exit = {user: position + 1 + reach_counts[user] for user, position in entry.items()}
+            self._reach_index = ReachIndex(order, entry, exit)
+        return self._reach_index
+
+    @property
+    def ancestor_index(self):
+
+        if self._ancestor_index is None:
+            users = list(self.graph)
+            ids = {user: user_id for user_id, user in enumerate(users)}
+            parents = array('i', (ids[self.referrers[user]] if user in self.referrers else user_id for user_id, user in enumerate(users)))
+            order, _ = self._get_euler_tour()
+            self._ancestor_index = AncestorIndex(ids, users, parents, map(ids.__getitem__, order))
+        return self._ancestor_index
+
+    @property
+    def unique_reach_ranker(self):
+
+        if self._unique_reach_ranker is None:
+            self._unique_reach_ranker = UniqueReachRanker(self)
+        return self._unique_reach_ranker
+
     # Part 1: Referral Graph 
 
     def add_user(self, user):
         
         if user not in self.graph:
             self.graph[user] = []
+            self._reach_counts[user] = 0
+            self._tree_roots[user] = user
+            if self._reach_ranking is not None:
+                # Reach 0 and the latest insertion sort after everyone else
+                self._reach_ranking.append(user)
+                self._ranking_ordinals[user] = self._next_ranking_ordinal
+                self._next_ranking_ordinal += 1
+            self._reach_index = None
+            if self._ancestor_index is not None:
+                self._ancestor_index.add_user(user)
+            if self._unique_reach_ranker is not None:
+                self._unique_reach_ranker.add_user(user)
+            if self._time_index is not None:
+                self._time_index.add_user(user)
+            if self._log is not None:
+                self._log.append_user(user)
 
-    def add_referral(self, referrer, candidate):
+    @instrumentation.timed_method('ReferralNetwork.add_referral')
+    def add_referral(self, referrer, candidate, timestamp=None):
 
-        # Constraint 1
+        # timestamp is when the referral was made, in seconds since the epoch; now by default
+
+        rejection = self._validate_referral(referrer, candidate)
+        if rejection == SELF_REFERRAL:
+            print(f"Error: Users cannot refer themselves ({referrer} -> {candidate})")
+            return False
+        if rejection == ALREADY_REFERRED:
+            print(f"Error: Candidate '{candidate}' has already been referred")
+            return False
+        if rejection == CYCLE:
+            print(f"Error: Adding this referral would create a cycle ({referrer} -> {candidate})")
+            return False
+
+        self._link(referrer, candidate, time.time() if timestamp is None else timestamp)
+        return True
+
+    @instrumentation.timed_method('ReferralNetwork.add_referrals')
+    def add_referrals(self, referrals):
+
+        # Bulk ingestion: same constraints and first-come order as add_referral, but
+        # rejections are collected into a report instead of printed. Rows are
+        # (referrer, candidate) or (referrer, candidate, timestamp).
+        report = IngestionReport()
+
+        for row, referral in enumerate(referrals, start=1):
+            referral = parse_referral(referral)
+            if referral is None:
+                report.rejected.append(Rejection(row, None, None, MALFORMED))
+                continue
+            referrer, candidate, timestamp = referral
+
+            rejection = self._validate_referral(referrer, candidate)
+            if rejection is not None:
+                report.rejected.append(Rejection(row, referrer, candidate, rejection))
+                continue
+
+            self._link(referrer, candidate, time.time() if timestamp is None else timestamp)
+            report.accepted += 1
+
+        return report
+
+    @instrumentation.timed_method('ReferralNetwork.add_referrals_from_file')
+    def add_referrals_from_file(self, path):
+
+        return self.add_referrals(read_referrals(path))
+
+    # Removing users and moving referrals. Reach counts and a cached ranking are patched
+    # along the affected upstream paths, and the union-find pointers, ancestor index and
+    # referral times of the affected trees are rewritten; the Euler-tour reach index and
+    # the time index are rebuilt lazily.
+
+    @instrumentation.timed_method('ReferralNetwork.remove_user')
+    def remove_user(self, user, promote_referrals=True):
+
+        # Removes user and the referral that brought them in. Their referrals are promoted
+        # to their referrer, keeping their place in its list, or detached as new roots.
+        if user not in self.graph:
+            print(f"Error: Unknown user '{user}'")
+            return False
+
+        self._sync_reach_counts()
+        referrer = self.referrers.pop(user, None)
+        referrals = self.graph.pop(user)
+        ranker = self._unique_reach_ranker
+        if ranker is not None:
+            ranker.touch(user)
+            for affected in itertools.chain((referrer,) if referrer is not None else (), referrals):
+                ranker.touch(affected)
+        new_referrer = referrer if promote_referrals else None
+
+        if referrer is not None:
+            siblings = self.graph[referrer]
+            position = siblings.index(user)
+            siblings[position:position + 1] = referrals if promote_referrals else []
+            # Promoted referrals stay upstream of the same users, so only the user leaves
+            # the chain; detached ones take their networks along
+            self._add_upstream_reach(referrer, -1 if promote_referrals else -1 - self._reach_counts[user])
+
+        self._remove_referral_time(user)
+        for referral in referrals:
+            if new_referrer is None:
+                del self.referrers[referral]
+                self._remove_referral_time(referral)
+            else:
+                self.referrers[referral] = new_referrer
+            self._relink_tree(referral, new_referrer)
+
+        self._remove_ranked_user(user)
+        del self._reach_counts[user]
+        del self._tree_roots[user]
+        self._reach_index = None
+        self._time_index = None
+        if self._ancestor_index is not None:
+            self._ancestor_index.remove_user(user)
+
+        if self._log is not None:
+            self._log.append_removal(user, promote_referrals)
+        return True
+
+    @instrumentation.timed_method('ReferralNetwork.move_referral')
+    def move_referral(self, candidate, referrer, timestamp=None):
+
+        # Re-assigns candidate, with their whole network, to a new referrer, as if the
+        # old referral had been withdrawn and this one accepted (now by default)
+        if candidate not in self.graph:
+            print(f"Error: Unknown user '{candidate}'")
+            return False
         if referrer == candidate:
             print(f"Error: Users cannot refer themselves ({referrer} -> {candidate})")
             return False
+        self.add_user(referrer)
+        if self._is_upstream(candidate, referrer):
+            print(f"Error: Adding this referral would create a cycle ({referrer} -> {candidate})")
+            return False
+
+        self._sync_reach_counts()
+        timestamp = time.time() if timestamp is None else timestamp
+        size = 1 + self._reach_counts[candidate]
+        old_referrer = self.referrers.pop(candidate, None)
+        if old_referrer is not None:
+            self.graph[old_referrer].remove(candidate)
+            self._add_upstream_reach(old_referrer, -size)
+        self._remove_referral_time(candidate)
+
+        self.graph[referrer].append(candidate)
+        self.referrers[candidate] = referrer
+        self._add_upstream_reach(referrer, size)
+        self._add_referral_time(candidate, timestamp)
+        self._relink_tree(candidate, referrer)
+        self._reach_index = None
+        self._time_index = None
+        if self._unique_reach_ranker is not None:
+            self._unique_reach_ranker.touch(candidate)
+            if old_referrer is not None:
+                self._unique_reach_ranker.touch(old_referrer)
+
+        if self._log is not None:
+            self._log.append_move(referrer, candidate, timestamp)
+        return True
+
+    def _is_upstream(self, ancestor, user):
+
+        # True when ancestor is user or one of user's referrers, walking up from user
+        current_node = user
+        while current_node != ancestor:
+            if current_node not in self.referrers:
+                return False
+            current_node = self.referrers[current_node]
+        return True
+
+    def _add_upstream_reach(self, user, delta):
+
+        # Adds delta to the reach of user and everyone upstream of them
+        current_node = user
+        while True:
+            self._set_reach(current_node, self._reach_counts[current_node] + delta)
+            if current_node not in self.referrers:
+                return
+            current_node = self.referrers[current_node]
+
+    def _ranking_key(self, user):
+
+        return -self._reach_counts[user], self._ranking_ordinals[user]
+
+    def _set_reach(self, user, reach):
+
+        # Keeps a cached ranking sorted: the user is taken out at its old key and put back
+        # at its new one, both found by binary search
+        ranking = self._reach_ranking
+        if ranking is None:
+            self._reach_counts[user] = reach
+            return
+        del ranking[bisect.bisect_left(ranking, self._ranking_key(user), key=self._ranking_key)]
+        self._reach_counts[user] = reach
+        ranking.insert(bisect.bisect_left(ranking, self._ranking_key(user), key=self._ranking_key), user)
+
+    def _remove_ranked_user(self, user):
+
+        if self._reach_ranking is not None:
+            del self._reach_ranking[bisect.bisect_left(self._reach_ranking, self._ranking_key(user), key=self._ranking_key)]
+            del self._ranking_ordinals[user]
+
+    def _relink_tree(self, candidate, referrer):
+
+        # candidate's tree now hangs below referrer, or stands alone when it is None. Union-
+        # find pointers may point above candidate, so the tree's all point at candidate now.
+        descendants = list(self.iter_descendants(candidate))
+        for descendant in descendants:
+            self._tree_roots[descendant] = candidate
+        self._tree_roots[candidate] = candidate if referrer is None else referrer
+
+        index = self._ancestor_index
+        if index is None:
+            return
+        if len(descendants) > len(index) // 4:
+            self._ancestor_index = None
+            return
+        index.link(index.ids[candidate if referrer is None else referrer], index.ids[candidate], map(index.ids.__getitem__, descendants))
+
+    def _remove_referral_time(self, candidate):
+
+        timestamp = self._referral_times.pop(candidate, None)
+        if timestamp is None:
+            return
+        self._sync_referral_times()
+        position = bisect.bisect_left(self._event_times, timestamp)
+        while self._event_candidates[position] != candidate:
+            position += 1
+        del self._event_times[position]
+        del self._event_candidates[position]
+
+    def _validate_referral(self, referrer, candidate):
+
+        # Constraint 1
+        if referrer == candidate:
+            return SELF_REFERRAL
         
         # Constraint 2
         if candidate in self.referrers:
-            print(f"Error: Candidate '{candidate}' has already been referred")
-            return False
+            return ALREADY_REFERRED
 
         self.add_user(referrer)
         self.add_user(candidate)
         
         # Constraint 3
         if self._creates_cycle(referrer, candidate):
-            print(f"Error: Adding this referral would create a cycle ({referrer} -> {candidate})")
-            return False
+            return CYCLE
+
+        return None
+
+    def _link(self, referrer, candidate, timestamp):
 
         self.graph[referrer].append(candidate)
         self.referrers[candidate] = referrer
+        event_position = self._add_referral_time(candidate, timestamp)
 
-        return True
+        # The candidate was a root, so its whole tree now hangs below the referrer
+        self._tree_roots[candidate] = referrer
+        self._reach_index = None
+        if self._ancestor_index is not None:
+            self._extend_ancestor_index(referrer, candidate)
+        if self._time_index is not None:
+            # Only a new leaf keeps the keys of the rest of the index valid
+            if self.graph[candidate]:
+                self._time_index = None
+            else:
+                self._time_index.link(referrer, candidate, event_position)
+        if self._unique_reach_ranker is not None:
+            self._unique_reach_ranker.touch(candidate)
+
+        self._pending_reach.append((referrer, candidate))
+        if len(self._pending_reach) >= BULK_CHUNK_SIZE:
+            self._sync_reach_counts()
+
+        if self._log is not None:
+            self._log.append_referral(referrer, candidate, timestamp)
+
+    def _extend_ancestor_index(self, referrer, candidate):
+
+        # The candidate's whole tree moves down; past a quarter of the network, rewriting
+        # its rows costs more than the lazy rebuild
+        index = self._ancestor_index
+        descendants = list(itertools.islice(self.iter_descendants(candidate), len(index) // 4 + 1)) if self.graph[candidate] else ()
+        if len(descendants) > len(index) // 4:
+            self._ancestor_index = None
+            return
+        index.link(index.ids[referrer], index.ids[candidate], map(index.ids.__getitem__, descendants))
+
+    def _add_referral_time(self, candidate, timestamp):
+
+        # Referrals without a time (from before timestamps were recorded) stay out of windows
+        if timestamp is None or math.isnan(timestamp):
+            return
+        self._referral_times[candidate] = timestamp
+        if self._event_times and timestamp < self._event_times[-1]:
+            # Inserting one at a time would make unsorted bulk ingestion quadratic
+            self._pending_events.append((timestamp, candidate))
+            return
+        self._event_times.append(timestamp)
+        self._event_candidates.append(candidate)
+        return len(self._event_times) - 1
+
+    def _sync_referral_times(self):
+
+        # Merges the out-of-order referrals into the sorted times, and their keys into the
+        # time index, if there is one
+        if not self._pending_events:
+            return
+        events, self._pending_events = self._pending_events, []
+        positions = _merge_events(self._event_times, self._event_candidates, events)
+        if self._time_index is not None:
+            self._time_index.merge(positions, [candidate for _, candidate in events])
+
+    def _replay_referral(self, referrer, candidate, timestamp=None):
+
+        # Applies a logged referral, which was validated before it was logged. Reach counts
+        # stay queued until the next read, which folds in the whole replay at once.
+        self.graph[referrer].append(candidate)
+        self.referrers[candidate] = referrer
+        self._add_referral_time(candidate, timestamp)
+        self._tree_roots[candidate] = referrer
+        self._reach_index = None
+        self._ancestor_index = None
+        self._unique_reach_ranker = None
+        self._time_index = None
+        self._pending_reach.append((referrer, candidate))
 
     def _creates_cycle(self, referrer, candidate):
 
-        current_node = referrer
-        while current_node in self.referrers:
+        if instrumentation.enabled:
+            nodes_visited = 1
+            current_node = referrer
+            while self._tree_roots[current_node] != current_node:
+                current_node = self._tree_roots[current_node]
+                nodes_visited += 1
+            instrumentation.observe('ReferralNetwork.cycle_check.nodes_visited', nodes_visited)
 
-            current_node = self.referrers[current_node]
-            if current_node == candidate:
-                return True            
+        # The candidate has no referrer yet (constraint 2), so it is the root of its tree,
+        # and it is an ancestor of the referrer exactly when it is the referrer's root
+        return self._find_root(referrer) == candidate
+
+    def _find_root(self, user):
+
+        root = user
+        while self._tree_roots[root] != root:
+            root = self._tree_roots[root]
+
+        # Path compression
+        while self._tree_roots[user] != root:
+            self._tree_roots[user], user = root, self._tree_roots[user]
+
+        return root
+
+    def _sync_reach_counts(self):
+
+        pending = self._pending_reach
+        if not pending:
+            return
+        self._pending_reach = []
+
+        # Every user that joined a new upstream chain since the last sync did so through
+        # exactly one lowest new referral (referrer, candidate): the candidate itself plus
+        # its downstream network as of the last sync. So each pending referral adds that
+        # size to the referrer and everyone above it in the current forest.
+        deltas = [1 + self._reach_counts[candidate] for _, candidate in pending]
+
+        # Give up on the walks once they cost more than one full recount. A cached ranking
+        # is patched along the walks until RANKING_PATCH_LIMIT changes, past which one
+        # re-sort on the next read is cheaper.
+        budget = len(self.graph)
+        patches = RANKING_PATCH_LIMIT
+        for (referrer, _), delta in zip(pending, deltas):
+            current_node = referrer
+            while True:
+                if self._reach_ranking is None:
+                    self._reach_counts[current_node] += delta
+                else:
+                    self._set_reach(current_node, self._reach_counts[current_node] + delta)
+                    patches -= 1
+                    if patches < 0:
+                        self._reach_ranking = None
+                budget -= 1
+                if current_node not in self.referrers:
+                    break
+                current_node = self.referrers[current_node]
+
+            if budget < 0:
+                self._rebuild_reach_counts()
+                self._reach_ranking = None
+                break
+
+        if instrumentation.enabled:
+            instrumentation.observe('ReferralNetwork.reach_sync.nodes_visited', len(self.graph) - budget)
 
-        return False
+    def _rebuild_reach_counts(self):
+
+        # Reversed pre-order visits every user after all of its referrals
+        order, _ = self._get_euler_tour()
+        for user in reversed(order):
+            self._reach_counts[user] = sum(1 + self._reach_counts[referral] for referral in self.graph[user])
 
     def get_direct_referrals(self, user):
 
         return self.graph.get(user, [])
 
-    #  Part 2: Full Network Reach
+    def get_direct_referrals_view(self, user):
 
-    def get_total_referral_count(self,user):
+        # Read-only and live: later referrals show up in the view, and nothing is copied
+        return ReferralsView(self.graph.get(user, ()))
 
-        if user not in self.graph:
-            return 0
+    def iter_descendants(self, user, order=BFS, max_depth=None):
 
-        queue = deque(self.graph.get(user, []))
-        count = len(queue)
+        # Lazily yields the users downstream of user, level by level (BFS) or in pre-order
+        # (DFS, the order of iter_reach), at most max_depth levels down. Memory is bounded
+        # by the widest level for BFS and by the depth for DFS.
+        if order not in (BFS, DFS):
+            raise ValueError(f"Unknown traversal order: {order!r}, expected {BFS!r} or {DFS!r}")
+        if user not in self.graph or max_depth is not None and max_depth < 1:
+            return
 
-        while queue:
-            current_user = queue.popleft()
-            
-            direct_referrals = self.graph.get(current_user, [])
-            for referral in direct_referrals:
-                queue.append(referral)
-                count += 1
-                
-        return count
+        if order == BFS:
+            level = [user]
+            depth = 1
+            while level:
+                next_level = []
+                for parent in level:
+                    for referral in self.graph[parent]:
+                        yield referral
+                        if max_depth is None or depth < max_depth:
+                            next_level.append(referral)
+                level = next_level
+                depth += 1
+            return
+
+        # One iterator over the referrals of every user on the current path
+        stack = [iter(self.graph[user])]
+        while stack:
+            for referral in stack[-1]:
+                yield referral
+                if max_depth is None or len(stack) < max_depth:
+                    stack.append(iter(self.graph[referral]))
+                break
+            else:
+                stack.pop()
+
+    def get_referral_time(self, candidate):
+
+        # When candidate was referred, or None for roots and untimed referrals
+        return self._referral_times.get(candidate)
+
+    def window(self, start, end):
+
+        # Analytics over the referrals made in [start, end); see ReferralWindow
+        return ReferralWindow(self._get_time_index(), start, end)
+
+    def _get_time_index(self):
+
+        # Built from the reach index, then extended by every referral until outgrown
+        self._sync_referral_times()
+        if self._time_index is None or self._time_index.outgrown():
+            index = self.reach_index
+            users = list(self.graph)
+            self._time_index = _TimeIndex(
+                users, array('i', map(index.entry.__getitem__, users)), array('i', map(index.exit.__getitem__, users)),
+                self._event_times, self._event_candidates, index.entry, index.exit,
+            )
+        return self._time_index
+
+    # Upward queries
+
+    def get_depth(self, user):
+
+        # Hops from the root of user's tree, or None for unknown users
+        return self.ancestor_index.depth(user)
+
+    def get_ancestor(self, user, k):
+
+        # The referrer k levels above user (user itself for k = 0), or None past the root
+        return self.ancestor_index.ancestor(user, k)
+
+    def get_lowest_common_ancestor(self, first, second):
+
+        # The deepest user with both in its network or equal to them, None across trees
+        return self.ancestor_index.common_ancestor(first, second)
+
+    def get_distance(self, first, second):
+
+        # Hops on the path between the two users, or None when no path joins them
+        return self.ancestor_index.distance(first, second)
+
+    def get_lowest_common_ancestors(self, pairs):
+
+        return self.ancestor_index.common_ancestors(pairs)
+
+    def get_distances(self, pairs):
+
+        return self.ancestor_index.distances(pairs)
+
+    def is_downstream(self, user, ancestor):
 
+        # True when user is in ancestor's network (directly or indirectly referred)
+        return self.reach_index.is_downstream(user, ancestor)
+
+    def iter_reach(self, user):
+
+        # Lazily yields everyone in user's network in pre-order
+        return self.reach_index.iter_reach(user)
+
+    # Snapshots
+
+    @instrumentation.timed_method('ReferralNetwork.save')
+    def save(self, path):
+
+        ids, columns = self._get_columns()
+        referral_times = [self._referral_times.get(candidate, math.nan) for candidate in self.referrers]
+        write_snapshot(path, list(self.graph), columns, [ids[candidate] for candidate in self.referrers], referral_times)
+
+    def _get_columns(self):
+
+        # The forest as the id columns of CompactReferralNetwork, with ids in insertion order
+        reach_counts = self.reach_counts
+        ids = {user: user_id for user_id, user in enumerate(self.graph)}
+        columns = {column: array('i', [NO_USER]) * len(ids) for column in ('parents', 'first_children', 'last_children', 'next_siblings')}
+        for user, referrals in self.graph.items():
+            if user in self.referrers:
+                columns['parents'][ids[user]] = ids[self.referrers[user]]
+            if referrals:
+                columns['first_children'][ids[user]] = ids[referrals[0]]
+                columns['last_children'][ids[user]] = ids[referrals[-1]]
+            for referral, next_referral in zip(referrals, referrals[1:]):
+                columns['next_siblings'][ids[referral]] = ids[next_referral]
+        columns['reach_counts'] = array('i', [reach_counts[user] for user in self.graph])
+        return ids, columns
+
+    @classmethod
+    @instrumentation.timed('ReferralNetwork.load')
+    def load(cls, path):
+
+        snapshot = Snapshot(path)
+        names = list(snapshot.names)
+
+        network = cls()
+        for user in names:
+            network.add_user(user)
+
+        for user_id, user in enumerate(names):
+            child_id = snapshot.first_children[user_id]
+            while child_id != NO_USER:
+                network.graph[user].append(names[child_id])
+                child_id = snapshot.next_siblings[child_id]
+            network._reach_counts[user] = snapshot.reach_counts[user_id]
+
+        # Referrers are restored in the order the referrals were accepted
+        for candidate_id in snapshot.referral_order:
+            candidate = names[candidate_id]
+            network.referrers[candidate] = names[snapshot.parents[candidate_id]]
+            network._tree_roots[candidate] = network.referrers[candidate]
+
+        if snapshot.referral_times is not None:
+            network._restore_referral_times(map(names.__getitem__, snapshot.referral_order), snapshot.referral_times)
+
+        return network
+
+    def _restore_referral_times(self, candidates, timestamps):
+
+        # Rebuilds the time index from referrals in acceptance order; the sort is stable,
+        # so equal times keep that order
+        events = sorted(((timestamp, candidate) for candidate, timestamp in zip(candidates, timestamps) if not math.isnan(timestamp)), key=operator.itemgetter(0))
+        self._referral_times = {candidate: timestamp for timestamp, candidate in events}
+        self._event_times = [timestamp for timestamp, _ in events]
+        self._event_candidates = [candidate for _, candidate in events]
+        self._pending_events = []
+        self._time_index = None
+
+    #  Part 2: Full Network Reach
+
+    @instrumentation.timed_method('ReferralNetwork.get_total_referral_count')
+    def get_total_referral_count(self, user):
+
+        return self.reach_counts.get(user, 0)
+
+    @instrumentation.timed_method('ReferralNetwork.get_top_k_referrers')
     def get_top_k_referrers(self, k):
         
         if k <= 0:
             return []            
-        
-        all_reaches = {}
 
-        for user in self.graph:
-            all_reaches[user] = self.get_total_referral_count(user)
+        return self._get_reach_ranking()[:k]
+
+    def iter_top_referrers(self):
+
+        # The ranking of get_top_k_referrers, lazily, unless it is already cached
+        reach_counts = self.reach_counts
+        if self._reach_ranking is not None:
+            return iter(self._reach_ranking)
+        return _iter_pages(self.graph, reach_counts.__getitem__)
+
+    def get_top_referrers_page(self, limit, cursor=None):
+
+        # One page of the get_top_k_referrers ranking; pass the returned cursor back for
+        # the next. Pages are heap-selected, so no page sorts the whole network.
+        return _select_page(self.graph, self.reach_counts.__getitem__, limit, cursor)
+
+    def _get_reach_ranking(self):
 
-        sorted_referrers = sorted(all_reaches.items(), key=lambda item: item[1], reverse=True)
+        reach_counts = self.reach_counts
+        if self._reach_ranking is None:
+            # sorted() is stable, so users with equal reach keep their insertion order
+            self._reach_ranking = sorted(self.graph, key=reach_counts.__getitem__, reverse=True)
+            self._ranking_ordinals = {user: ordinal for ordinal, user in enumerate(self.graph)}
+            self._next_ranking_ordinal = len(self._ranking_ordinals)
 
-        return [user for user, reach in sorted_referrers[:k]]
+        return self._reach_ranking
 
     # Part 3: Identify Influencers
 
     #  Metric 1: Unique Reach Expansion
-    def get_influencers_by_unique_reach(self):
+    @instrumentation.timed_method('ReferralNetwork.get_influencers_by_unique_reach')
+    def get_influencers_by_unique_reach(self, k=None):
 
-        all_reach_sets = self._get_all_reach_sets()
-        
-        globally_covered = set()
-        ranked_influencers = []
-        
-        # Make a copy to modify during iteration
-        remaining_influencers = all_reach_sets.copy()
+        return list(itertools.islice(self.iter_influencers_by_unique_reach(), k))
 
-        while remaining_influencers:
-            best_user = None
-            max_new_contribution = -1
-            
-            # Find the user who adds the most new candidates in this step
-            for user, reach_set in remaining_influencers.items():
-                new_contribution = len(reach_set - globally_covered)
-                if new_contribution > max_new_contribution:
-                    max_new_contribution = new_contribution
-                    best_user = user
-            
-            # If no one can contribute new users, we're done
-            if max_new_contribution == 0:
-                break
-            
-            ranked_influencers.append(best_user)
-            globally_covered.update(all_reach_sets[best_user])
-            del remaining_influencers[best_user]
-            
-        return ranked_influencers
+    def iter_influencers_by_unique_reach(self):
 
-    def _get_all_reach_sets(self):
-        
-        reach_sets_cache = {}
-        for user in self.graph:
-            if user not in reach_sets_cache:
-                self._calculate_reach_set_recursive(user, reach_sets_cache)
-        return reach_sets_cache
+        # Every user reaches strictly more users than any of their referrals, so the greedy
+        # always picks a root, after which nothing else in that tree adds coverage and other
+        # trees are untouched. The greedy order is therefore the roots with referrals, by
+        # reach and then insertion order (sorted() is stable). UniqueReachRanker keeps the
+        # same order up to date across writes.
+        reach_counts = self.reach_counts
+        referrers = self.referrers
+        roots = [user for user in self.graph if user not in referrers and reach_counts[user]]
+        roots.sort(key=reach_counts.__getitem__, reverse=True)
+        return iter(roots)
 
-    def _calculate_reach_set_recursive(self, user, cache):
-        
-        if user in cache:
-            return cache[user]
-        
-        reach_set = set(self.graph.get(user, []))
-        
-        for direct_referral in self.graph.get(user, []):
-            reach_set.update(self._calculate_reach_set_recursive(direct_referral, cache))
-            
-        cache[user] = reach_set
-        return reach_set
+    def get_influencers_by_unique_reach_page(self, limit, cursor=None):
+
+        # The greedy picks depend on every earlier pick, so the cursor is the number of
+        # users already returned and each page replays the selection up to its end
+        return _offset_page(self.iter_influencers_by_unique_reach(), limit, cursor)
+
+    def _get_euler_tour(self):
+
+        # Iterative pre-order DFS; the downstream users of u are order[entry[u] + 1 : entry[u] + 1 + reach(u)]
+        order = []
+        entry = {}
+        for root in self.graph:
+            if root in self.referrers:
+                continue
+
+            stack = [root]
+            while stack:
+                current_node = stack.pop()
+                entry[current_node] = len(order)
+                order.append(current_node)
+                stack.extend(reversed(self.graph[current_node]))
+
+        if instrumentation.enabled:
+            instrumentation.observe('ReferralNetwork.euler_tour.nodes_visited', len(order))
+        return order, entry
 
     # Metric 2: Flow Centrality 
+    @instrumentation.timed_method('ReferralNetwork.get_influencers_by_flow_centrality')
     def get_influencers_by_flow_centrality(self):
 
+        flow_scores = self._get_flow_scores_forest()
+        sorted_by_score = sorted(flow_scores.items(), key=lambda item: item[1], reverse=True)
+        return [user for user, score in sorted_by_score]
+
+    def iter_influencers_by_flow_centrality(self):
+
+        return _iter_pages(self.graph, self._get_flow_scores_forest().__getitem__)
+
+    def get_influencers_by_flow_centrality_page(self, limit, cursor=None):
+
+        return _select_page(self.graph, self._get_flow_scores_forest().__getitem__, limit, cursor)
+
+    def _get_flow_scores_forest(self):
+
+        # In a forest the path s -> t is unique, and v lies strictly inside it exactly
+        # when s is a proper ancestor of v and t a proper descendant. So v brokers
+        # depth(v) * reach(v) pairs.
+        reach_counts = self.reach_counts
+        depths = self._get_depths()
+        return {user: depths[user] * reach_counts[user] for user in self.graph}
+
+    def _get_depths(self):
+
+        # One O(V) pass rather than the ancestor index, which every later insert would
+        # then have to maintain
+        depths = {}
+        for root in self.graph:
+            if root in self.referrers:
+                continue
+
+            depths[root] = 0
+            stack = [root]
+            while stack:
+                current_node = stack.pop()
+                for referral in self.graph[current_node]:
+                    depths[referral] = depths[current_node] + 1
+                    stack.append(referral)
+
+        if instrumentation.enabled:
+            instrumentation.observe('ReferralNetwork.depths.nodes_visited', len(depths))
+        return depths
+
+    def _get_flow_scores_brandes(self):
+
+        # Brandes-style accumulation for general DAGs. Each pair (s, t) splits its credit
+        # over all shortest s -> t paths, which gives the same integer scores as the
+        # forest engine whenever shortest paths are unique.
+        flow_scores = {user: 0.0 for user in self.graph}
+
+        for source_node in self.graph:
+            path_counts = {source_node: 1}
+            distances = {source_node: 0}
+            predecessors = {source_node: []}
+            visit_order = []
+
+            queue = deque([source_node])
+            while queue:
+                current_node = queue.popleft()
+                visit_order.append(current_node)
+                for neighbor in self.graph.get(current_node, []):
+                    if neighbor not in distances:
+                        distances[neighbor] = distances[current_node] + 1
+                        path_counts[neighbor] = 0
+                        predecessors[neighbor] = []
+                        queue.append(neighbor)
+                    if distances[neighbor] == distances[current_node] + 1:
+                        path_counts[neighbor] += path_counts[current_node]
+                        predecessors[neighbor].append(current_node)
+
+            dependencies = {user: 0.0 for user in visit_order}
+            for target in reversed(visit_order):
+                for predecessor in predecessors[target]:
+                    share = path_counts[predecessor] / path_counts[target]
+                    dependencies[predecessor] += share * (1 + dependencies[target])
+                if target != source_node:
+                    flow_scores[target] += dependencies[target]
+
+        return flow_scores
+
+    def _get_flow_scores_all_pairs(self):
+
+        # Original O(V^3) definition, kept as the reference the faster engines are checked against
         distances = self._get_all_pairs_shortest_paths()
         users = list(self.graph.keys())
         flow_scores = {user: 0 for user in users}
@@ -167,9 +882,7 @@ class ReferralNetwork:
                         if distances[s][v] + distances[v][t] == dist_st:
                             flow_scores[v] += 1
                             
-        sorted_by_score = sorted(flow_scores.items(), key=lambda item: item[1], reverse=True)
-        return [user for user, score in sorted_by_score]
-
+        return flow_scores
 
     def _get_all_pairs_shortest_paths(self):
         
@@ -186,4 +899,875 @@ class ReferralNetwork:
                         queue.append((neighbor, dist + 1))
                         
         return distances
-        
\ No newline at end of file
+
+
+class ReferralsView(Sequence):
+
+    # Read-only view of a list of referrals that follows later changes to it
+
+    def __init__(self, referrals):
+
+        self._referrals = referrals
+
+    def __getitem__(self, index):
+
+        return self._referrals[index]
+
+    def __len__(self):
+
+        return len(self._referrals)
+
+    def __iter__(self):
+
+        return iter(self._referrals)
+
+    def __repr__(self):
+
+        return f'{type(self).__name__}({list(self)!r})'
+
+
+class Page(NamedTuple):
+
+    items: list
+    # Opaque; pass it back for the next page. None after the last page.
+    cursor: object
+
+
+def _select_page(users, scores, limit, cursor):
+
+    # users are in insertion order and scores maps a user to its score. The ranking is by
+    # score, descending, equal scores in insertion order, and a page is heap-selected in
+    # O(n log limit). The cursor is the last score returned and how many users with that
+    # score have been returned, so pages stay consistent when users are added in between.
+    if limit < 1:
+        raise ValueError(f"A page needs a positive limit, got {limit}")
+    if cursor is None:
+        candidates = users
+        last_score, ties = None, 0
+    else:
+        last_score, ties = cursor
+        # Users tied with the last one returned that come after it, then lower scores
+        candidates = itertools.chain(
+            itertools.islice(itertools.compress(users, map(functools.partial(operator.eq, last_score), map(scores, users))), ties, None),
+            itertools.compress(users, map(functools.partial(operator.gt, last_score), map(scores, users))),
+        )
+
+    # nlargest is stable, and one extra user tells whether another page follows
+    selected = heapq.nlargest(limit + 1, candidates, key=scores)
+    if len(selected) <= limit:
+        return Page(selected, None)
+    del selected[limit:]
+
+    score = scores(selected[-1])
+    tied = sum(1 for user in selected if scores(user) == score)
+    return Page(selected, (score, tied + ties if score == last_score else tied))
+
+
+def _iter_pages(users, scores, limit=64):
+
+    # A whole ranking as pages of growing size: the first users arrive after one O(n)
+    # pass instead of a full sort, and memory is bounded by the current page
+    cursor = None
+    while True:
+        page = _select_page(users, scores, limit, cursor)
+        yield from page.items
+        if page.cursor is None:
+            return
+        cursor = page.cursor
+        limit *= 4
+
+
+def _offset_page(ranking, limit, cursor):
+
+    if limit < 1:
+        raise ValueError(f"A page needs a positive limit, got {limit}")
+    offset = cursor or 0
+    items = list(itertools.islice(ranking, offset, offset + limit + 1))
+    if len(items) <= limit:
+        return Page(items, None)
+    return Page(items[:limit], offset + limit)
+
+
+def _merge_events(times, candidates, events):
+
+    # Merges (timestamp, candidate) events, in the order they were accepted, into the sorted
+    # times and their candidates in place, and returns where each one landed. The lists may
+    # be lists or arrays. An event only waits here if it was older than the latest listed
+    # time, so listed events with the same time were accepted before it and stay first.
+    events.sort(key=operator.itemgetter(0))
+    merged_times, merged_candidates, positions = times[:0], candidates[:0], []
+    previous = 0
+    for timestamp, candidate in events:
+        cut = bisect.bisect_right(times, timestamp, previous)
+        merged_times += times[previous:cut]
+        merged_candidates += candidates[previous:cut]
+        positions.append(len(merged_times))
+        merged_times.append(timestamp)
+        merged_candidates.append(candidate)
+        previous = cut
+    merged_times += times[previous:]
+    merged_candidates += candidates[previous:]
+    times[:] = merged_times
+    candidates[:] = merged_candidates
+    return positions
+
+
+class _TimeIndex:
+
+    # The time-sorted referrals, keyed by where their candidates sit in the forest so that
+    # every user's network is one range of keys. Keys are tuples. The index starts from an
+    # Euler tour: the user at tour position p has key (2p,), and the network of a user
+    # with tour entry and exit positions is [(2 * entry + 1,), (2 * exit,)).
+    #
+    # Later referrals extend the index in place instead of rebuilding the tour. Their keys
+    # are appended, or merged in bulk for referrals that arrived out of time order:
+    #   - a new leaf below a tour user is keyed (2 * entry + 1, i), for the i-th such
+    #     referral of that user. The key sorts inside the ranges of that user and of
+    #     everyone above them.
+    #   - a new leaf below an extended user with key K is keyed K + (i,), and the network
+    #     of that user is [K + (0,), K + (inf,)).
+    #   - users added after the tour start their own trees at (-1, j).
+    # A referral whose candidate already has referrals, a move or a removal would re-key
+    # whole trees, so the network drops the index and rebuilds it on next use. It also
+    # does so once extended keys grow too many or too long.
+    #
+    # Event keys are stored by their first element, which NumPy can count in bulk. The few
+    # extended keys are looked up by candidate.
+
+    def __init__(self, users, entries, exits, event_times, event_candidates, tour_entries, tour_exits):
+
+        # users by insertion position with their tour entry and exit positions; the event
+        # times and candidates are the network's own sorted lists, which it extends
+        self.users = users
+        self.entries = entries
+        self.exits = exits
+        self.event_times = event_times
+        self.event_candidates = event_candidates
+        self.event_keys = array('i', (2 * tour_entries[candidate] for candidate in event_candidates))
+        # Extended keys of the users linked or starting trees since the tour
+        self.keys = {}
+        self._tour_entries = tour_entries
+        self._tour_exits = tour_exits
+        self._child_counts = {}
+        self._root_count = 0
+        self._outgrown = False
+        # Insertion positions of users added since the tour, and of tour users by tour
+        # position, built when first needed
+        self._new_positions = {}
+        self._tour_positions = None
+
+    def outgrown(self):
+
+        return self._outgrown or len(self.keys) > TIME_INDEX_EXTENSIONS + len(self.entries) // 32
+
+    # Maintenance
+
+    def add_user(self, user):
+
+        self._new_positions[user] = len(self.users)
+        self.users.append(user)
+
+    def link(self, referrer, candidate, event_position):
+
+        # candidate, with no referrals of its own, was referred by referrer; event_position
+        # is where the network appended the referral to its sorted times, None if untimed
+        # or out of time order (see merge)
+        key = self._child_key(referrer)
+        self.keys[candidate] = key
+        if len(key) > TIME_INDEX_MAX_KEY_LENGTH:
+            self._outgrown = True
+        if event_position is not None:
+            self.event_keys.append(key[0])
+
+    def merge(self, positions, candidates):
+
+        # The network merged the referrals of these linked candidates into its sorted times
+        # at these increasing positions
+        event_keys, previous = array('i'), 0
+        for offset, (position, candidate) in enumerate(zip(positions, candidates)):
+            event_keys += self.event_keys[previous:position - offset]
+            event_keys.append(self.keys[candidate][0])
+            previous = position - offset
+        event_keys += self.event_keys[previous:]
+        self.event_keys = event_keys
+
+    def _child_key(self, referrer):
+
+        child_number = self._child_counts.get(referrer, 0)
+        self._child_counts[referrer] = child_number + 1
+        key = self.keys.get(referrer)
+        if key is None:
+            entry = self._tour_entry(referrer)
+            if entry is not None:
+                return 2 * entry + 1, child_number
+            key = self.keys[referrer] = (-1, self._root_count)
+            self._root_count += 1
+        return key + (child_number,)
+
+    # Lookups
+
+    def interval(self, user):
+
+        # The key range of user's network, or None for users with no network to count
+        key = self._key(user)
+        if key is None:
+            return None
+        extended_key = self.keys.get(key)
+        if extended_key is not None:
+            return extended_key + (0,), extended_key + (math.inf,)
+        entry = self._tour_entry(key)
+        if entry is None:
+            return None
+        return (2 * entry + 1,), (2 * self._tour_exits[key],)
+
+    # Network keys: users here, ids in the array-backed backend
+
+    def _key(self, user):
+
+        return user
+
+    def _tour_entry(self, key):
+
+        return self._tour_entries.get(key)
+
+    def _position(self, key):
+
+        position = self._new_positions.get(key)
+        if position is None:
+            if self._tour_positions is None:
+                self._tour_positions = array('i', bytes(4 * len(self.entries)))
+                for position, entry in enumerate(self.entries):
+                    self._tour_positions[entry] = position
+            position = self._tour_positions[self._tour_entries[key]]
+        return position
+
+
+class ReferralWindow:
+
+    # Reach, top-k and unique reach counting only the referrals made in [start, end).
+    # The window's referrals are a slice of the time-sorted event index, found by binary
+    # search. Ranking the keys of that slice (see _TimeIndex) turns every user's windowed
+    # network into an interval [rank(low), rank(high)) of window ranks, so windowed reach
+    # is a subtraction and the unique reach greedy runs on intervals as usual. Single users
+    # of small windows are ranked against the sorted slice. Everything else uses a prefix
+    # sum over the first elements of the keys, built once per window; it is vectorized
+    # with NumPy and a Python loop over the tour without it.
+
+    def __init__(self, time_index, start, end):
+
+        self.start = start
+        self.end = end
+        self._index = time_index
+        first = bisect.bisect_left(time_index.event_times, start)
+        last = max(first, bisect.bisect_left(time_index.event_times, end))
+        self.size = last - first
+
+        # Copied, since the index keeps growing; extended keys are taken now for the same reason
+        keys = time_index.event_keys[first:last]
+        if np is not None:
+            self._keys = np.frombuffer(keys, dtype=np.int32)
+            offsets = np.flatnonzero(self._keys & 1).tolist()
+        else:
+            self._keys = keys
+            offsets = [offset for offset, key in enumerate(keys) if key & 1]
+        candidates = time_index.event_candidates
+        self._extended_keys = sorted(time_index.keys[candidates[first + offset]] for offset in offsets)
+
+        self._user_count = len(time_index.users)
+        self._small = self.size * max(1, self.size.bit_length()) < len(time_index.entries)
+        self._sorted_keys = None
+        self._prefix = None
+        self._intervals = None
+        self._counts = None
+
+    def __len__(self):
+
+        return self.size
+
+    def _get_prefix(self):
+
+        # prefix[k + 1] is the number of window referrals whose keys start below k
+        if self._prefix is None:
+            size = 2 * len(self._index.entries) + 1
+            if np is not None:
+                self._prefix = np.zeros(size + 1, dtype=np.int32)
+                np.cumsum(np.bincount(self._keys + 1, minlength=size), out=self._prefix[1:])
+            else:
+                marks = [0] * size
+                for key in self._keys:
+                    marks[key + 1] += 1
+                self._prefix = [0, *itertools.accumulate(marks)]
+        return self._prefix
+
+    def _rank(self, key):
+
+        # The number of window referrals whose keys sort below key
+        if self._prefix is None and self._small:
+            if self._sorted_keys is None:
+                self._sorted_keys = sorted(self._keys) if np is None else np.sort(self._keys).tolist()
+            rank = bisect.bisect_left(self._sorted_keys, key[0])
+        else:
+            rank = int(self._get_prefix()[key[0] + 1])
+        if len(key) > 1 and self._extended_keys:
+            # Extended keys starting with key[0] sort by their remaining elements
+            rank += bisect.bisect_left(self._extended_keys, key) - bisect.bisect_left(self._extended_keys, key[:1])
+        return rank
+
+    def get_total_referral_count(self, user):
+
+        # How many of user's downstream users were referred within the window
+        interval = self._index.interval(user)
+        if interval is None:
+            return 0
+        low, high = interval
+        return self._rank(high) - self._rank(low)
+
+    def _get_intervals(self):
+
+        # Window-rank interval of every user, by insertion position: the tour users'
+        # in bulk from the prefix sum, then the few extended users one by one
+        if self._intervals is None:
+            prefix = self._get_prefix()
+            index = self._index
+            padding = self._user_count - len(index.entries)
+            if np is not None:
+                lows = np.concatenate((prefix[2 * np.frombuffer(index.entries, dtype=np.int32) + 2], np.zeros(padding, dtype=np.int32)))
+                highs = np.concatenate((prefix[2 * np.frombuffer(index.exits, dtype=np.int32) + 1], np.zeros(padding, dtype=np.int32)))
+            else:
+                lows = [prefix[2 * entry + 2] for entry in index.entries] + [0] * padding
+                highs = [prefix[2 * exit + 1] for exit in index.exits] + [0] * padding
+            for key, extended_key in list(index.keys.items()):
+                position = index._position(key)
+                # Users added after the window opened are left out
+                if position < self._user_count:
+                    lows[position] = self._rank(extended_key + (0,))
+                    highs[position] = self._rank(extended_key + (math.inf,))
+            self._intervals = lows, highs
+        return self._intervals
+
+    def _iter_ranked_positions(self, counts):
+
+        # Insertion positions by count, descending, equal counts in insertion order. With
+        # numpy the ranking is selected in chunks of growing size, so the first users cost
+        # one O(n) partition rather than a full sort; users with no windowed reach, usually
+        # most of them, come last and are never partitioned.
+        if np is None:
+            yield from sorted(range(len(counts)), key=counts.__getitem__, reverse=True)
+            return
+
+        remaining = np.flatnonzero(counts)
+        limit = 64
+        while len(remaining):
+            if limit < len(remaining):
+                remaining_counts = counts[remaining]
+                threshold = np.partition(remaining_counts, len(remaining) - limit)[len(remaining) - limit]
+                # Everyone above the threshold, then the first users tied with it
+                selected = remaining_counts > threshold
+                selected[np.flatnonzero(remaining_counts == threshold)[:limit - np.count_nonzero(selected)]] = True
+                chunk, remaining = remaining[selected], remaining[~selected]
+            else:
+                chunk, remaining = remaining, remaining[:0]
+            yield from chunk[np.lexsort((chunk, -counts[chunk]))].tolist()
+            limit *= 4
+        yield from np.flatnonzero(counts == 0).tolist()
+
+    def _get_counts(self):
+
+        if self._counts is None:
+            lows, highs = self._get_intervals()
+            self._counts = highs - lows if np is not None else list(map(operator.sub, highs, lows))
+        return self._counts
+
+    def iter_top_referrers(self):
+
+        # Removed users of the array backend leave None at their position
+        users = self._index.users
+        return (user for user in map(users.__getitem__, self._iter_ranked_positions(self._get_counts())) if user is not None)
+
+    def get_top_k_referrers(self, k):
+
+        # Users by windowed reach, equal reach in insertion order, as get_top_k_referrers
+        if k <= 0:
+            return []
+        return list(itertools.islice(self.iter_top_referrers(), k))
+
+    def get_influencers_by_unique_reach(self, k=None):
+
+        # Lazy greedy (CELF) over window-rank intervals. Windowed reach is not strictly
+        # larger above than below, so unlike the whole network the picks are not just
+        # roots. Marginal gains only shrink as coverage grows, so a gain computed in an
+        # earlier round is an upper bound and most users are never re-evaluated. Users
+        # enter the heap in order of windowed reach, only once their reach could beat the
+        # heap's best, so a short ranking never touches most users.
+        lows, highs = self._get_intervals()
+        counts = self._get_counts()
+        users = self._index.users
+        ranked = self._iter_ranked_positions(counts)
+
+        covered = _CoverageTracker(self.size)
+        ranked_influencers = []
+        heap = []
+        upcoming = next(ranked, None)
+
+        while k is None or len(ranked_influencers) < k:
+            # Unpushed users sit at their first-round key (-reach, position, 0)
+            while upcoming is not None and (not heap or (-int(counts[upcoming]), upcoming, 0) < heap[0]):
+                heapq.heappush(heap, (-int(counts[upcoming]), upcoming, 0))
+                upcoming = next(ranked, None)
+            if not heap or heap[0][0] == 0:
+                break
+
+            negative_gain, position, evaluated_round = heap[0]
+            start, end = int(lows[position]), int(highs[position])
+            if evaluated_round == len(ranked_influencers):
+                heapq.heappop(heap)
+                ranked_influencers.append(users[position])
+                covered.cover(start, end)
+            else:
+                new_contribution = (end - start) - covered.count(start, end)
+                heapq.heapreplace(heap, (-new_contribution, position, len(ranked_influencers)))
+
+        return ranked_influencers
+
+
+class ReachIndex:
+
+    # Pre-order (Euler-tour) positions of every user. The network of a user is exactly
+    # order[entry + 1 : exit], so its size and "is X downstream of Y" are O(1) and the
+    # whole index takes O(V) memory. The index is a snapshot; networks rebuild it lazily
+    # after they change.
+
+    def __init__(self, order, entry, exit):
+
+        self.order = order
+        self.entry = entry
+        self.exit = exit
+
+    def __len__(self):
+
+        return len(self.order)
+
+    def __contains__(self, user):
+
+        return self._key(user) is not None
+
+    def _key(self, user):
+
+        return user if user in self.entry else None
+
+    def _user(self, key):
+
+        return key
+
+    def interval(self, user):
+
+        # Positions [start, end) of the user's network in order
+        key = self._key(user)
+        if key is None:
+            raise KeyError(user)
+        return self.entry[key] + 1, self.exit[key]
+
+    def reach_size(self, user):
+
+        key = self._key(user)
+        if key is None:
+            return 0
+        return self.exit[key] - self.entry[key] - 1
+
+    def is_downstream(self, user, ancestor):
+
+        user_key, ancestor_key = self._key(user), self._key(ancestor)
+        if user_key is None or ancestor_key is None:
+            return False
+        return self.entry[ancestor_key] < self.entry[user_key] < self.exit[ancestor_key]
+
+    def iter_reach(self, user):
+
+        key = self._key(user)
+        if key is None:
+            return
+        for position in range(self.entry[key] + 1, self.exit[key]):
+            yield self._user(self.order[position])
+
+
+class AncestorIndex:
+
+    # Depths and binary-lifting jump tables over dense user ids: jumps[j][v] is the
+    # ancestor 2**j levels above v, or the root of v's tree when that is closer. Depth,
+    # k-th ancestor, lowest common ancestor and distance take O(log V). Unlike the reach
+    # index it is extended in place: a new user is one more root, and a referral rewrites
+    # the rows of the candidate's tree, parents before children, so a new leaf costs
+    # O(log V). Batches of pairs are answered level by level on NumPy arrays if available.
+
+    def __init__(self, ids, names, parents, order):
+
+        # ids maps users to ids and names is the reverse; parents holds each user's own id
+        # for roots, and order lists every id after its parent
+        self.ids = ids
+        self.names = names
+        self.depths = array('i', bytes(4 * len(parents)))
+        for user_id in order:
+            parent_id = parents[user_id]
+            if parent_id != user_id:
+                self.depths[user_id] = self.depths[parent_id] + 1
+        self.jumps = [array('i', parents)]
+        self._add_levels()
+
+    def __len__(self):
+
+        return len(self.depths)
+
+    def __contains__(self, user):
+
+        return self._key(user) is not None
+
+    def _key(self, user):
+
+        return self.ids.get(user)
+
+    def _user(self, key):
+
+        return self.names[key]
+
+    def _add_levels(self):
+
+        # Enough levels that the highest jump reaches past the deepest user
+        max_depth = max(self.depths, default=0)
+        while 1 << len(self.jumps) <= max_depth:
+            previous = self.jumps[-1]
+            self.jumps.append(array('i', map(previous.__getitem__, previous)))
+
+    # Maintenance
+
+    def add_user(self, user):
+
+        # The names may be shared with the network, which then has registered the user
+        if user not in self.ids:
+            self.ids[user] = len(self.names)
+            self.names.append(user)
+        self._add_root()
+
+    def _add_root(self):
+
+        user_id = len(self.depths)
+        self.depths.append(0)
+        for level in self.jumps:
+            level.append(user_id)
+
+    def link(self, referrer_id, candidate_id, descendant_ids=()):
+
+        # candidate_id's tree now hangs below referrer_id, or stands alone when the two are
+        # equal; descendant_ids is the rest of the tree in BFS order
+        jumps = self.jumps
+        jumps[0][candidate_id] = referrer_id
+        for user_id in itertools.chain((candidate_id,), descendant_ids):
+            parent_id = jumps[0][user_id]
+            depth = 0 if parent_id == user_id else self.depths[parent_id] + 1
+            self.depths[user_id] = depth
+            if 1 << len(jumps) <= depth:
+                self._add_levels()
+            for level in range(1, len(jumps)):
+                jumps[level][user_id] = jumps[level - 1][jumps[level - 1][user_id]]
+
+    def remove_user(self, user):
+
+        # The id is retired as a lone root; nothing points at it any more
+        user_id = self.ids.pop(user)
+        self.names[user_id] = None
+        self.link(user_id, user_id)
+
+    # Queries on ids
+
+    def _ancestor_id(self, user_id, k):
+
+        if k < 0 or k > self.depths[user_id]:
+            return NO_USER
+        while k:
+            level = k.bit_length() - 1
+            user_id = self.jumps[level][user_id]
+            k -= 1 << level
+        return user_id
+
+    def _common_ancestor_id(self, first_id, second_id):
+
+        if self.depths[first_id] < self.depths[second_id]:
+            first_id, second_id = second_id, first_id
+        first_id = self._ancestor_id(first_id, self.depths[first_id] - self.depths[second_id])
+        if first_id == second_id:
+            return first_id
+
+        for level in reversed(self.jumps):
+            if level[first_id] != level[second_id]:
+                first_id, second_id = level[first_id], level[second_id]
+
+        # Below a common parent, or at the roots of two different trees
+        parent_id = self.jumps[0][first_id]
+        return NO_USER if parent_id == first_id else parent_id
+
+    def _common_ancestor_ids(self, first_ids, second_ids):
+
+        # _common_ancestor_id for many pairs at once, one vectorized pass per level
+        depths = np.frombuffer(self.depths, dtype=np.int32)
+        jumps = [np.frombuffer(level, dtype=np.int32) for level in self.jumps]
+        first_depths, second_depths = depths[first_ids], depths[second_ids]
+        swap = first_depths < second_depths
+        deeper = np.where(swap, second_ids, first_ids)
+        shallower = np.where(swap, first_ids, second_ids)
+        difference = np.abs(first_depths - second_depths)
+
+        for level, jump in enumerate(jumps):
+            deeper = np.where((difference >> level) & 1 == 1, jump[deeper], deeper)
+
+        for jump in reversed(jumps):
+            deeper_jump, shallower_jump = jump[deeper], jump[shallower]
+            apart = deeper_jump != shallower_jump
+            deeper = np.where(apart, deeper_jump, deeper)
+            shallower = np.where(apart, shallower_jump, shallower)
+
+        parents = jumps[0][deeper]
+        common = np.where(deeper == shallower, deeper, parents)
+        common[(deeper != shallower) & (parents == deeper)] = NO_USER
+        return common
+
+    # Queries on users
+
+    def depth(self, user):
+
+        key = self._key(user)
+        return None if key is None else self.depths[key]
+
+    def ancestor(self, user, k):
+
+        key = self._key(user)
+        if key is None:
+            return None
+        ancestor_id = self._ancestor_id(key, k)
+        return None if ancestor_id == NO_USER else self._user(ancestor_id)
+
+    def common_ancestor(self, first, second):
+
+        first_key, second_key = self._key(first), self._key(second)
+        if first_key is None or second_key is None:
+            return None
+        common_id = self._common_ancestor_id(first_key, second_key)
+        return None if common_id == NO_USER else self._user(common_id)
+
+    def distance(self, first, second):
+
+        first_key, second_key = self._key(first), self._key(second)
+        if first_key is None or second_key is None:
+            return None
+        common_id = self._common_ancestor_id(first_key, second_key)
+        if common_id == NO_USER:
+            return None
+        return self.depths[first_key] + self.depths[second_key] - 2 * self.depths[common_id]
+
+    def _pair_keys(self, pairs):
+
+        # Unknown users map to NO_USER and are answered as None
+        pairs = list(pairs)
+        return tuple(array('i', map(self.ids.get, users, itertools.repeat(NO_USER))) for users in (map(operator.itemgetter(0), pairs), map(operator.itemgetter(1), pairs)))
+
+    def _common_ancestor_keys(self, first_keys, second_keys):
+
+        if np is None:
+            return [NO_USER if NO_USER in (first_key, second_key) else self._common_ancestor_id(first_key, second_key) for first_key, second_key in zip(first_keys, second_keys)]
+        first_keys = np.frombuffer(first_keys, dtype=np.int32)
+        second_keys = np.frombuffer(second_keys, dtype=np.int32)
+        known = (first_keys != NO_USER) & (second_keys != NO_USER)
+        common = np.full(len(first_keys), NO_USER, dtype=np.int32)
+        common[known] = self._common_ancestor_ids(first_keys[known], second_keys[known])
+        return common
+
+    def common_ancestors(self, pairs):
+
+        first_keys, second_keys = self._pair_keys(pairs)
+        common = self._common_ancestor_keys(first_keys, second_keys)
+        if np is not None:
+            common = common.tolist()
+        names = self.names
+        return [None if common_id == NO_USER else names[common_id] for common_id in common]
+
+    def distances(self, pairs):
+
+        first_keys, second_keys = self._pair_keys(pairs)
+        common = self._common_ancestor_keys(first_keys, second_keys)
+        if np is None:
+            depths = self.depths
+            return [None if common_id == NO_USER else depths[first_key] + depths[second_key] - 2 * depths[common_id] for first_key, second_key, common_id in zip(first_keys, second_keys, common)]
+
+        depths = np.frombuffer(self.depths, dtype=np.int32)
+        found = common != NO_USER
+        distances = np.full(len(common), NO_USER, dtype=np.int32)
+        common = common[found]
+        distances[found] = depths[np.frombuffer(first_keys, dtype=np.int32)[found]] + depths[np.frombuffer(second_keys, dtype=np.int32)[found]] - 2 * depths[common]
+        return [None if distance < 0 else distance for distance in distances.tolist()]
+
+
+class UniqueReachRanker:
+
+    # The ranking of get_influencers_by_unique_reach, repaired as referrals arrive rather
+    # than resorted. Every user reaches strictly more users than any of their referrals, so
+    # the best gain is always a root's, and once a root is picked nothing in its tree adds
+    # coverage while other trees are untouched: the greedy picks exactly the roots with
+    # referrals, by reach and then insertion order. A referral changes the gains of the
+    # candidate's new ancestors only, and of those just the root is ranked; the candidate,
+    # a root until then, drops out. So a refresh re-sorts the touched roots and rebuilds
+    # the ranking from the earliest position any of them held or takes.
+
+    def __init__(self, network):
+
+        self._network = network
+        self._number_users()
+        # Keys whose tree changed since the last refresh
+        self._pending = []
+
+        # (-reach, insertion ordinal, key) of every ranked root, in greedy order
+        network._sync_reach_counts()
+        self._entries = sorted(filter(None, map(self._entry, self._iter_roots())))
+        self._ranked = {entry[2]: entry for entry in self._entries}
+
+    def __len__(self):
+
+        self.refresh()
+        return len(self._entries)
+
+    def __iter__(self):
+
+        self.refresh()
+        return (self._user(key) for _, _, key in list(self._entries))
+
+    def get_influencers(self, k=None):
+
+        self.refresh()
+        return [self._user(key) for _, _, key in self._entries[:k]]
+
+    # Maintenance
+
+    def _number_users(self):
+
+        # Insertion ordinals break ties; they survive removals, which the graph order does not
+        self._ordinals = dict(zip(self._network.graph, itertools.count()))
+        self._next_ordinal = len(self._ordinals)
+
+    def add_user(self, user):
+
+        self._ordinals[user] = self._next_ordinal
+        self._next_ordinal += 1
+
+    def touch(self, key):
+
+        self._pending.append(key)
+
+    def refresh(self):
+
+        if not self._pending:
+            return
+        network = self._network
+        network._sync_reach_counts()
+        touched = set()
+        for key in self._pending:
+            touched.add(key)
+            if self._is_known(key):
+                touched.add(network._find_root(key))
+            else:
+                self._forget(key)
+        self._pending = []
+
+        # Every position before the first one a touched root leaves or takes is unchanged
+        entries = sorted(filter(None, map(self._entry, touched)))
+        start = len(self._entries)
+        for key in touched:
+            entry = self._ranked.pop(key, None)
+            if entry is not None:
+                start = min(start, bisect.bisect_left(self._entries, entry))
+        if entries:
+            start = min(start, bisect.bisect_left(self._entries, entries[0]))
+
+        kept = [entry for entry in self._entries[start:] if entry[2] not in touched]
+        self._entries[start:] = heapq.merge(kept, entries)
+        for entry in entries:
+            self._ranked[entry[2]] = entry
+
+    # Network keys: users here, ids in the array-backed backend
+
+    def _entry(self, key):
+
+        if not self._is_root(key):
+            return None
+        reach = self._network._reach_counts[key]
+        return (-reach, self._ordinal(key), key) if reach else None
+
+    def _iter_roots(self):
+
+        referrers = self._network.referrers
+        return (user for user in self._network.graph if user not in referrers)
+
+    def _is_known(self, key):
+
+        return key in self._network.graph
+
+    def _is_root(self, key):
+
+        return key in self._network.graph and key not in self._network.referrers
+
+    def _forget(self, key):
+
+        # A removed user
+        self._ordinals.pop(key, None)
+
+    def _ordinal(self, key):
+
+        return self._ordinals[key]
+
+    def _user(self, key):
+
+        return key
+
+
+class _CoverageTracker:
+
+    # Tracks covered positions of an Euler-tour order. Reach intervals taken from one
+    # tour are laminar (any two are nested or disjoint), so coverage is a set of disjoint
+    # maximal intervals, and a Fenwick tree holding the newly covered count of every
+    # selected interval at its start position counts the coverage inside any other interval.
+
+    def __init__(self, size):
+
+        self.tree = [0] * (size + 1)
+        self.starts = []
+        self.ends = []
+
+    def count(self, start, end):
+
+        # An interval nested inside a covered one is fully covered
+        position = bisect.bisect_right(self.starts, start) - 1
+        if position >= 0 and self.ends[position] >= end:
+            return end - start
+
+        return self._prefix(end) - self._prefix(start)
+
+    def cover(self, start, end):
+
+        self._add(start, (end - start) - self.count(start, end))
+
+        # The new interval swallows every maximal interval nested inside it
+        first = bisect.bisect_left(self.starts, start)
+        last = bisect.bisect_left(self.starts, end)
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+
+    def _prefix(self, end):
+
+        total = 0
+        while end > 0:
+            total += self.tree[end]
+            end -= end & -end
+        return total
+
+    def _add(self, position, value):
+
+        position += 1
+        while position < len(self.tree):
+            self.tree[position] += value
+            position += position & -position
@@ -0,0 +1,548 @@
+# Asyncio query service over a shared referral network
+#
+# One port speaks both JSON lines ({"id": 1, "op": "reach", "user": "A"} per line, one
+# {"id": 1, "result": ...} or {"id": 1, "error": ...} line back) and HTTP
+# (GET /reach?user=A or POST /reach with a JSON body). Concurrency control:
+#
+#   - reads share a readers-writer lock and run concurrently with each other;
+#   - writes are queued and applied in batches under the write lock, one batch at a time;
+#   - unique reach and flow centrality run in a process pool on a binary snapshot of the
+#     network, so the event loop never blocks on them and writers only wait for the
+#     snapshot to be written, not for the analytics;
+#   - simulation and bonus queries also run in the pool;
+#   - with a write-ahead log, each write batch is one group commit, made on a worker
+#     thread so fsync never blocks the loop, and no write is acknowledged before the
+#     commit is durable.
+#
+#   python -m source.Service serve --port 8765
+#   python -m source.Service load --port 8765 --requests 20000 --concurrency 32
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlsplit
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.Optimization import min_bonus_for_target
+from source.ReferralNetwork import ReferralNetwork
+from source.Simulation import days_to_target, simulate
+from source.WriteAheadLog import WriteAheadLog
+
+# Most queued writes applied under one acquisition of the write lock
+MAX_WRITE_BATCH = 1024
+
+# Longest accepted request line or HTTP body
+MAX_REQUEST_BYTES = 1 << 20
+
+_HTTP_METHODS = (b'GET ', b'POST ', b'HEAD ', b'PUT ', b'DELETE ', b'OPTIONS ')
+
+
+class ServiceError(Exception):
+
+    pass
+
+
+class ReadWriteLock:
+
+    # Many readers or a single writer. Waiting writers block new readers, so a steady
+    # stream of reads cannot starve the write batches.
+
+    def __init__(self):
+
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+
+        async with self._condition:
+            self._waiting_writers += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writing and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class ReferralService:
+
+    def __init__(self, network=None, workers: int | None = None, log=None):
+
+        # log is the WriteAheadLog the network was recovered from, if any
+        self.network = network if network is not None else ReferralNetwork()
+        self.log = log
+        self.lock = ReadWriteLock()
+        self.version = 0
+        self.write_batches = 0
+
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._writes = asyncio.Queue()
+        self._writer_task = None
+        self._server = None
+
+        # Snapshots handed to the process pool: version -> [path, analytics in flight]
+        self._snapshot_directory = tempfile.mkdtemp(prefix='referral-service-')
+        self._snapshots = {}
+        self._snapshot_lock = asyncio.Lock()
+        # Analytics results (or futures for those still running) of the current version
+        self._analytics = {}
+
+        self._reads = {
+            'reach': lambda params: self.network.get_total_referral_count(params['user']),
+            'direct_referrals': lambda params: list(self.network.get_direct_referrals(params['user'])),
+            'top_k': lambda params: self.network.get_top_k_referrers(int(params['k'])),
+            'is_downstream': lambda params: self.network.is_downstream(params['user'], params['ancestor']),
+            # The ranker repairs itself from the writes since the last query, so this stays cheap
+            'unique_reach': lambda params: self.network.unique_reach_ranker.get_influencers(None if params.get('k') is None else int(params['k'])),
+            'stats': lambda params: {
+                'users': len(self.network.graph),
+                'referrals': len(self.network.referrers),
+                'version': self.version,
+            },
+        }
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0):
+
+        self._writer_task = asyncio.create_task(self._apply_writes())
+        self._server = await asyncio.start_server(self._handle_connection, host, port, limit=MAX_REQUEST_BYTES)
+        return self._server
+
+    @property
+    def port(self) -> int:
+
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._writer_task
+        self._executor.shutdown(cancel_futures=True)
+        shutil.rmtree(self._snapshot_directory, ignore_errors=True)
+
+    # Requests
+
+    async def handle(self, op: str, params: dict):
+
+        if op in self._reads:
+            async with self.lock.read():
+                return self._reads[op](params)
+
+        if op in ('add_referral', 'add_user'):
+            future = asyncio.get_running_loop().create_future()
+            await self._writes.put((op, params, future))
+            return await future
+
+        if op == 'flow_centrality':
+            return await self._run_analytics(op, params)
+
+        if op in ('simulate', 'days_to_target', 'min_bonus'):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, _run_simulation, op, params)
+
+        raise ServiceError(f"Unknown operation: {op}")
+
+    async def _apply_writes(self):
+
+        while True:
+            batch = [await self._writes.get()]
+            while len(batch) < MAX_WRITE_BATCH and not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+
+            async with self.lock.write():
+                if self.log is None:
+                    changed, outcomes = self._apply_batch(batch)
+                else:
+                    # Logged writes can flush and fsync as they are appended, or wait for the
+                    # log's timer thread to finish one, so the whole batch runs off the event
+                    # loop. Readers are locked out meanwhile, but the loop keeps serving.
+                    changed, outcomes = await asyncio.to_thread(self._apply_batch, batch)
+
+                for future, result, error in outcomes:
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+
+                self.write_batches += 1
+                if changed:
+                    self.version += 1
+                    self._analytics = {}
+                    self._release_snapshots()
+
+    def _apply_batch(self, batch):
+
+        # Applies a batch of writes and commits it to the log, if any; returns whether the
+        # network changed and a (future, result, error) outcome per write
+        changed = False
+        outcomes = []
+        for op, params, future in batch:
+            try:
+                result = self._apply_write(op, params)
+            except Exception as error:
+                outcomes.append((future, None, error))
+                continue
+            changed = changed or result.get('accepted', False)
+            outcomes.append((future, result, None))
+
+        if self.log is not None:
+            try:
+                self.log.commit()
+            except OSError as error:
+                outcomes = [(future, None, error) for future, _, _ in outcomes]
+        return changed, outcomes
+
+    def _apply_write(self, op, params):
+
+        if op == 'add_user':
+            added = params['user'] not in self.network.graph
+            self.network.add_user(params['user'])
+            return {'accepted': added}
+
+        report = self.network.add_referrals([(params['referrer'], params['candidate'], params.get('timestamp'))])
+        if report.rejected:
+            return {'accepted': False, 'reason': report.rejected[0].reason}
+        return {'accepted': True}
+
+    async def _run_analytics(self, op, params):
+
+        k = params.get('k')
+        key = (op, None if k is None else int(k))
+
+        # Identical queries on the same version share one computation
+        result = self._analytics.get(key)
+        if result is None:
+            result = self._analytics[key] = asyncio.ensure_future(self._compute_analytics(*key))
+        return await asyncio.shield(result)
+
+    async def _compute_analytics(self, op, k):
+
+        version, path = await self._snapshot()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, _run_analytics, path, op, k)
+        finally:
+            self._snapshots[version][1] -= 1
+            self._release_snapshots()
+
+    async def _snapshot(self):
+
+        # Writes the current version to disk once; readers only block writers meanwhile
+        async with self._snapshot_lock:
+            async with self.lock.read():
+                version = self.version
+                if version not in self._snapshots:
+                    path = os.path.join(self._snapshot_directory, f'network-{version}.snapshot')
+                    self.network.reach_counts  # fold pending referrals in on the event loop
+                    await asyncio.to_thread(self.network.save, path)
+                    self._snapshots[version] = [path, 0]
+                self._snapshots[version][1] += 1
+                return version, self._snapshots[version][0]
+
+    def _release_snapshots(self):
+
+        for version, (path, in_flight) in list(self._snapshots.items()):
+            if version != self.version and not in_flight:
+                del self._snapshots[version]
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+    # Protocols
+
+    async def _handle_connection(self, reader, writer):
+
+        try:
+            first_line = await reader.readline()
+            if first_line.startswith(_HTTP_METHODS):
+                await self._serve_http(first_line, reader, writer)
+            else:
+                await self._serve_json_lines(first_line, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _serve_json_lines(self, line, reader, writer):
+
+        while line:
+            if line.strip():
+                response = await self._respond_json_line(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+            line = await reader.readline()
+
+    async def _respond_json_line(self, line):
+
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ServiceError("A request must be a JSON object")
+            request_id = request.pop('id', None)
+            op = request.pop('op', None)
+            return {'id': request_id, 'result': await self.handle(op, request)}
+        except (ServiceError, KeyError, TypeError, ValueError) as error:
+            return {'id': request_id, 'error': _describe(error)}
+
+    async def _serve_http(self, request_line, reader, writer):
+
+        while request_line:
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while (header := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', 0))
+            if length > MAX_REQUEST_BYTES:
+                raise ValueError("Request body too large")
+            body = await reader.readexactly(length) if length else b''
+
+            status, payload = await self._respond_http(method, target, body)
+            data = json.dumps(payload).encode()
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            writer.write(
+                f'{version} {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1') + data
+            )
+            await writer.drain()
+
+            if not keep_alive:
+                break
+            request_line = await reader.readline()
+
+    async def _respond_http(self, method, target, body):
+
+        url = urlsplit(target)
+        op = url.path.strip('/')
+        try:
+            # Query values are JSON where they parse as such (k=10), strings otherwise
+            params = {name: _parse_query_value(value) for name, value in parse_qsl(url.query)}
+            if method == 'POST' and body:
+                payload = json.loads(body)
+                if not isinstance(payload, dict):
+                    raise ServiceError("The request body must be a JSON object")
+                params.update(payload)
+            return '200 OK', {'result': await self.handle(op, params)}
+        except ServiceError as error:
+            status = '404 Not Found' if str(error).startswith('Unknown operation') else '400 Bad Request'
+            return status, {'error': _describe(error)}
+        except (KeyError, TypeError, ValueError) as error:
+            return '400 Bad Request', {'error': _describe(error)}
+
+
+def _describe(error):
+
+    if isinstance(error, KeyError):
+        return f"Missing parameter: {error.args[0]}"
+    return str(error)
+
+
+def _parse_query_value(value):
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+# Process pool workers
+
+# The network of the last snapshot this worker loaded: (path, network)
+_worker_network = (None, None)
+
+
+def _run_analytics(path, op, k):
+
+    global _worker_network
+    if _worker_network[0] != path:
+        _worker_network = (path, CompactReferralNetwork.load(path))
+    network = _worker_network[1]
+
+    ranking = network.get_influencers_by_flow_centrality()
+    return ranking if k is None else ranking[:k]
+
+
+def _run_simulation(op, params):
+
+    if op == 'simulate':
+        return simulate(float(params['p']), int(params['days']))
+    if op == 'days_to_target':
+        return days_to_target(float(params['p']), float(params['target']))
+
+    # The adoption curve is given as [bonus, probability] points and interpolated linearly
+    points = sorted((float(bonus), float(p)) for bonus, p in params['adoption'])
+    if not points:
+        raise ServiceError("The adoption curve needs at least one point")
+
+    def adoption_prob(bonus):
+        for (low_bonus, low_p), (high_bonus, high_p) in zip(points, points[1:]):
+            if bonus <= high_bonus:
+                if bonus <= low_bonus:
+                    return low_p
+                return low_p + (high_p - low_p) * (bonus - low_bonus) / (high_bonus - low_bonus)
+        return points[-1][1] if bonus >= points[-1][0] else points[0][1]
+
+    return min_bonus_for_target(int(params['days']), float(params['target']), adoption_prob)
+
+
+# Load generator
+
+class LoadReport(NamedTuple):
+
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50: float
+    p99: float
+
+
+async def generate_load(host, port, requests=10_000, concurrency=32, write_ratio=0.1, users=1_000, seed=0) -> LoadReport:
+
+    # Each connection sends JSON-line requests back to back: mostly reach and top-k
+    # reads, plus add_referral writes that grow random trees of users
+    rng = random.Random(seed)
+    counts = [requests // concurrency + (connection < requests % concurrency) for connection in range(concurrency)]
+    latencies = []
+    errors = 0
+
+    async def client(count, client_seed):
+        nonlocal errors
+        client_rng = random.Random(client_seed)
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_REQUEST_BYTES)
+        try:
+            for request_id in range(count):
+                roll = client_rng.random()
+                if roll < write_ratio:
+                    candidate = client_rng.randrange(users, users * 1000)
+                    request = {'op': 'add_referral', 'referrer': client_rng.randrange(users), 'candidate': candidate}
+                elif roll < write_ratio + (1 - write_ratio) * 0.1:
+                    request = {'op': 'top_k', 'k': 10}
+                else:
+                    request = {'op': 'reach', 'user': client_rng.randrange(users)}
+                request['id'] = request_id
+
+                start = time.perf_counter()
+                writer.write(json.dumps(request).encode() + b'\n')
+                await writer.drain()
+                response = json.loads(await reader.readline())
+                latencies.append(time.perf_counter() - start)
+                if 'error' in response:
+                    errors += 1
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(count, rng.random()) for count in counts if count))
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))] if latencies else 0.0
+
+    return LoadReport(len(latencies), errors, seconds, len(latencies) / seconds if seconds else 0.0, percentile(50), percentile(99))
+
+
+# Command line
+
+async def _serve(args):
+
+    log = WriteAheadLog(args.log_directory) if args.log_directory else None
+    network = log.recover() if log is not None else ReferralNetwork()
+    if args.referrals:
+        network.add_referrals_from_file(args.referrals)
+
+    service = ReferralService(network, workers=args.workers, log=log)
+    server = await service.start(args.host, args.port)
+    print(f"Serving on {args.host}:{service.port}", flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+        if log is not None:
+            log.close()
+
+
+async def _load(args):
+
+    report = await generate_load(args.host, args.port, args.requests, args.concurrency, args.write_ratio, args.users, args.seed)
+    print(
+        f"{report.requests} requests ({report.errors} errors) in {report.seconds:.2f} s: "
+        f"{report.throughput:.0f} req/s, p50 {report.p50 * 1e3:.2f} ms, p99 {report.p99 * 1e3:.2f} ms"
+    )
+
+
+def main(argv=None) -> int:
+
+    parser = argparse.ArgumentParser(description="Referral network query service.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help="run the service")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--workers', type=int, default=None, help="processes for analytics and simulation")
+    serve.add_argument('--referrals', help="CSV or JSON-lines file of referrals to start from")
+    serve.add_argument('--log-directory', help="recover from and log writes to this write-ahead log directory")
+
+    load = commands.add_parser('load', help="run the load generator against a service")
+    load.add_argument('--host', default='127.0.0.1')
+    load.add_argument('--port', type=int, default=8765)
+    load.add_argument('--requests', type=int, default=10_000)
+    load.add_argument('--concurrency', type=int, default=32)
+    load.add_argument('--write-ratio', type=float, default=0.1)
+    load.add_argument('--users', type=int, default=1_000)
+    load.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args) if args.command == 'serve' else _load(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
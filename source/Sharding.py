@@ -0,0 +1,182 @@
+# Sharded analytics: the influencer rankings over root-tree shards in a process pool
+#
+# The trees of the forest are independent: a user's reach, depth and flow score, and
+# every unique reach gain, depend only on the user's own tree. So the trees are dealt into
+# shards of balanced size, every shard is ranked in a worker process, and the shard
+# rankings are merged exactly:
+#   top-k referrers   the k largest of every shard's top k
+#   unique reach      every shard's roots with referrals by reach, merged. The greedy
+#                     over the whole forest picks exactly those roots in that order
+#   flow centrality   every shard's ranking, merged by score
+# Ties break by insertion order throughout, so the results equal the network's methods.
+#
+# The forest is copied once into shared memory as the id columns of a snapshot; workers
+# attach to it by name rather than receiving pickled graphs. The analytics describe the
+# network as it was when they were created.
+#
+#   with ShardedAnalytics(network, workers=8) as analytics:
+#       analytics.get_influencers_by_unique_reach(100)
+
+import heapq
+import itertools
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from source.Snapshot import NO_USER
+
+# Shards per worker; more, smaller shards let the pool even out the load
+SHARDS_PER_WORKER = 4
+
+TOP_REFERRERS = 'top_referrers'
+UNIQUE_REACH = 'unique_reach'
+FLOW_CENTRALITY = 'flow_centrality'
+
+_COLUMNS = ('parents', 'first_children', 'next_siblings', 'reach_counts')
+
+
+class ShardedAnalytics:
+
+    def __init__(self, network, workers: int | None = None, shards: int | None = None):
+
+        _, columns = network._get_columns()
+        self.names = list(network.graph)
+        self.workers = workers or os.cpu_count() or 1
+        self.shards = _balance_trees(columns['parents'], columns['reach_counts'], shards or self.workers * SHARDS_PER_WORKER)
+
+        user_count = len(self.names)
+        self._memory = shared_memory.SharedMemory(create=True, size=max(4, 4 * len(_COLUMNS) * user_count))
+        view = self._memory.buf.cast('i')
+        for index, column in enumerate(_COLUMNS):
+            view[index * user_count:(index + 1) * user_count] = array('i', columns[column])
+        view.release()
+
+        self._executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 and len(self.shards) > 1 else None
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+    def close(self) -> None:
+
+        if self._memory is None:
+            return
+        if self._executor is not None:
+            self._executor.shutdown()
+        _detach(self._memory.name)
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+    def _rank(self, metric, k):
+
+        if self._memory is None:
+            raise RuntimeError("These analytics are closed")
+        tasks = (itertools.repeat(self._memory.name), itertools.repeat(len(self.names)), self.shards, itertools.repeat(metric), itertools.repeat(k))
+        if self._executor is None:
+            return list(map(_rank_shard, *tasks))
+        return list(self._executor.map(_rank_shard, *tasks))
+
+    def get_top_k_referrers(self, k):
+
+        if k <= 0:
+            return []
+        ranking = heapq.nsmallest(k, itertools.chain.from_iterable(self._rank(TOP_REFERRERS, k)))
+        return [self.names[user_id] for _, user_id in ranking]
+
+    def get_influencers_by_unique_reach(self, k=None):
+
+        ranking = itertools.islice(heapq.merge(*self._rank(UNIQUE_REACH, k)), k)
+        return [self.names[user_id] for _, user_id in ranking]
+
+    def get_influencers_by_flow_centrality(self, k=None):
+
+        ranking = itertools.islice(heapq.merge(*self._rank(FLOW_CENTRALITY, k)), k)
+        return [self.names[user_id] for _, user_id in ranking]
+
+
+def _balance_trees(parents, reach_counts, shard_count):
+
+    # Longest processing time first: the largest remaining tree goes to the lightest shard
+    trees = sorted((user_id for user_id, parent_id in enumerate(parents) if parent_id == NO_USER), key=reach_counts.__getitem__, reverse=True)
+    shards = [[] for _ in range(max(1, min(shard_count, len(trees))))]
+    loads = [(0, index) for index in range(len(shards))]
+    for root_id in trees:
+        load, index = loads[0]
+        shards[index].append(root_id)
+        heapq.heapreplace(loads, (load + reach_counts[root_id] + 1, index))
+    return [shard for shard in shards if shard]
+
+
+# Shared memory attached in this process, by name: the block and its column views
+_attached = {}
+
+
+def _attach(name, user_count):
+
+    if name not in _attached:
+        memory = shared_memory.SharedMemory(name=name)
+        view = memory.buf.cast('i')
+        columns = [view[index * user_count:(index + 1) * user_count] for index in range(len(_COLUMNS))]
+        _attached[name] = (memory, view, columns)
+    return _attached[name][2]
+
+
+def _detach(name):
+
+    if name in _attached:
+        memory, view, columns = _attached.pop(name)
+        for column in columns:
+            column.release()
+        view.release()
+        memory.close()
+
+
+def _rank_shard(name, user_count, root_ids, metric, k):
+
+    # One shard's ranking as (sort key, user id) pairs in merge order: the key is the
+    # negated reach, gain or score, so smaller sorts first and ties go to smaller ids
+    parents, first_children, next_siblings, reach_counts = _attach(name, user_count)
+
+    if metric == UNIQUE_REACH:
+        # The greedy picks the roots with referrals by reach, then id (see
+        # ReferralNetwork.iter_influencers_by_unique_reach), so no tour is needed
+        picks = sorted((-reach_counts[root_id], root_id) for root_id in root_ids if reach_counts[root_id])
+        return picks if k is None else picks[:k]
+
+    order, depths = _get_euler_tour(root_ids, parents, first_children, next_siblings)
+    if metric == TOP_REFERRERS:
+        return heapq.nsmallest(k, zip((-reach_counts[user_id] for user_id in order), order))
+    scores = zip((-depth * reach_counts[user_id] for user_id, depth in zip(order, depths)), order)
+    return sorted(scores) if k is None else heapq.nsmallest(k, scores)
+
+
+def _get_euler_tour(root_ids, parents, first_children, next_siblings):
+
+    # Pre-order of the shard's trees with every user's depth, walked over the sibling links
+    order = []
+    depths = []
+    for root_id in root_ids:
+        current_id = root_id
+        depth = 0
+        while True:
+            order.append(current_id)
+            depths.append(depth)
+            if first_children[current_id] != NO_USER:
+                current_id = first_children[current_id]
+                depth += 1
+                continue
+
+            while current_id != root_id and next_siblings[current_id] == NO_USER:
+                current_id = parents[current_id]
+                depth -= 1
+            if current_id == root_id:
+                break
+            current_id = next_siblings[current_id]
+
+    return order, depths
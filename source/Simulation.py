@@ -1,6 +1,18 @@
 # Part 4: Network Growth Simulation
 
-from collections import deque
+import bisect
+import math
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import NamedTuple
+
+from source.Instrumentation import instrumentation
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batch simulation falls back to the scalar loop
+    np = None
 
 INITIAL_REFERRERS = 100
 REFERRAL_CAPACITY = 10
@@ -8,93 +20,265 @@ REFERRAL_CAPACITY = 10
 MAX_SIMULATION_DAYS = 1000
 
 
-def simulate(p: float, days: int) -> list[float]:
+@dataclass(frozen=True)
+class SimulationConfig:
+
+    initial_referrers: float = INITIAL_REFERRERS
+    referral_capacity: float = REFERRAL_CAPACITY
+    max_simulation_days: int = MAX_SIMULATION_DAYS
+
+
+def _resolve_config(config: SimulationConfig | None) -> SimulationConfig:
+
+    # Without an explicit config the module constants apply, read at call time
+    if config is not None:
+        return config
+    return SimulationConfig(INITIAL_REFERRERS, REFERRAL_CAPACITY, MAX_SIMULATION_DAYS)
+
+
+class _CohortEngine:
+
+    # Every cohort makes p referrals per person per day, so each one retires exactly
+    # `lifetime` days after it is created. Cohort sizes therefore live in a ring buffer
+    # indexed by creation day: the slot a new cohort is written to is the one whose
+    # cohort retires that same day, and the active total is kept as a running sum.
+
+    def __init__(self, p: float, horizon: int, config: SimulationConfig):
+
+        self.p = p
+        self.cohorts = [0.0] * _cohort_lifetime(p, horizon + 1, config.referral_capacity)
+        self.cohorts[0] = float(config.initial_referrers)
+        self.total_active_referrers = float(config.initial_referrers)
+        self.cumulative_referrals = 0.0
+        self.day = 0
+
+    @property
+    def exhausted(self) -> bool:
+
+        return self.total_active_referrers < 1
+
+    def step(self) -> float:
+
+        self.day += 1
+        if self.exhausted:
+            return self.cumulative_referrals
+
+        # 1. Calculate new referrals for today
+        new_referrals_today = self.total_active_referrers * self.p
+        self.cumulative_referrals += new_referrals_today
+
+        # 2. Retire the cohort that reaches its referral capacity today, and
+        # 3. add the new cohort in its place
+        slot = self.day % len(self.cohorts)
+        self.total_active_referrers -= self.cohorts[slot]
+        self.cohorts[slot] = new_referrals_today
+        self.total_active_referrers += new_referrals_today
+
+        return self.cumulative_referrals
+
+
+def _cohort_lifetime(p: float, limit: int, referral_capacity: float) -> int:
+
+    # Days until a cohort reaches its referral capacity, found with the same repeated float
+    # additions the day-by-day model performs, capped at limit. A lifetime past the
+    # horizon means no cohort ever retires, and a buffer of horizon + 1 slots then only
+    # ever holds each cohort once.
+    referrals_made = 0.0
+    for day in range(1, limit):
+        referrals_made += p
+        if referrals_made >= referral_capacity:
+            return day
+    return max(limit, 1)
+
+
+@instrumentation.timed('simulate')
+def simulate(p: float, days: int, config: SimulationConfig | None = None) -> list[float]:
     
     if p <= 0 or days <= 0:
         return [0.0] * days
 
-    # A deque to manage cohorts of active referrers.
-    active_cohorts = deque([(INITIAL_REFERRERS, 0)])
-    
-    total_active_referrers = float(INITIAL_REFERRERS)
-    cumulative_referrals = 0.0
-    daily_cumulative_totals = []
+    engine = _CohortEngine(p, days, _resolve_config(config))
+    if not instrumentation.enabled:
+        return [engine.step() for _ in range(days)]
 
+    # Cohorts alive after each day: those created within the last lifetime, none once frozen
+    daily_cumulative_totals = []
     for _ in range(days):
-
-        if total_active_referrers < 1:
-            daily_cumulative_totals.append(cumulative_referrals)
-            continue
-
-        # 1. Calculate new referrals for today
-        new_referrals_today = total_active_referrers * p
-        cumulative_referrals += new_referrals_today
-        daily_cumulative_totals.append(cumulative_referrals)
-        
-        # 2. Age and retire existing cohorts
-        temp_cohorts = deque()
-        while active_cohorts:
-            count, referrals_made = active_cohorts.popleft()
-            
-            # For convenience, each person in the cohort makes 'p' more referrals
-            new_referrals_for_this_cohort = referrals_made + p
-            
-            if new_referrals_for_this_cohort < REFERRAL_CAPACITY:
-                temp_cohorts.append((count, new_referrals_for_this_cohort))
-            else:
-                # If the group exceeds referral capacity, we make that group unactive
-                total_active_referrers -= count
-        
-        active_cohorts = temp_cohorts
-
-        # 3. Add the new cohort for the next day
-        if new_referrals_today > 0:
-            active_cohorts.append((new_referrals_today, 0.0))
-            total_active_referrers += new_referrals_today
-        
+        daily_cumulative_totals.append(engine.step())
+        instrumentation.observe('simulate.cohorts_per_day', 0 if engine.exhausted else min(engine.day + 1, len(engine.cohorts)))
     return daily_cumulative_totals
 
 
-def days_to_target(p: float, target_total: int) -> int:
+@instrumentation.timed('days_to_target')
+def days_to_target(p: float, target_total: int, config: SimulationConfig | None = None) -> int:
 
     if target_total <= 0:
         return 0
     if p <= 0:
         return -1 
 
-    active_cohorts = deque([(INITIAL_REFERRERS, 0)])
-    total_active_referrers = float(INITIAL_REFERRERS)
-    cumulative_referrals = 0.0
-    days_elapsed = 0
+    return growth_curve_cache.days_to_target(p, target_total, config)
 
-    while cumulative_referrals < target_total:
-        days_elapsed += 1
-        
-        if days_elapsed > MAX_SIMULATION_DAYS:
-            return -1
 
-        if total_active_referrers < 1:
-            return -1
+# Growth curve cache
 
-        # 1. Calculate new referrals for today
-        new_referrals_today = total_active_referrers * p
-        cumulative_referrals += new_referrals_today
-        
-        # 2. Age and retire existing cohorts
-        temp_cohorts = deque()
-        while active_cohorts:
-            count, referrals_made = active_cohorts.popleft()
-            new_referrals_for_this_cohort = referrals_made + p
-            if new_referrals_for_this_cohort < REFERRAL_CAPACITY:
-                temp_cohorts.append((count, new_referrals_for_this_cohort))
-            else:
-                total_active_referrers -= count
-        
-        active_cohorts = temp_cohorts
-
-        # 3. Add the new cohort for the next day
-        if new_referrals_today > 0:
-            active_cohorts.append((new_referrals_today, 0))
+class CurveCacheInfo(NamedTuple):
+
+    hits: int
+    misses: int
+    evictions: int
+    curves: int
+    cached_days: int
+    max_cached_days: int
+
+
+class _GrowthCurve:
+
+    # Cumulative totals for one p, extended lazily. The curve is monotone, so the first
+    # day reaching a target is a bisect once the curve is long enough.
+
+    def __init__(self, p: float, config: SimulationConfig):
+
+        self.max_days = config.max_simulation_days
+        self.engine = _CohortEngine(p, self.max_days, config)
+        self.totals = array('d')
+
+    def days_to_target(self, target_total: float, within_days: int | None = None) -> int:
+
+        # within_days stops the curve from being extended past that day
+        limit = self.max_days if within_days is None else min(within_days, self.max_days)
+        while self.engine is not None and (not self.totals or self.totals[-1] < target_total):
+            if self.engine.day >= self.max_days or self.engine.exhausted:
+                # The curve is final; the engine's ring buffer is no longer needed
+                self.engine = None
+                break
+            if len(self.totals) >= limit:
+                break
+            self.totals.append(self.engine.step())
+
+        days = bisect.bisect_left(self.totals, target_total) + 1
+        return days if days <= min(len(self.totals), limit) else -1
+
+    @property
+    def size(self) -> int:
+
+        return len(self.totals) + (len(self.engine.cohorts) if self.engine is not None else 0)
+
+
+class GrowthCurveCache:
+
+    # LRU cache of growth curves keyed by p and the simulation config. The memory
+    # cap counts stored floats (curve days plus live ring-buffer slots) across all curves.
+
+    def __init__(self, max_cached_days: int = 1_000_000):
+
+        self.max_cached_days = max_cached_days
+        self._curves = OrderedDict()
+        self._cached_days = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def days_to_target(self, p: float, target_total: float, config: SimulationConfig | None = None, within_days: int | None = None) -> int:
+
+        config = _resolve_config(config)
+        key = (p, config)
+        curve = self._curves.get(key)
+        if curve is None:
+            self.misses += 1
+            curve = self._curves[key] = _GrowthCurve(p, config)
+            size_before = 0
+        else:
+            self.hits += 1
+            self._curves.move_to_end(key)
+            size_before = curve.size
+
+        if instrumentation.enabled:
+            curve_days_before = len(curve.totals)
+        days = curve.days_to_target(target_total, within_days)
+        self._cached_days += curve.size - size_before
+        if instrumentation.enabled:
+            instrumentation.increment('GrowthCurveCache.days_simulated', len(curve.totals) - curve_days_before)
+
+        # Evict least recently used curves, never the one just used
+        while self._cached_days > self.max_cached_days and len(self._curves) > 1:
+            _, evicted = self._curves.popitem(last=False)
+            self._cached_days -= evicted.size
+            self.evictions += 1
+
+        return days
+
+    def info(self) -> CurveCacheInfo:
+
+        return CurveCacheInfo(self.hits, self.misses, self.evictions, len(self._curves), self._cached_days, self.max_cached_days)
+
+    def clear(self) -> None:
+
+        self._curves.clear()
+        self._cached_days = 0
+        self.hits = self.misses = self.evictions = 0
+
+
+growth_curve_cache = GrowthCurveCache()
+
+
+# Batch simulation
+
+@instrumentation.timed('simulate_batch')
+def simulate_batch(ps, days, config: SimulationConfig | None = None):
+
+    # Simulates many adoption probabilities in lockstep. days is a single horizon or one
+    # per scenario; row i holds simulate(ps[i], days[i]) padded with NaN to the longest
+    # horizon. Returns a NumPy array, or a list of lists when NumPy is not installed.
+    config = _resolve_config(config)
+    ps = list(ps)
+    horizons = list(days) if hasattr(days, '__len__') else [days] * len(ps)
+    horizons = [max(int(horizon), 0) for horizon in horizons]
+    longest = max(horizons, default=0)
+
+    if np is None:
+        return [simulate(p, horizon, config) + [math.nan] * (longest - horizon) for p, horizon in zip(ps, horizons)]
+
+    ps = np.asarray(ps, dtype=float)
+    scenarios = np.arange(len(ps))
+
+    # Every cohort ages by p per day, so it retires a fixed number of days after it is
+    # created. The count is found with the same repeated float additions as simulate.
+    lifetimes = np.full(len(ps), longest + 1)
+    referrals_made = np.zeros(len(ps))
+    ageing = ps > 0
+    for day in range(1, longest + 1):
+        if not ageing.any():
+            break
+        referrals_made = referrals_made + ps
+        retired = ageing & (referrals_made >= config.referral_capacity)
+        lifetimes[retired] = day
+        ageing &= ~retired
+
+    # cohort_sizes[:, d] is the cohort created on day d; day 0 holds the initial referrers
+    cohort_sizes = np.zeros((len(ps), longest + 1))
+    cohort_sizes[:, 0] = config.initial_referrers
+    total_active_referrers = np.where(ps > 0, float(config.initial_referrers), 0.0)
+    cumulative_referrals = np.zeros(len(ps))
+    daily_cumulative_totals = np.zeros((len(ps), longest))
+
+    # Float overflow is expected on long horizons at high p and ends in inf or nan, as in simulate().
+    # A nan total is not below one referrer, so such scenarios keep running, as in simulate()
+    with np.errstate(over='ignore', invalid='ignore'):
+        for day in range(1, longest + 1):
+            # Scenarios with less than one active referrer stay frozen, as in simulate
+            running = ~(total_active_referrers < 1)
+
+            new_referrals_today = np.where(running, total_active_referrers * ps, 0.0)
+            cumulative_referrals += new_referrals_today
+            daily_cumulative_totals[:, day - 1] = cumulative_referrals
+
+            created = day - lifetimes
+            retiring = running & (created >= 0)
+            total_active_referrers[retiring] -= cohort_sizes[scenarios[retiring], created[retiring]]
+
+            cohort_sizes[:, day] = new_referrals_today
             total_active_referrers += new_referrals_today
 
-    return days_elapsed
\ No newline at end of file
+    daily_cumulative_totals[np.arange(longest) >= np.asarray(horizons)[:, None]] = np.nan
+    return daily_cumulative_totals
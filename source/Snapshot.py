@@ -0,0 +1,249 @@
+# Binary snapshots of a referral network
+#
+# Layout (little-endian), every section padded to 8 bytes:
+#   header        magic, version, flags, user count, referral count, hash slot count,
+#                 name blob size, CRC-32 of everything after the header
+#   parents, first_children, last_children, next_siblings, reach_counts   int32[users]
+#   referral_order                                                         int32[referrals]
+#   name_offsets                                                           int64[users + 1]
+#   name_kinds                                                             uint8[users]
+#   hash_slots    open-addressing table of user ids keyed by CRC-32 of the encoded name
+#   name_blob     encoded names, back to back
+#   referral_times                                                         float64[referrals]
+#                 only with FLAG_REFERRAL_TIMES; the time of each referral in referral_order
+#
+# Loading can memory-map the file, in which case names and id lookups are decoded on
+# demand from the mapped pages and several processes share them read-only.
+
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+from collections.abc import Mapping, Sequence
+
+SNAPSHOT_MAGIC = b'RFNS'
+SNAPSHOT_VERSION = 1
+
+_HEADER = struct.Struct('<4sHHQQQQI')
+
+# How user names are encoded in the name blob
+_NAME_STR = 0
+_NAME_INT = 1
+
+# Header flags
+FLAG_REFERRAL_TIMES = 1
+
+_ID_COLUMNS = ('parents', 'first_children', 'last_children', 'next_siblings', 'reach_counts')
+
+NO_USER = -1
+
+
+def _encode_name(name):
+
+    if isinstance(name, str):
+        return _NAME_STR, name.encode('utf-8')
+    if isinstance(name, int) and not isinstance(name, bool):
+        return _NAME_INT, str(name).encode('ascii')
+    raise ValueError(f"Snapshots only support str and int user names, got {type(name).__name__}")
+
+
+def _decode_name(kind, data):
+
+    if kind == _NAME_INT:
+        return int(data)
+    return str(data, 'utf-8')
+
+
+def _name_hash(kind, data):
+
+    return zlib.crc32(data, kind)
+
+
+def _padding(size):
+
+    return -size % 8
+
+
+def _little_endian(values):
+
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def write_snapshot(path: str, names, columns: dict, referral_order, referral_times=None) -> None:
+
+    user_count = len(names)
+    slot_count = 1
+    while slot_count < 2 * user_count:
+        slot_count *= 2
+
+    name_offsets = array('q', [0])
+    name_kinds = bytearray()
+    hash_slots = array('i', [NO_USER]) * slot_count
+    blob = bytearray()
+
+    for user_id, name in enumerate(names):
+        kind, data = _encode_name(name)
+        blob += data
+        name_offsets.append(len(blob))
+        name_kinds.append(kind)
+
+        slot = _name_hash(kind, data) & (slot_count - 1)
+        while hash_slots[slot] != NO_USER:
+            slot = (slot + 1) & (slot_count - 1)
+        hash_slots[slot] = user_id
+
+    sections = [array('i', columns[column]) for column in _ID_COLUMNS]
+    sections += [array('i', referral_order), name_offsets, bytes(name_kinds), hash_slots, bytes(blob)]
+    flags = 0
+    if referral_times is not None:
+        sections.append(array('d', referral_times))
+        flags |= FLAG_REFERRAL_TIMES
+
+    payload = bytearray()
+    for section in sections:
+        data = _little_endian(section).tobytes() if isinstance(section, array) else section
+        payload += data
+        payload += bytes(_padding(len(data)))
+
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, flags, user_count, len(referral_order),
+        slot_count, len(blob), zlib.crc32(payload),
+    )
+    with open(path, 'wb') as file:
+        file.write(header)
+        file.write(payload)
+
+
+class Snapshot:
+
+    # A parsed snapshot. With use_mmap the columns are int32 memoryviews over the
+    # mapped file; otherwise they are private writable arrays.
+
+    def __init__(self, path: str, use_mmap: bool = True, verify: bool = True):
+
+        with open(path, 'rb') as file:
+            if use_mmap:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = file.read()
+
+        view = memoryview(buffer)
+        if len(view) < _HEADER.size:
+            raise ValueError(f"Not a referral network snapshot: {path}")
+
+        magic, version, flags, user_count, referral_count, slot_count, blob_size, checksum = _HEADER.unpack_from(view)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Not a referral network snapshot: {path}")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version}, expected {SNAPSHOT_VERSION}")
+        if verify and zlib.crc32(view[_HEADER.size:]) != checksum:
+            raise ValueError(f"Snapshot checksum mismatch: {path}")
+
+        self.user_count = user_count
+        self.referral_count = referral_count
+        self._buffer = buffer
+
+        offset = _HEADER.size
+        sizes = [('i', user_count)] * len(_ID_COLUMNS)
+        sizes += [('i', referral_count), ('q', user_count + 1), ('B', user_count), ('i', slot_count), ('B', blob_size)]
+        if flags & FLAG_REFERRAL_TIMES:
+            sizes.append(('d', referral_count))
+
+        sections = []
+        for typecode, count in sizes:
+            size = count * struct.calcsize(typecode)
+            section = view[offset:offset + size]
+            if len(section) != size:
+                raise ValueError(f"Truncated snapshot: {path}")
+            sections.append(self._column(section, typecode, use_mmap))
+            offset += size + _padding(size)
+
+        for column, section in zip(_ID_COLUMNS, sections):
+            setattr(self, column, section)
+        self.referral_order, self._name_offsets, self._name_kinds, self._hash_slots, self._name_blob = sections[len(_ID_COLUMNS):len(_ID_COLUMNS) + 5]
+        # Timestamps of the referrals in referral_order, or None if they were not saved
+        self.referral_times = sections[len(_ID_COLUMNS) + 5] if flags & FLAG_REFERRAL_TIMES else None
+
+        self.names = _SnapshotNames(self)
+        self.ids = _SnapshotIds(self)
+
+    @staticmethod
+    def _column(section, typecode, use_mmap):
+
+        if typecode == 'B':
+            return section
+        if use_mmap and sys.byteorder == 'little':
+            return section.cast(typecode)
+
+        values = array(typecode, section.tobytes())
+        return _little_endian(values)
+
+    def _name_bytes(self, user_id):
+
+        return bytes(self._name_blob[self._name_offsets[user_id]:self._name_offsets[user_id + 1]])
+
+    def name(self, user_id):
+
+        return _decode_name(self._name_kinds[user_id], self._name_bytes(user_id))
+
+    def find(self, name):
+
+        try:
+            kind, data = _encode_name(name)
+        except ValueError:
+            return None
+
+        mask = len(self._hash_slots) - 1
+        slot = _name_hash(kind, data) & mask
+        while True:
+            user_id = self._hash_slots[slot]
+            if user_id == NO_USER:
+                return None
+            if self._name_kinds[user_id] == kind and self._name_bytes(user_id) == data:
+                return user_id
+            slot = (slot + 1) & mask
+
+
+class _SnapshotNames(Sequence):
+
+    def __init__(self, snapshot):
+
+        self._snapshot = snapshot
+
+    def __getitem__(self, user_id):
+
+        if isinstance(user_id, slice):
+            return [self[index] for index in range(*user_id.indices(len(self)))]
+        if not 0 <= user_id < len(self):
+            raise IndexError(user_id)
+        return self._snapshot.name(user_id)
+
+    def __len__(self):
+
+        return self._snapshot.user_count
+
+
+class _SnapshotIds(Mapping):
+
+    def __init__(self, snapshot):
+
+        self._snapshot = snapshot
+
+    def __getitem__(self, name):
+
+        user_id = self._snapshot.find(name)
+        if user_id is None:
+            raise KeyError(name)
+        return user_id
+
+    def __iter__(self):
+
+        return iter(self._snapshot.names)
+
+    def __len__(self):
+
+        return self._snapshot.user_count
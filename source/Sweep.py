@@ -0,0 +1,123 @@
+# Part 4: Parameter sweeps
+#
+# Runs simulate() over grids of adoption probability, referral capacity, initial
+# referrers and horizon. Scenarios that must produce the same curve are simulated once:
+# capacity only matters through the day a cohort retires, and a shorter horizon is a
+# prefix of a longer one, so every horizon of an equivalent group is read off one curve.
+
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from source.Simulation import INITIAL_REFERRERS, REFERRAL_CAPACITY, SimulationConfig, _cohort_lifetime, simulate
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional; only write_sweep_parquet needs it
+    pyarrow = None
+
+# Equivalent-scenario groups simulated per task sent to the process pool
+GROUPS_PER_TASK = 64
+
+SWEEP_FIELDS = ('p', 'referral_capacity', 'initial_referrers', 'days', 'total_referrals')
+
+
+class SweepResult(NamedTuple):
+
+    p: float
+    referral_capacity: float
+    initial_referrers: float
+    days: int
+    total_referrals: float
+
+
+def run_sweep(ps, days, capacities=(REFERRAL_CAPACITY,), initial_referrers=(INITIAL_REFERRERS,), workers=None):
+
+    # Yields one SweepResult per point of the grid, a group of equivalent scenarios at a
+    # time, so results can be written out while the rest of the sweep is still running
+    ps, capacities, initial_referrers = list(ps), list(capacities), list(initial_referrers)
+    horizons = sorted({max(int(horizon), 0) for horizon in days})
+    longest = horizons[-1] if horizons else 0
+
+    groups = {}
+    for p, capacity, initial in itertools.product(ps, capacities, initial_referrers):
+        # Lifetimes past the longest horizon all come out as longest + 1: no cohort retires
+        lifetime = _cohort_lifetime(p, longest + 1, capacity) if p > 0 else 0
+        group = groups.setdefault((p, lifetime, initial), (SimulationConfig(initial, capacity, longest), []))
+        group[1].append(capacity)
+
+    tasks = list(groups.items())
+    tasks = [tasks[start:start + GROUPS_PER_TASK] for start in range(0, len(tasks), GROUPS_PER_TASK)]
+    tasks = [([(p, config) for (p, _, _), (config, _) in task], horizons) for task in tasks]
+
+    workers = workers or os.cpu_count() or 1
+    executor = None
+    if workers == 1 or len(tasks) <= 1:
+        chunks = (_simulate_groups(*task) for task in tasks)
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(tasks)))
+        chunks = executor.map(_simulate_groups, *zip(*tasks))
+
+    group_list = iter(groups.items())
+    try:
+        for chunk in chunks:
+            for totals, ((p, _, initial), (_, group_capacities)) in zip(chunk, group_list):
+                for capacity in group_capacities:
+                    for horizon, total in zip(horizons, totals):
+                        yield SweepResult(p, capacity, initial, horizon, total)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def _simulate_groups(groups, horizons):
+
+    # Total referrals at each horizon for every (p, config) group
+    results = []
+    for p, config in groups:
+        curve = simulate(p, horizons[-1], config) if horizons else []
+        results.append([curve[horizon - 1] if horizon else 0.0 for horizon in horizons])
+    return results
+
+
+def write_sweep_csv(results, path: str) -> int:
+
+    # Streams sweep results to a CSV file with a header row; returns the number of rows
+    count = 0
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(SWEEP_FIELDS)
+        for result in results:
+            writer.writerow(result)
+            count += 1
+    return count
+
+
+def write_sweep_parquet(results, path: str, batch_size: int = 65_536) -> int:
+
+    # Streams sweep results to a Parquet file in row groups of batch_size rows
+    if pyarrow is None:
+        raise ImportError("write_sweep_parquet requires pyarrow")
+
+    schema = pyarrow.schema([
+        ('p', pyarrow.float64()),
+        ('referral_capacity', pyarrow.float64()),
+        ('initial_referrers', pyarrow.float64()),
+        ('days', pyarrow.int64()),
+        ('total_referrals', pyarrow.float64()),
+    ])
+
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        results = iter(results)
+        while True:
+            batch = list(itertools.islice(results, batch_size))
+            if not batch:
+                break
+            columns = [list(column) for column in zip(*batch)]
+            writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+            count += len(batch)
+    return count
@@ -0,0 +1,378 @@
+# Append-only write-ahead log of accepted referrals, with snapshot compaction
+#
+# A log directory holds at most one snapshot and one log per generation:
+#   snapshot-<generation>.snapshot   the network as of the start of the generation
+#   log-<generation>.wal             users and referrals added since, in order
+#
+# Log layout (little-endian): a header (magic, version, flags, generation) followed by
+# frames, one per group commit: payload size, CRC-32 of the payload, then the records.
+#   user record       type 0, name kind, name size, name
+#   referral record   type 1, referrer kind and size, candidate kind and size, both names
+#   timed referral    type 2, as type 1 with the float64 time of the referral before the names
+#   removal           type 3, name kind and size, whether referrals were promoted, name
+#   move              type 4, laid out as a timed referral to the new referrer
+#
+# Appends are buffered and written with a single fsync per commit, which happens when the
+# buffer is full, on commit(), or at the latest sync_interval after the first buffered
+# record: a background timer commits a buffer that no later append flushes. Only records that were
+# validated when they were added are logged, so replay applies them without re-checking.
+# A torn frame at the end of the log (a crash mid-commit) is dropped on recovery.
+#
+#   log = WriteAheadLog('data/referrals')
+#   network = log.recover()
+#   network.add_referral('A', 'B')
+#   log.close()
+
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.ReferralNetwork import ReferralNetwork
+from source.Snapshot import _NAME_INT, _encode_name
+
+LOG_MAGIC = b'RFNL'
+LOG_VERSION = 1
+
+# Longest a logged record waits for its fsync, idle or not, and most bytes buffered before one
+DEFAULT_SYNC_INTERVAL = 0.01
+DEFAULT_MAX_BUFFER_BYTES = 1 << 20
+
+# Logged records after which the next commit compacts the log into a snapshot
+DEFAULT_COMPACT_EVERY = 1_000_000
+
+_LOG_HEADER = struct.Struct('<4sHHQ')
+_FRAME = struct.Struct('<II')
+_USER_RECORD = struct.Struct('<BBI')
+_REFERRAL_RECORD = struct.Struct('<BBIBI')
+_TIMED_REFERRAL_RECORD = struct.Struct('<BBIBId')
+_REMOVAL_RECORD = struct.Struct('<BBIB')
+
+_USER = 0
+_REFERRAL = 1
+_TIMED_REFERRAL = 2
+_REMOVAL = 3
+_MOVE = 4
+
+_FILE_PATTERN = re.compile(r'(snapshot|log)-(\d+)\.(snapshot|wal)$')
+
+
+class WriteAheadLog:
+
+    def __init__(self, directory: str, sync_interval: float = DEFAULT_SYNC_INTERVAL, max_buffer_bytes: int = DEFAULT_MAX_BUFFER_BYTES,
+                 compact_every: int | None = DEFAULT_COMPACT_EVERY, fsync: bool = True):
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.max_buffer_bytes = max_buffer_bytes
+        self.compact_every = compact_every
+        self.fsync = fsync
+
+        self.network = None
+        self.generation = 0
+        # Records in the current generation's log, and commits made since opening
+        self.records = 0
+        self.commits = 0
+
+        self._file = None
+        self._buffer = bytearray()
+        self._buffered_records = 0
+        self._last_commit = time.monotonic()
+
+        # The flush timer commits from its own thread, so appends and commits share a lock.
+        # It only writes the buffer; compaction waits for the next foreground commit.
+        self._lock = threading.RLock()
+        self._flush_timer = None
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+    def _path(self, kind, generation):
+
+        extension = 'snapshot' if kind == 'snapshot' else 'wal'
+        return os.path.join(self.directory, f'{kind}-{generation:020d}.{extension}')
+
+    # Recovery
+
+    def recover(self, network_class=ReferralNetwork):
+
+        # Loads the latest snapshot, replays its log on top and attaches the log to the
+        # returned network, so every user and referral it accepts from now on is logged
+        if self.network is not None:
+            raise RuntimeError("This log is already attached to a network")
+
+        snapshots = [generation for kind, generation in self._list_files() if kind == 'snapshot']
+        self.generation = max(snapshots, default=0)
+
+        snapshot_path = self._path('snapshot', self.generation)
+        if os.path.exists(snapshot_path):
+            if issubclass(network_class, CompactReferralNetwork):
+                network = network_class.load(snapshot_path, use_mmap=False)
+            else:
+                network = network_class.load(snapshot_path)
+        else:
+            network = network_class()
+
+        log_path = self._path('log', self.generation)
+        self.records, valid_size = _replay(network, log_path, self.generation) if os.path.exists(log_path) else (0, 0)
+        if valid_size:
+            # Anything past the last complete frame is a torn commit; cut it off
+            self._file = open(log_path, 'r+b')
+            self._file.truncate(valid_size)
+            self._file.seek(valid_size)
+        else:
+            self._open_log(self.generation)
+
+        self._remove_other_generations()
+        network._log = self
+        self.network = network
+        return network
+
+    def _list_files(self):
+
+        files = []
+        for name in os.listdir(self.directory):
+            match = _FILE_PATTERN.match(name)
+            if match:
+                files.append((match.group(1), int(match.group(2))))
+        return files
+
+    def _remove_other_generations(self):
+
+        for kind, generation in self._list_files():
+            if generation != self.generation:
+                os.remove(self._path(kind, generation))
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self.directory, name))
+
+    def _open_log(self, generation):
+
+        self._file = open(self._path('log', generation), 'wb')
+        self._file.write(_LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, 0, generation))
+        self._sync_file(self._file)
+        self._sync_directory()
+
+    def _sync_file(self, file):
+
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    def _sync_directory(self):
+
+        # Makes created and renamed files durable; not every platform can open a directory
+        if not self.fsync:
+            return
+        try:
+            descriptor = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+    # Appending
+
+    def append_user(self, user) -> None:
+
+        kind, data = _encode_name(user)
+        self._append(_USER_RECORD.pack(_USER, kind, len(data)) + data)
+
+    def append_referral(self, referrer, candidate, timestamp=None) -> None:
+
+        if timestamp is None:
+            self._append_pair(_REFERRAL_RECORD, _REFERRAL, referrer, candidate)
+        else:
+            self._append_pair(_TIMED_REFERRAL_RECORD, _TIMED_REFERRAL, referrer, candidate, timestamp)
+
+    def append_move(self, referrer, candidate, timestamp) -> None:
+
+        self._append_pair(_TIMED_REFERRAL_RECORD, _MOVE, referrer, candidate, timestamp)
+
+    def append_removal(self, user, promote_referrals) -> None:
+
+        kind, data = _encode_name(user)
+        self._append(_REMOVAL_RECORD.pack(_REMOVAL, kind, len(data), promote_referrals) + data)
+
+    def _append_pair(self, record, record_type, referrer, candidate, *fields):
+
+        referrer_kind, referrer_data = _encode_name(referrer)
+        candidate_kind, candidate_data = _encode_name(candidate)
+        header = record.pack(record_type, referrer_kind, len(referrer_data), candidate_kind, len(candidate_data), *fields)
+        self._append(header + referrer_data + candidate_data)
+
+    def _append(self, record):
+
+        with self._lock:
+            self._buffer += record
+            self._buffered_records += 1
+            if len(self._buffer) >= self.max_buffer_bytes or time.monotonic() - self._last_commit >= self.sync_interval:
+                self.commit()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.sync_interval, self._flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush(self):
+
+        # Runs on the timer thread once sync_interval has passed since the first unflushed append
+        with self._lock:
+            self._flush_timer = None
+            if self._file is not None:
+                self._write_buffer()
+
+    def commit(self) -> None:
+
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            self._write_buffer()
+            if self.compact_every is not None and self.records >= self.compact_every:
+                self.compact()
+
+    def _write_buffer(self):
+
+        # Group commit: everything appended since the last commit shares one write and fsync
+        self._last_commit = time.monotonic()
+        if not self._buffered_records:
+            return
+        if self._file is None:
+            raise RuntimeError("The log is not open; recover() opens it")
+
+        self._file.write(_FRAME.pack(len(self._buffer), zlib.crc32(self._buffer)))
+        self._file.write(self._buffer)
+        self._sync_file(self._file)
+
+        self.records += self._buffered_records
+        self.commits += 1
+        self._buffer.clear()
+        self._buffered_records = 0
+
+    def compact(self) -> None:
+
+        # Starts a new generation from a snapshot of the network. The snapshot is complete
+        # and durable before the new log exists, and the old files are only removed after,
+        # so a crash at any point recovers one consistent generation.
+        with self._lock:
+            self._write_buffer()
+            generation = self.generation + 1
+            snapshot_path = self._path('snapshot', generation)
+            temporary_path = snapshot_path + '.tmp'
+
+            self.network.save(temporary_path)
+            with open(temporary_path, 'rb') as file:
+                if self.fsync:
+                    os.fsync(file.fileno())
+            os.replace(temporary_path, snapshot_path)
+
+            self._file.close()
+            self._open_log(generation)
+            self.generation = generation
+            self.records = 0
+            self._remove_other_generations()
+
+    def close(self) -> None:
+
+        with self._lock:
+            if self._file is None:
+                return
+            self.commit()
+            self._file.close()
+            self._file = None
+        if self.network is not None:
+            self.network._log = None
+            self.network = None
+
+
+def _replay(network, path, generation):
+
+    # Applies every complete frame of the log to network. Returns the number of records
+    # applied and the size of the valid prefix of the file (0 if even the header is torn).
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    if len(data) < _LOG_HEADER.size:
+        return 0, 0
+    magic, version, _, log_generation = _LOG_HEADER.unpack_from(data)
+    if magic != LOG_MAGIC:
+        raise ValueError(f"Not a referral write-ahead log: {path}")
+    if version != LOG_VERSION:
+        raise ValueError(f"Unsupported log version {version}, expected {LOG_VERSION}")
+    if log_generation != generation:
+        raise ValueError(f"Log {path} belongs to generation {log_generation}, expected {generation}")
+
+    records = 0
+    position = _LOG_HEADER.size
+    while position + _FRAME.size <= len(data):
+        size, checksum = _FRAME.unpack_from(data, position)
+        payload = data[position + _FRAME.size:position + _FRAME.size + size]
+        if len(payload) != size or zlib.crc32(payload) != checksum:
+            break
+        records += _apply_records(network, payload)
+        position += _FRAME.size + size
+
+    return records, position
+
+
+def _apply_records(network, payload):
+
+    # The hot loop of recovery, hence the local bindings and inlined name decoding
+    add_user = network.add_user
+    replay_referral = network._replay_referral
+    unpack_removal = _REMOVAL_RECORD.unpack_from
+    unpack_user = _USER_RECORD.unpack_from
+    unpack_referral = _REFERRAL_RECORD.unpack_from
+    unpack_timed_referral = _TIMED_REFERRAL_RECORD.unpack_from
+    user_size = _USER_RECORD.size
+    referral_size = _REFERRAL_RECORD.size
+    timed_referral_size = _TIMED_REFERRAL_RECORD.size
+
+    records = 0
+    position = 0
+    end = len(payload)
+    while position < end:
+        record_type = payload[position]
+        if record_type == _USER:
+            _, kind, size = unpack_user(payload, position)
+            position += user_size
+            data = payload[position:position + size]
+            add_user(int(data) if kind == _NAME_INT else data.decode())
+            position += size
+        elif record_type == _REMOVAL:
+            _, kind, size, promote_referrals = unpack_removal(payload, position)
+            position += _REMOVAL_RECORD.size
+            data = payload[position:position + size]
+            network.remove_user(int(data) if kind == _NAME_INT else data.decode(), bool(promote_referrals))
+            position += size
+        else:
+            if record_type != _REFERRAL:
+                _, referrer_kind, referrer_size, candidate_kind, candidate_size, timestamp = unpack_timed_referral(payload, position)
+                position += timed_referral_size
+            else:
+                _, referrer_kind, referrer_size, candidate_kind, candidate_size = unpack_referral(payload, position)
+                timestamp = None
+                position += referral_size
+            data = payload[position:position + referrer_size]
+            referrer = int(data) if referrer_kind == _NAME_INT else data.decode()
+            position += referrer_size
+            data = payload[position:position + candidate_size]
+            candidate = int(data) if candidate_kind == _NAME_INT else data.decode()
+            position += candidate_size
+            if record_type == _MOVE:
+                network.move_referral(candidate, referrer, timestamp)
+            else:
+                replay_referral(referrer, candidate, timestamp)
+        records += 1
+    return records
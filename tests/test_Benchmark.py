@@ -0,0 +1,86 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from source.Benchmark import (
+    BenchmarkResult, compare_to_baseline, main, results_from_json, results_to_json, run_benchmarks,
+)
+from source.CompactReferralNetwork import CompactReferralNetwork
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests for the benchmark harness and the regression check.
+    """
+
+    def test_covers_every_public_method(self):
+        """
+        Tests that every public network method and simulation function gets a result.
+        """
+        results = run_benchmarks(shapes=['wide_star'], sizes=[300], repeat=1)
+        names = {result.name for result in results}
+
+        for name in ('add_user', 'add_referral', 'add_referrals', 'add_referrals_from_file', 'save', 'load',
+                     'get_direct_referrals', 'get_total_referral_count', 'get_top_k_referrers',
+                     'get_influencers_by_unique_reach', 'get_influencers_by_flow_centrality',
+                     'days_to_target', 'min_bonus_for_target'):
+            self.assertIn(name, names)
+        self.assertTrue(any(name.startswith('simulate') for name in names))
+        self.assertTrue(all(result.seconds >= 0 and result.peak_bytes >= 0 for result in results))
+
+    def test_compact_backend(self):
+        """
+        Tests that the harness runs against the compact backend too.
+        """
+        results = run_benchmarks(shapes=['deep_chain'], sizes=[300], network_class=CompactReferralNetwork, repeat=1, simulation=False)
+        self.assertEqual({result.shape for result in results}, {'deep_chain'})
+
+    def test_regressions_are_flagged(self):
+        """
+        Tests that only results clearly slower or larger than the baseline are flagged.
+        """
+        baseline = [
+            BenchmarkResult('a', 'star', 10, 0.010, 10 ** 6),
+            BenchmarkResult('b', 'star', 10, 0.010, 10 ** 6),
+            BenchmarkResult('c', 'star', 10, 0.00001, 100),
+        ]
+        results = [
+            BenchmarkResult('a', 'star', 10, 0.030, 10 ** 6),
+            BenchmarkResult('b', 'star', 10, 0.012, 3 * 10 ** 6),
+            BenchmarkResult('c', 'star', 10, 0.0005, 10_000),
+            BenchmarkResult('d', 'star', 10, 1.0, 10 ** 9),
+        ]
+
+        regressions = compare_to_baseline(results, baseline, threshold=1.5)
+
+        self.assertEqual([(r.name, r.metric) for r in regressions], [('a', 'seconds'), ('b', 'peak_bytes')])
+        self.assertAlmostEqual(regressions[0].ratio, 3.0)
+
+    def test_json_round_trip_and_exit_code(self):
+        """
+        Tests that results written by main() compare clean against themselves and fail against a faster baseline.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(main(['--shapes', 'deep_chain', '--sizes', '2000', '--repeat', '1', '--no-simulation', '--output', output]), 0)
+
+            with open(output) as file:
+                document = json.load(file)
+            self.assertEqual(document['meta']['backend'], 'ReferralNetwork')
+            results = results_from_json(document)
+            self.assertEqual(compare_to_baseline(results, results), [])
+
+            faster = [result._replace(seconds=result.seconds / 100, peak_bytes=result.peak_bytes // 100) for result in results]
+            baseline = os.path.join(directory, 'baseline.json')
+            with open(baseline, 'w') as file:
+                json.dump(results_to_json(faster), file)
+            with contextlib.redirect_stdout(io.StringIO()) as log:
+                exit_code = main(['--shapes', 'deep_chain', '--sizes', '2000', '--repeat', '1', '--no-simulation', '--baseline', baseline, '--threshold', '1.0'])
+            self.assertEqual(exit_code, 1)
+            self.assertIn('REGRESSION', log.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import math
+import os
+import random
+import tempfile
+import unittest
+
+import tests.test_ReferralNetwork as reference_tests
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.ReferralNetwork import ReferralNetwork
+from source.Sharding import ShardedAnalytics
+
+# Re-run the ReferralNetwork test cases against the array-backed backend
+
+class TestCompactReferralNetworkPart1(reference_tests.TestReferralNetworkPart1):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactReferralNetworkParts2And3(reference_tests.TestReferralNetworkParts2And3):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactIncrementalReachCounts(reference_tests.TestIncrementalReachCounts):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactUniqueReachRanking(reference_tests.TestUniqueReachRanking):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactReachIndex(reference_tests.TestReachIndex):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactStreamingQueries(reference_tests.TestStreamingQueries):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactTimeWindows(reference_tests.TestTimeWindows):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactAncestorIndex(reference_tests.TestAncestorIndex):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactRemovalAndMoves(reference_tests.TestRemovalAndMoves):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactUniqueReachRanker(reference_tests.TestUniqueReachRanker):
+
+    network_class = CompactReferralNetwork
+
+class TestCompactMatchesDictBackend(unittest.TestCase):
+
+    def setUp(self):
+
+        rng = random.Random(11)
+        self.dict_network = ReferralNetwork()
+        self.compact_network = CompactReferralNetwork()
+        for i in range(400):
+            # A mix of new roots, valid referrals and rejected ones
+            referrer, candidate = f"u{rng.randrange(i + 1)}", f"u{rng.randrange(i + 1)}"
+            if rng.random() < 0.1:
+                self.dict_network.add_user(candidate)
+                self.compact_network.add_user(candidate)
+            else:
+                self.assertEqual(
+                    self.dict_network.add_referral(referrer, candidate),
+                    self.compact_network.add_referral(referrer, candidate),
+                )
+
+    def test_views_match_dicts(self):
+        """
+        Tests that the read-only views expose the same graph as the dict backend.
+        """
+        self.assertEqual(dict(self.compact_network.graph), self.dict_network.graph)
+        self.assertEqual(dict(self.compact_network.referrers), self.dict_network.referrers)
+        self.assertEqual(dict(self.compact_network.reach_counts), self.dict_network.reach_counts)
+
+    def test_rankings_match(self):
+        """
+        Tests that both backends produce identical rankings, including tie order.
+        """
+        size = len(self.dict_network.graph)
+        self.assertEqual(self.compact_network.get_top_k_referrers(size), self.dict_network.get_top_k_referrers(size))
+        self.assertEqual(self.compact_network.get_influencers_by_unique_reach(), self.dict_network.get_influencers_by_unique_reach())
+        self.assertEqual(self.compact_network.get_influencers_by_flow_centrality(), self.dict_network.get_influencers_by_flow_centrality())
+
+    def test_removals_match(self):
+        """
+        Tests that removals leave both backends identical, including the tombstoned ids the
+        array backend keeps, in snapshots and in sharded rankings.
+        """
+        rng = random.Random(5)
+        for step in range(60):
+            user = rng.choice(list(self.dict_network.graph))
+            promote_referrals = rng.random() < 0.5
+            for network in (self.dict_network, self.compact_network):
+                self.assertTrue(network.remove_user(user, promote_referrals))
+            if step % 10 == 0:
+                self.test_rankings_match()
+                self.assertEqual(self.compact_network.get_depth(user), None)
+                self.assertEqual(self.compact_network.window(0, math.inf).get_top_k_referrers(20), self.dict_network.window(0, math.inf).get_top_k_referrers(20))
+        self.compact_network.add_referral('u0', 'new')
+        self.dict_network.add_referral('u0', 'new')
+
+        self.test_views_match_dicts()
+        self.test_rankings_match()
+        size = len(self.dict_network.graph)
+        window = self.compact_network.window(0, math.inf)
+        self.assertEqual(window.get_top_k_referrers(size), self.dict_network.window(0, math.inf).get_top_k_referrers(size))
+        for user in self.dict_network.graph:
+            self.assertEqual(self.compact_network.get_depth(user), self.dict_network.get_depth(user))
+            self.assertEqual(window.get_total_referral_count(user), self.dict_network.get_total_referral_count(user))
+
+        with ShardedAnalytics(self.compact_network, workers=1, shards=4) as analytics:
+            self.assertEqual(analytics.get_top_k_referrers(10), self.dict_network.get_top_k_referrers(10))
+            self.assertEqual(analytics.get_influencers_by_unique_reach(), self.dict_network.get_influencers_by_unique_reach())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'network.snapshot')
+            self.compact_network.save(path)
+            loaded = CompactReferralNetwork.load(path, use_mmap=False)
+            self.assertEqual(dict(loaded.graph), self.dict_network.graph)
+            self.assertEqual(dict(loaded.reach_counts), self.dict_network.reach_counts)
+            self.assertEqual(loaded.get_referral_time('new'), self.compact_network.get_referral_time('new'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.ReferralNetwork import ReferralNetwork
+from source.Generators import (
+    GENERATORS, build_network, campaign_bursts, deep_chain, preferential_attachment_forest, wide_star,
+)
+
+class TestGenerators(unittest.TestCase):
+    """
+    Tests for the synthetic referral network generators.
+    """
+
+    def test_every_referral_is_accepted(self):
+        """
+        Tests that each generator yields a forest whose referrals are all accepted.
+        """
+        for name, generator in GENERATORS.items():
+            for network_class in (ReferralNetwork, CompactReferralNetwork):
+                referrals = list(generator(2000))
+                network = network_class()
+                report = network.add_referrals(referrals)
+
+                self.assertEqual(report.rejected, [], name)
+                self.assertEqual(report.accepted, len(referrals), name)
+                self.assertTrue(all(0 <= user < 2000 for pair in referrals for user in pair), name)
+
+    def test_seeded_generators_are_reproducible(self):
+        """
+        Tests that the same seed gives the same network and another seed a different one.
+        """
+        for generator in (preferential_attachment_forest, campaign_bursts):
+            self.assertEqual(list(generator(1000, seed=3)), list(generator(1000, seed=3)))
+            self.assertNotEqual(list(generator(1000, seed=3)), list(generator(1000, seed=4)))
+
+    def test_shapes(self):
+        """
+        Tests the defining property of each shape.
+        """
+        chain = build_network(deep_chain(500))
+        self.assertEqual(chain.get_total_referral_count(0), 499)
+        self.assertEqual(chain.get_direct_referrals(250), [251])
+
+        star = build_network(wide_star(500, hubs=2))
+        self.assertEqual(len(star.get_direct_referrals(0)), 249)
+        self.assertEqual(len(star.get_direct_referrals(1)), 249)
+
+        forest = build_network(preferential_attachment_forest(5000, seed=1))
+        fan_outs = sorted((len(forest.get_direct_referrals(user)) for user in forest.graph), reverse=True)
+        self.assertGreater(fan_outs[0], 20 * sum(fan_outs) / len(fan_outs))
+
+        bursts = list(campaign_bursts(1000, campaigns=4, ambassadors=3, seed=2))
+        self.assertEqual([candidate for _, candidate in bursts], list(range(1, 1000)))
+        # The first campaign's only possible ambassador is user 0, who makes most of its referrals
+        first_campaign = [referrer for referrer, candidate in bursts if candidate < 250]
+        self.assertGreater(first_campaign.count(0), 0.6 * len(first_campaign))
+
+    def test_tiny_sizes(self):
+        """
+        Tests that networks of zero or one user produce no referrals.
+        """
+        for generator in GENERATORS.values():
+            self.assertEqual(list(generator(0)), [])
+            self.assertEqual(list(generator(1)), [])
+
+if __name__ == '__main__':
+    unittest.main()
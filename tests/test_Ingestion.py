@@ -0,0 +1,172 @@
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.Ingestion import ALREADY_REFERRED, CYCLE, MALFORMED, SELF_REFERRAL, Rejection
+from source.ReferralNetwork import ReferralNetwork
+
+class TestBulkIngestion(unittest.TestCase):
+    """
+    Tests for add_referrals and add_referrals_from_file.
+    """
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.network = self.network_class()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+
+        self.directory.cleanup()
+
+    def _random_referrals(self, seed, size=500):
+        rng = random.Random(seed)
+        return [(rng.randrange(size // 2), rng.randrange(size // 2)) for _ in range(size)]
+
+    def test_rejections_are_reported_not_printed(self):
+        """
+        Tests that every constraint violation is reported with its row and reason, silently.
+        """
+        referrals = [('A', 'B'), ('B', 'C'), ('A', 'A'), ('D', 'C'), ('C', 'A'), ('C', 'D')]
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            report = self.network.add_referrals(iter(referrals))
+
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(report.accepted, 3)
+        self.assertEqual(report.total, 6)
+        self.assertEqual(report.rejected, [
+            Rejection(3, 'A', 'A', SELF_REFERRAL),
+            Rejection(4, 'D', 'C', ALREADY_REFERRED),
+            Rejection(5, 'C', 'A', CYCLE),
+        ])
+        self.assertEqual(self.network.get_total_referral_count('A'), 3)
+
+    def test_matches_one_by_one_inserts(self):
+        """
+        Tests that bulk ingestion builds the same network as repeated add_referral calls,
+        including reach counts across several chunks.
+        """
+        for seed in range(3):
+            referrals = self._random_referrals(seed)
+            # Start from a non-empty network so pending deltas build on existing counts
+            expected = self.network_class()
+            network = self.network_class()
+            for existing in (expected, network):
+                existing.add_referral('root', referrals[0][0])
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected_results = [expected.add_referral(referrer, candidate) for referrer, candidate in referrals]
+
+            with mock.patch('source.ReferralNetwork.BULK_CHUNK_SIZE', 37), mock.patch('source.CompactReferralNetwork.BULK_CHUNK_SIZE', 37):
+                report = network.add_referrals(referrals)
+
+            self.assertEqual(report.accepted, sum(expected_results))
+            self.assertEqual(dict(network.graph), dict(expected.graph))
+            self.assertEqual(dict(network.reach_counts), dict(expected.reach_counts))
+            self.assertEqual(network.get_top_k_referrers(10), expected.get_top_k_referrers(10))
+
+    def test_large_batch_falls_back_to_full_recount(self):
+        """
+        Tests the recount path taken when walking every pending referral would cost more.
+        """
+        chain = [(i, i + 1) for i in range(300)]
+        report = self.network.add_referrals(chain)
+
+        self.assertEqual(report.accepted, 300)
+        self.assertEqual(self.network.get_total_referral_count(0), 300)
+        self.assertEqual(self.network.get_total_referral_count(150), 150)
+
+    def test_csv_file_with_header(self):
+        """
+        Tests streaming referrals from a CSV export with a header row.
+        """
+        path = os.path.join(self.directory.name, 'referrals.csv')
+        with open(path, 'w') as file:
+            file.write("referrer,candidate\nA,B\nB,C\nC,A\n")
+
+        report = self.network.add_referrals_from_file(path)
+
+        self.assertEqual(report.accepted, 2)
+        self.assertEqual(report.rejected, [Rejection(3, 'C', 'A', CYCLE)])
+        self.assertEqual(self.network.get_direct_referrals('B'), ['C'])
+
+    def test_jsonl_file(self):
+        """
+        Tests streaming referrals from JSON lines written as objects or pairs.
+        """
+        path = os.path.join(self.directory.name, 'referrals.jsonl')
+        with open(path, 'w') as file:
+            file.write(json.dumps({'referrer': 'A', 'candidate': 'B'}) + "\n\n")
+            file.write(json.dumps(['A', 'C']) + "\n")
+
+        report = self.network.add_referrals_from_file(path)
+
+        self.assertEqual(report.accepted, 2)
+        self.assertEqual(self.network.get_total_referral_count('A'), 2)
+
+    def test_files_with_timestamps(self):
+        """
+        Tests the optional timestamp column of CSV files and timestamp field of JSON lines.
+        """
+        csv_path = os.path.join(self.directory.name, 'referrals.csv')
+        with open(csv_path, 'w') as file:
+            file.write("referrer,candidate,timestamp\nA,B,10\nB,C,\n")
+        jsonl_path = os.path.join(self.directory.name, 'referrals.jsonl')
+        with open(jsonl_path, 'w') as file:
+            file.write(json.dumps({'referrer': 'A', 'candidate': 'D', 'timestamp': 20}) + "\n")
+            file.write(json.dumps(['D', 'E', 30.5]) + "\n")
+
+        self.assertEqual(self.network.add_referrals_from_file(csv_path).accepted, 2)
+        self.assertEqual(self.network.add_referrals_from_file(jsonl_path).accepted, 2)
+
+        self.assertEqual([self.network.get_referral_time(user) for user in 'BDE'], [10.0, 20.0, 30.5])
+        self.assertGreater(self.network.get_referral_time('C'), 30.5)
+        self.assertEqual(self.network.window(0, 25).get_total_referral_count('A'), 2)
+
+    def test_corrupt_rows_are_rejected(self):
+        """
+        Tests that unparsable rows mid-file are reported as malformed and the load carries on.
+        """
+        csv_path = os.path.join(self.directory.name, 'referrals.csv')
+        with open(csv_path, 'w') as file:
+            file.write("A,B\nA\nB,C,not a time\nB,D\n")
+        jsonl_path = os.path.join(self.directory.name, 'referrals.jsonl')
+        with open(jsonl_path, 'w') as file:
+            file.write(json.dumps(['D', 'E']) + "\n")
+            file.write('{"referrer": "D", "cand\n')
+            file.write(json.dumps({'referrer': 'D'}) + "\n")
+            file.write(json.dumps(['D']) + "\n")
+            file.write(json.dumps(['D', 'F']) + "\n")
+
+        csv_report = self.network.add_referrals_from_file(csv_path)
+        jsonl_report = self.network.add_referrals_from_file(jsonl_path)
+
+        self.assertEqual(csv_report.accepted, 2)
+        self.assertEqual(csv_report.rejected, [Rejection(2, None, None, MALFORMED), Rejection(3, None, None, MALFORMED)])
+        self.assertEqual(jsonl_report.accepted, 2)
+        self.assertEqual([rejection.row for rejection in jsonl_report.rejected], [2, 3, 4])
+        self.assertEqual(self.network.get_total_referral_count('A'), 4)
+
+    def test_unknown_file_format(self):
+        """
+        Tests that unsupported file extensions are refused.
+        """
+        with self.assertRaises(ValueError):
+            self.network.add_referrals_from_file('referrals.xml')
+
+class TestCompactBulkIngestion(TestBulkIngestion):
+
+    network_class = CompactReferralNetwork
+
+if __name__ == '__main__':
+    unittest.main()
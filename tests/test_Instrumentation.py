@@ -0,0 +1,137 @@
+import contextlib
+import io
+import unittest
+
+from source.Instrumentation import LATENCY_BUCKETS, Histogram, instrumentation
+from source.Optimization import min_bonus_for_target, min_p_for_target
+from source.ReferralNetwork import ReferralNetwork
+from source.Simulation import growth_curve_cache, simulate
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Tests for the optional call, latency and traversal metrics.
+    """
+
+    def setUp(self):
+
+        instrumentation.disable()
+        instrumentation.reset()
+        self.network = ReferralNetwork()
+        self.network.add_referrals([('A', 'B'), ('B', 'C'), ('A', 'D')])
+
+    def tearDown(self):
+
+        instrumentation.disable()
+        instrumentation.reset()
+
+    def test_disabled_records_nothing(self):
+        """
+        Tests that nothing is recorded and methods are left unwrapped while disabled.
+        """
+        self.network.add_referral('C', 'E')
+        self.network.get_top_k_referrers(2)
+        simulate(0.1, 10)
+
+        self.assertEqual(instrumentation.to_dict(), {'counters': {}, 'histograms': {}})
+        self.assertFalse(hasattr(ReferralNetwork.add_referral, '__wrapped__'))
+
+        instrumentation.enable()
+        self.assertTrue(hasattr(ReferralNetwork.add_referral, '__wrapped__'))
+
+    def test_network_calls_and_traversals(self):
+        """
+        Tests call counts, latencies and nodes visited for network operations.
+        """
+        instrumentation.enable()
+        self.network.add_referral('C', 'E')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.network.add_referral('E', 'A')  # rejected, still counted
+        self.network.get_total_referral_count('A')
+        self.network.get_influencers_by_unique_reach()
+
+        metrics = instrumentation.to_dict()
+        self.assertEqual(metrics['counters']['ReferralNetwork.add_referral.calls'], 2)
+        self.assertEqual(metrics['histograms']['ReferralNetwork.add_referral.seconds']['count'], 2)
+        self.assertEqual(metrics['histograms']['ReferralNetwork.cycle_check.nodes_visited']['count'], 2)
+        # The three setUp referrals are folded in with the new one: 1 + 2 + 1 + 3 ancestors.
+        # That is more than the 5 users, so the sync falls back to a full recount, which
+        # takes the only Euler tour; unique reach just sorts the roots.
+        self.assertEqual(metrics['histograms']['ReferralNetwork.reach_sync.nodes_visited']['sum'], 7)
+        self.assertEqual(metrics['histograms']['ReferralNetwork.euler_tour.nodes_visited']['buckets'][-1], (float('inf'), 1))
+        self.assertEqual(metrics['histograms']['ReferralNetwork.euler_tour.nodes_visited']['sum'], 5)
+
+    def test_simulation_and_optimization_metrics(self):
+        """
+        Tests cohorts per simulated day and simulations per search.
+        """
+        instrumentation.enable()
+        simulate(3.4, 6)
+
+        # p = 3.4 retires each cohort after 3 days, so at most 3 are alive
+        cohorts = instrumentation.histograms['simulate.cohorts_per_day']
+        self.assertEqual(cohorts.count, 6)
+        self.assertEqual(cohorts.sum, 2 + 3 + 3 + 3 + 3 + 3)
+
+        growth_curve_cache.clear()
+        min_bonus_for_target(30, 500, lambda bonus: bonus / 1000.0)
+        searches = instrumentation.histograms['min_bonus_for_target.simulations']
+        self.assertEqual(searches.count, 1)
+        self.assertGreater(searches.sum, 10)
+        self.assertEqual(instrumentation.counters['min_bonus_for_target.calls'], 1)
+        self.assertGreaterEqual(instrumentation.counters['days_to_target.calls'], searches.sum)
+
+        min_p_for_target(45, 777)
+        self.assertGreater(instrumentation.histograms['min_p_for_target.simulations'].sum, 1)
+
+    def test_prometheus_export(self):
+        """
+        Tests the Prometheus text format of counters and cumulative histogram buckets.
+        """
+        instrumentation.enable()
+        self.network.get_top_k_referrers(1)
+        text = instrumentation.to_prometheus()
+
+        self.assertIn('# TYPE referrals_referral_network_get_top_k_referrers_calls_total counter\n', text)
+        self.assertIn('referrals_referral_network_get_top_k_referrers_calls_total 1\n', text)
+        self.assertIn('referrals_referral_network_get_top_k_referrers_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('referrals_referral_network_get_top_k_referrers_seconds_count 1\n', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        """
+        Tests bucket placement on and between bounds.
+        """
+        histogram = Histogram((1, 10))
+        for value in (0, 1, 2, 10, 11):
+            histogram.observe(value)
+        self.assertEqual(histogram.to_dict(), {'count': 5, 'sum': 24, 'buckets': [(1, 2), (10, 4), (float('inf'), 5)]})
+        self.assertEqual(len(Histogram(LATENCY_BUCKETS).counts), len(LATENCY_BUCKETS) + 1)
+
+    def test_profile_selected_calls(self):
+        """
+        Tests that profiling only covers the selected operations and restores the previous state.
+        """
+        with instrumentation.profile({'ReferralNetwork.get_influencers_by_flow_centrality'}) as profile:
+            self.network.get_influencers_by_flow_centrality()
+            simulate(0.1, 10)
+
+        profiled = {function for _, _, function in profile.stats().stats}
+        self.assertIn('get_influencers_by_flow_centrality', profiled)
+        self.assertNotIn('simulate', profiled)
+        self.assertIn('get_influencers_by_flow_centrality', profile.report())
+        self.assertFalse(instrumentation.enabled)
+        self.assertFalse(hasattr(ReferralNetwork.get_influencers_by_flow_centrality, '__wrapped__'))
+
+    def test_profile_whole_block(self):
+        """
+        Tests that without a selection the whole block is profiled, and sessions do not nest.
+        """
+        with instrumentation.profile() as profile:
+            simulate(0.1, 10)
+            with self.assertRaises(RuntimeError):
+                with instrumentation.profile():
+                    pass
+
+        self.assertIn('simulate', {function for _, _, function in profile.stats().stats})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import unittest
+
+from source.Simulation import SimulationConfig, np, simulate
+
+if np is not None:
+    from source.MonteCarlo import simulate_monte_carlo
+
+@unittest.skipIf(np is None, "NumPy is not installed")
+class TestMonteCarlo(unittest.TestCase):
+    """
+    Tests for the stochastic Monte Carlo simulation mode.
+    """
+
+    def test_mean_tracks_deterministic_model(self):
+        """
+        Tests that the mean trajectory stays close to the expected-value simulation.
+        """
+        result = simulate_monte_carlo(0.1, 20, trajectories=2000, seed=1, workers=1)
+        expected = simulate(0.1, 20)
+
+        for day in (0, 9, 19):
+            self.assertAlmostEqual(result.mean[day] / expected[day], 1.0, delta=0.02)
+
+    def test_percentile_bands_are_ordered(self):
+        """
+        Tests that the p5 / p50 / p95 bands are per-day arrays in increasing order.
+        """
+        result = simulate_monte_carlo(0.5, 15, trajectories=500, seed=2, workers=1)
+
+        self.assertEqual(sorted(result.percentiles), [5, 50, 95])
+        self.assertEqual(len(result.percentiles[50]), 15)
+        self.assertTrue((result.percentiles[5] <= result.percentiles[50]).all())
+        self.assertTrue((result.percentiles[50] <= result.percentiles[95]).all())
+
+    def test_reproducible_regardless_of_worker_count(self):
+        """
+        Tests that a seed fixes the result whether tasks run inline or in a process pool.
+        """
+        inline = simulate_monte_carlo(2.0, 10, trajectories=600, target_total=5000, seed=7, workers=1)
+        pooled = simulate_monte_carlo(2.0, 10, trajectories=600, target_total=5000, seed=7, workers=2)
+
+        self.assertTrue((inline.mean == pooled.mean).all())
+        self.assertTrue((inline.days_to_target == pooled.days_to_target).all())
+
+    def test_days_to_target_distribution(self):
+        """
+        Tests the per-trajectory days_to_target, including unreachable targets.
+        """
+        result = simulate_monte_carlo(0.1, 30, trajectories=300, target_total=500, seed=3, workers=1)
+        self.assertEqual(len(result.days_to_target), 300)
+        self.assertTrue(((result.days_to_target >= 15) & (result.days_to_target <= 25)).all())
+
+        unreachable = simulate_monte_carlo(0.1, 5, trajectories=10, target_total=10 ** 6, seed=3, workers=1)
+        self.assertTrue((unreachable.days_to_target == -1).all())
+
+    def test_long_horizons(self):
+        """
+        Tests that counts past the exact samplers' range follow the deterministic model.
+        """
+        for p, days in ((0.3, 365), (0.5, 120), (1.0, 100), (2.0, 60)):
+            with self.subTest(p=p, days=days):
+                result = simulate_monte_carlo(p, days, trajectories=50, seed=5, workers=1)
+                expected = simulate(p, days)
+                self.assertTrue(np.isfinite(result.mean).all())
+                self.assertAlmostEqual(result.mean[-1] / expected[-1], 1.0, delta=0.05)
+
+    def test_fractional_initial_referrers(self):
+        """
+        Tests that a fractional number of initial referrers is rejected rather than truncated.
+        """
+        with self.assertRaises(ValueError):
+            simulate_monte_carlo(0.1, 5, trajectories=10, seed=4, workers=1, config=SimulationConfig(initial_referrers=2.5))
+
+        whole = simulate_monte_carlo(0.1, 5, trajectories=10, seed=4, workers=1, config=SimulationConfig(initial_referrers=3.0))
+        self.assertEqual(len(whole.mean), 5)
+
+    def test_zero_probability(self):
+        """
+        Tests that p = 0 never produces referrals.
+        """
+        result = simulate_monte_carlo(0, 5, trajectories=10, seed=4, workers=1)
+        self.assertTrue((result.mean == 0).all())
+
+if __name__ == '__main__':
+    unittest.main()
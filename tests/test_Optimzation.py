@@ -1,6 +1,10 @@
+import math
 import unittest
-from source.Optimization import min_bonus_for_target
-from source.Simulation import simulate
+from source.Optimization import (
+    min_bonus_for_target, min_bonus_for_targets, min_p_for_target,
+    register_adoption_inverse, register_adoption_table, unregister_adoption_inverse,
+)
+from source.Simulation import SimulationConfig, days_to_target, np, simulate
 
 class TestOptimization(unittest.TestCase):
     """
@@ -63,5 +67,149 @@ class TestOptimization(unittest.TestCase):
         actual_bonus = min_bonus_for_target(days, target_hires, mock_adoption_prob)
         self.assertEqual(actual_bonus, expected_bonus)
 
+class TestBatchOptimization(unittest.TestCase):
+    """
+    Tests for the batched multi-target bonus optimizer.
+    """
+
+    def setUp(self):
+
+        self.queries = [(d, t) for d in (0, 1, 7, 15, 30, 90) for t in (-5, 0, 1, 205, 206, 2000, 10 ** 6)]
+
+    def test_matches_scalar_optimizer(self):
+        """
+        Tests every query against min_bonus_for_target for several adoption curves.
+        """
+        adoption_curves = [
+            lambda bonus: bonus / 1000.0,
+            lambda bonus: 0.0001,
+            lambda bonus: 1 - math.exp(-bonus / 800),
+            lambda bonus: min(0.5, (bonus / 3000) ** 2),
+        ]
+        for adoption_prob in adoption_curves:
+            expected = [min_bonus_for_target(days, target, adoption_prob) for days, target in self.queries]
+            self.assertEqual(min_bonus_for_targets(self.queries, adoption_prob), expected)
+
+    def test_adoption_function_called_once_per_bonus(self):
+        """
+        Tests that queries sharing bisection midpoints share the adoption function calls.
+        """
+        calls = []
+        def counting_adoption_prob(bonus):
+            calls.append(bonus)
+            return bonus / 1000.0
+
+        min_bonus_for_targets([(15, 205)] * 50 + [(30, 205)] * 50, counting_adoption_prob)
+
+        self.assertEqual(len(calls), len(set(calls)))
+        self.assertLess(len(calls), 2 * 20)
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_vectorized_adoption_curve(self):
+        """
+        Tests that evaluating each round's midpoints in one array call gives the same answers.
+        """
+        adoption_prob = lambda bonus: bonus / 1000.0
+        expected = [min_bonus_for_target(days, target, adoption_prob) for days, target in self.queries]
+        self.assertEqual(min_bonus_for_targets(self.queries, adoption_prob, vectorized=True), expected)
+
+    def test_config_is_passed_through(self):
+        """
+        Tests that both optimizers simulate with the given config.
+        """
+        config = SimulationConfig(initial_referrers=10, referral_capacity=5)
+        adoption_prob = lambda bonus: bonus / 1000.0
+        expected = [min_bonus_for_target(days, target, adoption_prob, config=config) for days, target in self.queries]
+
+        self.assertNotEqual(expected, [min_bonus_for_target(days, target, adoption_prob) for days, target in self.queries])
+        self.assertEqual(min_bonus_for_targets(self.queries, adoption_prob, config=config), expected)
+
+    def test_empty_batch(self):
+        """
+        Tests that no queries give no results.
+        """
+        self.assertEqual(min_bonus_for_targets([], lambda bonus: bonus / 1000.0), [])
+
+class TestInverseSolver(unittest.TestCase):
+    """
+    Tests for the minimum-p solver and registered adoption inverses.
+    """
+
+    def setUp(self):
+
+        self.queries = [(d, t) for d in (0, 1, 7, 15, 30, 90, 2000) for t in (-5, 1, 205, 206, 2000, 10 ** 6)]
+        self.registered = []
+
+    def tearDown(self):
+
+        for adoption_prob in self.registered:
+            unregister_adoption_inverse(adoption_prob)
+
+    def test_min_p_is_the_reachability_threshold(self):
+        """
+        Tests that the returned p reaches the target in time and a slightly smaller one does not.
+        """
+        for days, target in [(1, 50), (7, 206), (30, 2000), (365, 10 ** 6), (1000, 10 ** 5)]:
+            p = min_p_for_target(days, target)
+            self.assertTrue(0 < days_to_target(p, target) <= days, (days, target))
+            self.assertFalse(0 < days_to_target(p * (1 - 1e-8), target) <= days, (days, target))
+
+    def test_min_p_edge_cases(self):
+        """
+        Tests trivial targets, empty horizons and referrer-less configs.
+        """
+        self.assertEqual(min_p_for_target(10, 0), 0.0)
+        self.assertIsNone(min_p_for_target(0, 10))
+        self.assertIsNone(min_p_for_target(10, 10, SimulationConfig(initial_referrers=0)))
+        self.assertEqual(min_p_for_target(5000, 10 ** 5), min_p_for_target(1000, 10 ** 5))
+
+    def test_registered_inverse_matches_search(self):
+        """
+        Tests that inverting the adoption curve gives the bisection's answers without calling it.
+        """
+        adoption_curves = [
+            (lambda bonus: bonus / 1000.0, lambda p: p * 1000.0),
+            (lambda bonus: 1 - math.exp(-bonus / 800), lambda p: math.inf if p >= 1 else -800 * math.log1p(-p)),
+            (lambda bonus: min(0.5, (bonus / 3000) ** 2), lambda p: math.inf if p > 0.5 else 3000 * math.sqrt(p)),
+        ]
+        for adoption_prob, inverse in adoption_curves:
+            expected = [min_bonus_for_target(days, target, adoption_prob) for days, target in self.queries]
+
+            calls = []
+            def counting_adoption_prob(bonus, adoption_prob=adoption_prob):
+                calls.append(bonus)
+                return adoption_prob(bonus)
+            register_adoption_inverse(counting_adoption_prob, inverse)
+            self.registered.append(counting_adoption_prob)
+
+            actual = [min_bonus_for_target(days, target, counting_adoption_prob) for days, target in self.queries]
+            self.assertEqual(actual, expected)
+            self.assertEqual(min_bonus_for_targets(self.queries, counting_adoption_prob), expected)
+            self.assertEqual(calls, [])
+
+    def test_registered_table_matches_search(self):
+        """
+        Tests that a tabulated linear adoption curve is inverted exactly.
+        """
+        adoption_prob = lambda bonus: bonus / 1000.0
+        expected = [min_bonus_for_target(days, target, adoption_prob) for days, target in self.queries]
+
+        register_adoption_table(adoption_prob, range(0, 5001, 250), [bonus / 1000.0 for bonus in range(0, 5001, 250)])
+        self.registered.append(adoption_prob)
+
+        self.assertEqual([min_bonus_for_target(days, target, adoption_prob) for days, target in self.queries], expected)
+
+    def test_invalid_table(self):
+        """
+        Tests that tables that are empty, ragged or not monotone are rejected.
+        """
+        adoption_prob = lambda bonus: bonus / 1000.0
+        with self.assertRaises(ValueError):
+            register_adoption_table(adoption_prob, [], [])
+        with self.assertRaises(ValueError):
+            register_adoption_table(adoption_prob, [0, 100], [0.0])
+        with self.assertRaises(ValueError):
+            register_adoption_table(adoption_prob, [0, 100, 200], [0.0, 0.2, 0.1])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,11 +1,40 @@
+import contextlib
+import io
+import math
+import os
+import random
+import tempfile
+import time
 import unittest
+from unittest import mock
 from source.ReferralNetwork import ReferralNetwork
 
+
+def _random_forest(network_class, seed, size, root_rate=0.05, span=20, jitter=None):
+
+    # Users 1..size-1, each starting a new tree with probability root_rate or referred by one
+    # of the span users before it (any earlier user if span is None). Referrals are timed
+    # i +- jitter when jitter is given, and now otherwise.
+    rng = random.Random(seed)
+    network = network_class()
+    for i in range(1, size):
+        if rng.random() < root_rate:
+            network.add_user(i)
+        else:
+            referrer = rng.randrange(0 if span is None else max(0, i - span), i)
+            if jitter is None:
+                network.add_referral(referrer, i)
+            else:
+                network.add_referral(referrer, i, float(i + (rng.randrange(-jitter, jitter) if jitter else 0)))
+    return network
+
 class TestReferralNetworkPart1(unittest.TestCase):
 
+    network_class = ReferralNetwork
+
     def setUp(self):
         
-        self.network = ReferralNetwork()
+        self.network = self.network_class()
 
     # Test Core Functionality
 
@@ -99,6 +128,8 @@ class TestReferralNetworkPart1(unittest.TestCase):
 
 class TestReferralNetworkParts2And3(unittest.TestCase):
 
+    network_class = ReferralNetwork
+
     def setUp(self):
         """
         Set up a complex, non-trivial network to test advanced functions.
@@ -108,7 +139,7 @@ class TestReferralNetworkParts2And3(unittest.TestCase):
         - B is a sub-influencer under A.
         - K is an isolated user who has referred no one.
         """
-        self.network = ReferralNetwork()
+        self.network = self.network_class()
         referrals = [
             ('A', 'B'), ('A', 'C'),
             ('B', 'D'), ('B', 'E'),
@@ -194,5 +225,832 @@ class TestReferralNetworkParts2And3(unittest.TestCase):
         # We can confidently assert the order of the top 3 brokers.
         self.assertEqual(ranked_list[:3], ['B', 'D', 'C'])
 
+class TestIncrementalReachCounts(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.network = self.network_class()
+
+    def _bfs_reach(self, user):
+        # Reference implementation: the original full traversal
+        queue = list(self.network.graph.get(user, []))
+        count = 0
+        while queue:
+            count += 1
+            queue.extend(self.network.graph.get(queue.pop(), []))
+        return count
+
+    def test_reach_counts_when_candidate_already_has_referrals(self):
+        """
+        Tests that attaching a user with an existing downstream network credits
+        every ancestor with the whole subtree, not just the candidate.
+        """
+        self.network.add_referral('B', 'C')
+        self.network.add_referral('C', 'D')
+        self.network.add_referral('X', 'A')
+        self.network.add_referral('A', 'B')
+
+        self.assertEqual(self.network.get_total_referral_count('X'), 4)
+        self.assertEqual(self.network.get_total_referral_count('A'), 3)
+        self.assertEqual(self.network.get_total_referral_count('B'), 2)
+        self.assertEqual(self.network.get_total_referral_count('D'), 0)
+
+    def test_rejected_referrals_do_not_change_counts(self):
+        """
+        Tests that failed inserts leave the maintained counts untouched.
+        """
+        self.network.add_referral('A', 'B')
+        self.network.add_referral('B', 'C')
+        self.network.add_referral('C', 'A')
+        self.network.add_referral('D', 'C')
+
+        self.assertEqual(self.network.get_total_referral_count('A'), 2)
+        self.assertEqual(self.network.get_total_referral_count('D'), 0)
+
+    def test_deep_chain_inserts_and_cycle_check(self):
+        """
+        Tests root tracking on a chain far deeper than the recursion limit, including
+        a cycle attempt from the bottom back to the top.
+        """
+        depth = 20000
+        for i in range(depth):
+            self.assertTrue(self.network.add_referral(i, i + 1))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(self.network.add_referral(depth, 0))
+            self.assertFalse(self.network.add_referral(depth, depth // 2))
+        self.assertTrue(self.network.add_referral(depth, 'tail'))
+
+        self.assertEqual(self.network.get_total_referral_count(0), depth + 1)
+        self.assertEqual(self.network.get_total_referral_count(depth // 2), depth // 2 + 1)
+
+    def test_reach_counts_with_interleaved_reads(self):
+        """
+        Tests that queued reach updates are folded in correctly whenever a read happens.
+        """
+        self.network.add_referral('B', 'C')
+        self.assertEqual(self.network.get_total_referral_count('B'), 1)
+        self.network.add_referral('A', 'B')
+        self.network.add_referral('C', 'D')
+        self.assertEqual(self.network.get_top_k_referrers(2), ['A', 'B'])
+        self.network.add_referral('R', 'A')
+        self.assertEqual(self.network.get_total_referral_count('R'), 4)
+        self.assertEqual(self.network.get_total_referral_count('A'), 3)
+
+    def test_counts_and_ranking_match_full_traversal(self):
+        """
+        Tests maintained counts and the cached ranking against a fresh BFS on a random forest.
+        """
+        rng = random.Random(7)
+        for i in range(1, 300):
+            self.network.add_referral(rng.randrange(i), i)
+            if i % 50 == 0:
+                # Poll the leaderboard in between writes to exercise cache invalidation
+                self.network.get_top_k_referrers(5)
+
+        for user in self.network.graph:
+            self.assertEqual(self.network.get_total_referral_count(user), self._bfs_reach(user))
+
+        expected = sorted(self.network.graph, key=self._bfs_reach, reverse=True)
+        self.assertEqual(self.network.get_top_k_referrers(20), expected[:20])
+
+    def test_ranking_is_patched_not_resorted(self):
+        """
+        Tests that polling the leaderboard after single inserts patches the cached ranking
+        instead of sorting every user again.
+        """
+        self.network = _random_forest(self.network_class, 11, 200, root_rate=0, span=None)
+        self.network.get_top_k_referrers(5)
+        rng = random.Random(12)
+
+        with mock.patch('source.ReferralNetwork.sorted', create=True) as resort, mock.patch('source.CompactReferralNetwork.sorted', create=True) as compact_resort:
+            for i in range(200, 260):
+                if i % 3:
+                    self.network.add_referral(rng.randrange(i), i)
+                else:
+                    self.network.add_user(i)
+                ranking = self.network.get_top_k_referrers(len(self.network.graph))
+            self.network.add_referral(250, 'new')
+            ranking = self.network.get_top_k_referrers(len(self.network.graph))
+        resort.assert_not_called()
+        compact_resort.assert_not_called()
+
+        # Users with equal reach, new ones included, stay in insertion order
+        expected = sorted(self.network.graph, key=self._bfs_reach, reverse=True)
+        self.assertEqual(ranking, expected)
+
+class TestFlowCentralityEngines(unittest.TestCase):
+
+    def test_forest_engine_matches_all_pairs_definition(self):
+        """
+        Cross-checks the linear-time forest engine against the original triple loop.
+        """
+        for seed in range(5):
+            network = _random_forest(ReferralNetwork, seed, 60, root_rate=0.1, span=None)
+            self.assertEqual(network._get_flow_scores_forest(), network._get_flow_scores_all_pairs())
+
+    def test_brandes_engine_matches_on_forests(self):
+        """
+        Cross-checks the Brandes-style engine against the original triple loop on forests,
+        where shortest paths are unique.
+        """
+        for seed in range(3):
+            network = _random_forest(ReferralNetwork, seed, 40, root_rate=0.1, span=None)
+            expected = network._get_flow_scores_all_pairs()
+            for user, score in network._get_flow_scores_brandes().items():
+                self.assertAlmostEqual(score, expected[user])
+
+    def test_brandes_engine_on_general_dag(self):
+        """
+        Tests the Brandes-style engine on DAGs that the referral constraints would never build.
+        """
+        network = ReferralNetwork()
+        # A -> B -> C plus a shortcut A -> C: B is not on the shortest A -> C path
+        network.graph = {'A': ['B', 'C'], 'B': ['C'], 'C': []}
+        self.assertEqual(network._get_flow_scores_brandes(), {'A': 0.0, 'B': 0.0, 'C': 0.0})
+
+        # Diamond: the two shortest A -> D paths split the credit
+        network.graph = {'A': ['B', 'C'], 'B': ['D'], 'C': ['D'], 'D': []}
+        scores = network._get_flow_scores_brandes()
+        self.assertAlmostEqual(scores['B'], 0.5)
+        self.assertAlmostEqual(scores['C'], 0.5)
+
+class TestUniqueReachRanking(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def _reference_ranking(self, network):
+        # The original set-based greedy: rescan every remaining user each round
+        reach_sets = {}
+        for user in network.graph:
+            queue = list(network.graph[user])
+            reach_sets[user] = set()
+            while queue:
+                current = queue.pop()
+                reach_sets[user].add(current)
+                queue.extend(network.graph[current])
+
+        covered = set()
+        ranking = []
+        remaining = dict(reach_sets)
+        while remaining:
+            best_user, best_gain = None, -1
+            for user, reach_set in remaining.items():
+                gain = len(reach_set - covered)
+                if gain > best_gain:
+                    best_user, best_gain = user, gain
+            if best_gain == 0:
+                break
+            ranking.append(best_user)
+            covered.update(reach_sets[best_user])
+            del remaining[best_user]
+        return ranking
+
+    def test_matches_set_based_greedy(self):
+        """
+        Cross-checks the ranking by root reach against the original greedy algorithm on random forests.
+        """
+        for seed in range(5):
+            network = _random_forest(self.network_class, seed, 150, root_rate=0.2, span=None)
+            self.assertEqual(network.get_influencers_by_unique_reach(), self._reference_ranking(network))
+
+    def test_budget_stops_early(self):
+        """
+        Tests that a budget k returns the first k users of the full ranking.
+        """
+        network = self.network_class()
+        for referrer, candidate in [('A', 'B'), ('A', 'C'), ('H', 'I'), ('X', 'Y'), ('X', 'Z'), ('Z', 'W')]:
+            network.add_referral(referrer, candidate)
+
+        self.assertEqual(network.get_influencers_by_unique_reach(), ['X', 'A', 'H'])
+        self.assertEqual(network.get_influencers_by_unique_reach(k=2), ['X', 'A'])
+        self.assertEqual(network.get_influencers_by_unique_reach(k=0), [])
+
+    def test_empty_network(self):
+        """
+        Tests that an empty network has no influencers.
+        """
+        self.assertEqual(self.network_class().get_influencers_by_unique_reach(), [])
+
+class TestReachIndex(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def _reference_reach(self, network, user):
+
+        reach = []
+        stack = list(reversed(network.graph[user]))
+        while stack:
+            current = stack.pop()
+            reach.append(current)
+            stack.extend(reversed(network.graph[current]))
+        return reach
+
+    def test_matches_traversal(self):
+        """
+        Tests reach sizes, downstream checks and reach iteration against a plain DFS.
+        """
+        for seed in range(3):
+            network = _random_forest(self.network_class, seed, 200, root_rate=0.1, span=None)
+            reach = {user: self._reference_reach(network, user) for user in network.graph}
+
+            for user in network.graph:
+                self.assertEqual(network.reach_index.reach_size(user), len(reach[user]))
+                self.assertEqual(list(network.iter_reach(user)), reach[user])
+            for user in network.graph:
+                for ancestor in network.graph:
+                    self.assertEqual(network.is_downstream(user, ancestor), user in reach[ancestor])
+
+    def test_unknown_users(self):
+        """
+        Tests that users outside the network have no reach and no ancestors.
+        """
+        network = self.network_class()
+        network.add_referral('A', 'B')
+
+        self.assertFalse(network.is_downstream('Z', 'A'))
+        self.assertFalse(network.is_downstream('B', 'Z'))
+        self.assertFalse(network.is_downstream('A', 'A'))
+        self.assertEqual(list(network.iter_reach('Z')), [])
+        self.assertEqual(network.reach_index.reach_size('Z'), 0)
+        self.assertNotIn('Z', network.reach_index)
+
+    def test_index_is_rebuilt_after_changes(self):
+        """
+        Tests that new users and referrals show up in the index.
+        """
+        network = self.network_class()
+        network.add_referral('A', 'B')
+        self.assertEqual(list(network.iter_reach('A')), ['B'])
+
+        network.add_referral('C', 'A')
+        network.add_user('D')
+        network.add_referral('B', 'E')
+
+        self.assertEqual(list(network.iter_reach('C')), ['A', 'B', 'E'])
+        self.assertTrue(network.is_downstream('E', 'C'))
+        self.assertIn('D', network.reach_index)
+        self.assertEqual(len(network.reach_index), 5)
+
+    def test_deep_chain(self):
+        """
+        Tests that a chain far deeper than the recursion limit is indexed iteratively.
+        """
+        network = self.network_class()
+        network.add_referrals((i, i + 1) for i in range(50_000))
+
+        self.assertEqual(network.reach_index.reach_size(0), 50_000)
+        self.assertTrue(network.is_downstream(50_000, 0))
+        self.assertFalse(network.is_downstream(0, 50_000))
+        self.assertEqual(next(network.iter_reach(49_998)), 49_999)
+        self.assertEqual(network.get_influencers_by_unique_reach(), [0])
+
+class TestStreamingQueries(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.network = _random_forest(self.network_class, 5, 300)
+
+    def _pages(self, get_page, limit):
+
+        items, cursor = [], None
+        while True:
+            page = get_page(limit, cursor)
+            items.extend(page.items)
+            if page.cursor is None:
+                return items
+            cursor = page.cursor
+
+    def test_descendants_bfs_and_dfs(self):
+        """
+        Tests both traversal orders, with and without a depth limit.
+        """
+        network = self.network_class()
+        network.add_referrals([('A', 'B'), ('A', 'C'), ('B', 'D'), ('D', 'E'), ('C', 'F')])
+
+        self.assertEqual(list(network.iter_descendants('A')), ['B', 'C', 'D', 'F', 'E'])
+        self.assertEqual(list(network.iter_descendants('A', order='dfs')), ['B', 'D', 'E', 'C', 'F'])
+        self.assertEqual(list(network.iter_descendants('A', max_depth=2)), ['B', 'C', 'D', 'F'])
+        self.assertEqual(list(network.iter_descendants('A', order='dfs', max_depth=2)), ['B', 'D', 'C', 'F'])
+        self.assertEqual(list(network.iter_descendants('A', max_depth=0)), [])
+        self.assertEqual(list(network.iter_descendants('Z')), [])
+        with self.assertRaises(ValueError):
+            list(network.iter_descendants('A', order='sideways'))
+
+    def test_descendants_match_reach(self):
+        """
+        Tests that unlimited DFS is the reach order and BFS covers the same users.
+        """
+        for user in self.network.graph:
+            reach = list(self.network.iter_reach(user))
+            self.assertEqual(list(self.network.iter_descendants(user, order='dfs')), reach)
+            self.assertCountEqual(list(self.network.iter_descendants(user)), reach)
+
+    def test_descendants_are_lazy(self):
+        """
+        Tests that the first descendants of a very deep chain arrive without a full walk.
+        """
+        network = self.network_class()
+        network.add_referrals((i, i + 1) for i in range(100_000))
+
+        descendants = network.iter_descendants(0, order='dfs')
+        self.assertEqual([next(descendants) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(sum(1 for _ in network.iter_descendants(0, max_depth=10)), 10)
+
+    def test_rankings_stream_in_order(self):
+        """
+        Tests that the ranking generators yield exactly the full rankings.
+        """
+        size = len(self.network.graph)
+        self.assertEqual(list(self.network.iter_top_referrers()), self.network.get_top_k_referrers(size))
+        self.network.get_top_k_referrers(1)  # cached ranking
+        self.assertEqual(list(self.network.iter_top_referrers()), self.network.get_top_k_referrers(size))
+        self.assertEqual(list(self.network.iter_influencers_by_unique_reach()), self.network.get_influencers_by_unique_reach())
+        self.assertEqual(list(self.network.iter_influencers_by_flow_centrality()), self.network.get_influencers_by_flow_centrality())
+
+    def test_pages_cover_rankings(self):
+        """
+        Tests that following the cursors returns every ranking exactly once, in order.
+        """
+        size = len(self.network.graph)
+        for limit in (1, 7, size, size + 5):
+            self.assertEqual(self._pages(self.network.get_top_referrers_page, limit), self.network.get_top_k_referrers(size))
+            self.assertEqual(self._pages(self.network.get_influencers_by_unique_reach_page, limit), self.network.get_influencers_by_unique_reach())
+            self.assertEqual(self._pages(self.network.get_influencers_by_flow_centrality_page, limit), self.network.get_influencers_by_flow_centrality())
+
+        with self.assertRaises(ValueError):
+            self.network.get_top_referrers_page(0)
+
+    def test_pages_after_removals(self):
+        """
+        Tests that every remaining user is paged and streamed exactly once after removals,
+        without a cached ranking to fall back on.
+        """
+        self.assertTrue(self.network.remove_user(10, promote_referrals=True))
+        self.assertTrue(self.network.remove_user(20, promote_referrals=False))
+        self.network._reach_ranking = None
+        users = sorted(self.network.graph)
+        for limit in (1, 7, len(users) + 5):
+            self.assertEqual(sorted(self._pages(self.network.get_top_referrers_page, limit)), users)
+            self.assertEqual(sorted(self._pages(self.network.get_influencers_by_flow_centrality_page, limit)), users)
+        self.assertEqual(sorted(self.network.iter_top_referrers()), users)
+        self.assertEqual(sorted(self.network.iter_influencers_by_flow_centrality()), users)
+
+    def test_cursor_survives_new_users(self):
+        """
+        Tests that users added between pages do not repeat or skip earlier users.
+        """
+        first = self.network.get_top_referrers_page(10)
+        self.network.add_user('late')
+
+        second = self.network.get_top_referrers_page(10, first.cursor)
+
+        ranking = self.network.get_top_k_referrers(len(self.network.graph))
+        self.assertEqual(first.items + second.items, ranking[:20])
+
+    def test_referrals_view(self):
+        """
+        Tests that the view is read-only, follows new referrals and handles unknown users.
+        """
+        network = self.network_class()
+        network.add_referral('A', 'B')
+        view = network.get_direct_referrals_view('A')
+
+        network.add_referral('A', 'C')
+        self.assertEqual(list(view), ['B', 'C'])
+        self.assertEqual((len(view), view[1], view[-1]), (2, 'C', 'C'))
+        self.assertIn('B', view)
+        self.assertFalse(hasattr(view, 'append'))
+        with self.assertRaises(TypeError):
+            view[0] = 'D'
+        self.assertEqual(list(network.get_direct_referrals_view('Z')), [])
+
+class TestTimeWindows(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        # Referrals arrive roughly, but not exactly, in time order
+        self.network = _random_forest(self.network_class, 21, 300, jitter=30)
+
+    def _in_window(self, user, start, end):
+
+        # Untimed referrals are in no window
+        timestamp = self.network.get_referral_time(user)
+        return timestamp is not None and start <= timestamp < end
+
+    def _window_reach(self, user, start, end):
+
+        return sum(1 for descendant in self.network.iter_reach(user) if self._in_window(descendant, start, end))
+
+    def _window_unique_reach(self, start, end):
+
+        networks = {user: {descendant for descendant in self.network.iter_reach(user) if self._in_window(descendant, start, end)} for user in self.network.graph}
+        covered, ranking = set(), []
+        while True:
+            best = max(self.network.graph, key=lambda user: len(networks[user] - covered))
+            if not networks[best] - covered:
+                return ranking
+            ranking.append(best)
+            covered |= networks[best]
+
+    def test_window_matches_brute_force(self):
+        """
+        Tests windowed reach, top-k and unique reach against filtering every network.
+        """
+        for start, end in [(0, 1000), (100, 110), (50, 200), (280, 290), (120, 121), (500, 600), (10, 5)]:
+            window = self.network.window(start, end)
+            reach = {user: self._window_reach(user, start, end) for user in self.network.graph}
+
+            self.assertEqual(len(window), sum(start <= self.network.get_referral_time(user) < end for user in self.network.referrers))
+            self.assertEqual({user: window.get_total_referral_count(user) for user in self.network.graph}, reach)
+            self.assertEqual(window.get_top_k_referrers(len(reach)), sorted(reach, key=reach.get, reverse=True))
+            self.assertEqual(window.get_top_k_referrers(5), sorted(reach, key=reach.get, reverse=True)[:5])
+            self.assertEqual(window.get_influencers_by_unique_reach(), self._window_unique_reach(start, end))
+            self.assertEqual(window.get_influencers_by_unique_reach(3), self._window_unique_reach(start, end)[:3])
+            self.assertEqual(window.get_total_referral_count('nobody'), 0)
+
+    def test_referral_times(self):
+        """
+        Tests explicit, bulk and default timestamps, and that roots have no referral time.
+        """
+        network = self.network_class()
+        before = time.time()
+        network.add_referral('A', 'B')
+        after = time.time()
+        network.add_referrals([('A', 'C', 5.0), ('C', 'D')])
+        network.add_referral('D', 'E', 3.5)
+
+        self.assertTrue(before <= network.get_referral_time('B') <= after)
+        self.assertEqual(network.get_referral_time('C'), 5.0)
+        self.assertEqual(network.get_referral_time('E'), 3.5)
+        self.assertIsNone(network.get_referral_time('A'))
+        self.assertIsNone(network.get_referral_time('Z'))
+        self.assertEqual(network.window(0, 10).get_total_referral_count('A'), 2)
+        self.assertEqual(network.window(0, 10).get_top_k_referrers(2), ['A', 'C'])
+
+    def test_window_follows_new_referrals(self):
+        """
+        Tests that windows opened after a referral include it.
+        """
+        self.assertEqual(self.network.window(1000, 2000).get_top_k_referrers(1), [0])
+        self.network.add_referral(1, 'late', 1500.0)
+        self.network.add_referral('late', 'later', 1600.0)
+
+        window = self.network.window(1000, 2000)
+        self.assertEqual(len(window), 2)
+        self.assertEqual(window.get_total_referral_count(1), 2)
+        # Every ancestor of 'late' gains both referrals; the first of them covers the window
+        self.assertEqual(window.get_influencers_by_unique_reach(), window.get_top_k_referrers(1))
+        self.assertEqual(window.get_total_referral_count(window.get_top_k_referrers(1)[0]), 2)
+
+    def test_unsorted_bulk_times_are_merged(self):
+        """
+        Tests that a batch of shuffled times, with ties, is merged into an index already in use,
+        keeping equal times in the order they were accepted.
+        """
+        index = self.network.window(0, 1000)._index
+        rng = random.Random(4)
+        batch = [(rng.randrange(300), f'bulk{i}', float(rng.randrange(0, 400, 5))) for i in range(200)]
+        self.network.add_referrals(batch)
+
+        for start, end in [(0, 1000), (100, 150), (395, 400)]:
+            window = self.network.window(start, end)
+            self.assertIs(window._index, index)
+            reach = {user: self._window_reach(user, start, end) for user in self.network.graph}
+            self.assertEqual({user: window.get_total_referral_count(user) for user in self.network.graph}, reach)
+            self.assertEqual(window.get_top_k_referrers(len(reach)), sorted(reach, key=reach.get, reverse=True))
+        # Earlier referrals come before the batch's at equal times, and the batch keeps its order
+        names = getattr(self.network, '_names', None)
+        candidates = [candidate if names is None else names[candidate] for candidate in index.event_candidates]
+        batch_order = {candidate: order for order, (_, candidate, _) in enumerate(batch)}
+        events = [(self.network.get_referral_time(candidate), batch_order.get(candidate, -1)) for candidate in candidates]
+        self.assertEqual(events, sorted(events))
+
+    def test_index_is_extended_between_writes(self):
+        """
+        Tests windows opened between writes of every kind against filtering every network,
+        while new leaves extend the time index in place and other writes rebuild it.
+        """
+        rng = random.Random(8)
+        for step in range(150):
+            users = list(self.network.graph)
+            index = self.network._time_index
+            action = rng.random()
+            if action < 0.55:
+                # A new leaf, mostly but not always in time order
+                self.network.add_referral(rng.choice(users), f'leaf{step}', 300.0 + step + rng.randrange(-40, 3))
+            elif action < 0.65:
+                self.network.add_user(f'root{step}')
+                self.network.add_referral(rng.choice([f'root{step}', rng.choice(users)]), f'next{step}', 300.0 + step)
+            elif action < 0.7:
+                self.network.add_referral(rng.choice(users), f'untimed{step}', math.nan)
+            elif action < 0.8:
+                # A candidate that brings referrals of its own, unless that would be a cycle
+                roots = [user for user in users if user not in self.network.referrers and self.network.graph[user]]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.network.add_referral(rng.choice(users), rng.choice(roots), 300.0 + step)
+                index = None
+            elif action < 0.85:
+                self.network.move_referral(rng.choice(list(self.network.referrers)), f'mover{step}', 300.0 + step)
+                index = None
+            elif action < 0.9:
+                self.network.remove_user(rng.choice(users), rng.random() < 0.5)
+                index = None
+
+            start = rng.choice([0, 250, 290, 400, 440])
+            end = start + rng.choice([5, 30, 1000])
+            window = self.network.window(start, end)
+            if index is not None and not index.outgrown():
+                self.assertIs(self.network._time_index, index)
+            reach = {user: self._window_reach(user, start, end) for user in self.network.graph}
+            self.assertEqual({user: window.get_total_referral_count(user) for user in self.network.graph}, reach)
+            self.assertEqual(window.get_top_k_referrers(len(reach)), sorted(reach, key=reach.get, reverse=True))
+            if step % 10 == 0:
+                self.assertEqual(window.get_influencers_by_unique_reach(), self._window_unique_reach(start, end))
+
+    def test_times_survive_save_and_load(self):
+        """
+        Tests that snapshots keep referral times and loaded networks answer the same windows.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'network.snapshot')
+            self.network.save(path)
+            loaded = self.network_class.load(path)
+
+            for candidate in self.network.referrers:
+                self.assertEqual(loaded.get_referral_time(candidate), self.network.get_referral_time(candidate))
+            for start, end in [(0, 1000), (100, 150)]:
+                self.assertEqual(loaded.window(start, end).get_top_k_referrers(20), self.network.window(start, end).get_top_k_referrers(20))
+                self.assertEqual(loaded.window(start, end).get_influencers_by_unique_reach(), self.network.window(start, end).get_influencers_by_unique_reach())
+
+
+class TestAncestorIndex(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.network = _random_forest(self.network_class, 22, 300)
+
+    def _chain(self, user):
+
+        # user and its referrers up to the root, walked one hop at a time
+        chain = [user]
+        while chain[-1] in self.network.referrers:
+            chain.append(self.network.referrers[chain[-1]])
+        return chain
+
+    def assertMatchesChainWalks(self, pairs):
+
+        for user in self.network.graph:
+            chain = self._chain(user)
+            self.assertEqual(self.network.get_depth(user), len(chain) - 1)
+            for k in (0, 1, 2, 3, 5, len(chain) - 1, len(chain)):
+                self.assertEqual(self.network.get_ancestor(user, k), chain[k] if k < len(chain) else None)
+
+        expected_ancestors, expected_distances = [], []
+        for first, second in pairs:
+            first_chain, second_chain = self._chain(first), self._chain(second)
+            common = next((user for user in first_chain if user in second_chain), None)
+            expected_ancestors.append(common)
+            expected_distances.append(None if common is None else first_chain.index(common) + second_chain.index(common))
+
+        self.assertEqual([self.network.get_lowest_common_ancestor(first, second) for first, second in pairs], expected_ancestors)
+        self.assertEqual([self.network.get_distance(first, second) for first, second in pairs], expected_distances)
+        self.assertEqual(self.network.get_lowest_common_ancestors(pairs), expected_ancestors)
+        self.assertEqual(self.network.get_distances(pairs), expected_distances)
+
+    def test_queries_match_chain_walks(self):
+        """
+        Tests depth, k-th ancestor, common ancestor and distance, singly and in batches.
+        """
+        rng = random.Random(1)
+        users = list(self.network.graph)
+        pairs = [(rng.choice(users), rng.choice(users)) for _ in range(500)] + [(5, 5), (0, 1)]
+
+        self.assertMatchesChainWalks(pairs)
+
+    def test_index_is_extended_in_place(self):
+        """
+        Tests that new users, new leaves and attached trees update the built index.
+        """
+        index = self.network.ancestor_index
+        self.network.add_user('loner')
+        self.network.add_referral(299, 'leaf')
+        # A deep chain forces extra jump levels, then hangs below an existing user
+        self.network.add_referrals([(f'c{i}', f'c{i + 1}') for i in range(70)])
+        self.network.add_referral('leaf', 'c0')
+
+        self.assertIs(self.network.ancestor_index, index)
+        self.assertEqual(self.network.get_depth('c70'), self.network.get_depth('leaf') + 71)
+        users = list(self.network.graph)
+        self.assertMatchesChainWalks([(users[i], users[-i]) for i in range(1, 200)] + [('loner', 'c3'), ('c70', 0)])
+
+    def test_only_upward_queries_build_the_index(self):
+        """
+        Tests that flow centrality leaves inserts free of index maintenance.
+        """
+        self.network.get_influencers_by_flow_centrality()
+        self.assertIsNone(self.network._ancestor_index)
+
+        self.network.get_depth(0)
+        self.assertIsNotNone(self.network._ancestor_index)
+
+    def test_unknown_users(self):
+        """
+        Tests that unknown users and pairs across trees are answered with None.
+        """
+        self.network.add_user('loner')
+        self.assertIsNone(self.network.get_depth('Z'))
+        self.assertIsNone(self.network.get_ancestor('Z', 1))
+        self.assertIsNone(self.network.get_ancestor(5, -1))
+        self.assertIsNone(self.network.get_lowest_common_ancestor('Z', 5))
+        self.assertEqual(self.network.get_lowest_common_ancestors([('Z', 5), ('loner', 5), (5, 5)]), [None, None, 5])
+        self.assertEqual(self.network.get_distances([('Z', 'Z'), ('loner', 'loner')]), [None, 0])
+        self.assertEqual(self.network_class().get_distances([('Z', 'Y')]), [None])
+
+
+class TestRemovalAndMoves(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.network = _random_forest(self.network_class, 24, 200, jitter=0)
+
+    def rebuild(self):
+
+        # The same forest built from scratch: users in order, then every referral list
+        network = self.network_class()
+        for user in self.network.graph:
+            network.add_user(user)
+        for user in list(self.network.graph):
+            for referral in self.network.graph[user]:
+                network.add_referral(user, referral, self.network.get_referral_time(referral))
+        return network
+
+    def assertMatchesRebuild(self):
+
+        expected = self.rebuild()
+        users = list(expected.graph)
+        pairs = list(zip(users, reversed(users)))
+        self.assertEqual({user: list(referrals) for user, referrals in self.network.graph.items()}, {user: list(referrals) for user, referrals in expected.graph.items()})
+        self.assertEqual(dict(self.network.referrers), dict(expected.referrers))
+        self.assertEqual(dict(self.network.reach_counts), dict(expected.reach_counts))
+        self.assertEqual(list(self.network.iter_top_referrers()), list(expected.iter_top_referrers()))
+        self.assertEqual(self.network.get_distances(pairs), expected.get_distances(pairs))
+        self.assertEqual(self.network.get_influencers_by_unique_reach(10), expected.get_influencers_by_unique_reach(10))
+        self.assertEqual(self.network.window(50, 150).get_top_k_referrers(10), expected.window(50, 150).get_top_k_referrers(10))
+
+    def test_moves_update_derived_state(self):
+        """
+        Tests that moved networks leave every count, ranking and index as a rebuild would.
+        """
+        rng = random.Random(1)
+        # Build the cached ranking and ancestor index so the moves patch them
+        self.network.get_top_k_referrers(5)
+        self.network.get_depth(0)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(200):
+                users = list(self.network.graph)
+                self.network.move_referral(rng.choice(users), rng.choice(users + [f'new{i}']), 1000.0 + i)
+        self.assertMatchesRebuild()
+
+    def test_move_constraints(self):
+        """
+        Tests that moves into the candidate's own network, onto itself or of unknown users fail.
+        """
+        user = next(user for user in self.network.graph if self.network.get_direct_referrals(user))
+        referral = self.network.get_direct_referrals(user)[0]
+        before = dict(self.network.reach_counts)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(self.network.move_referral(user, referral))
+            self.assertFalse(self.network.move_referral(user, user))
+            self.assertFalse(self.network.move_referral('nobody', user))
+        self.assertEqual(dict(self.network.reach_counts), before)
+
+        # A root can be moved below another tree, and back out is a cycle no longer
+        root = next(user for user in self.network.graph if user not in self.network.referrers and user != 0)
+        self.assertTrue(self.network.move_referral(root, 0, 5.0))
+        self.assertEqual(self.network.get_referral_time(root), 5.0)
+        self.assertTrue(self.network.is_downstream(root, 0))
+
+    def test_cycle_checks_after_moves(self):
+        """
+        Tests that new referrals are checked against the moved forest, not the original one.
+        """
+        self.network.add_referral('A', 'B')
+        self.network.add_referral('B', 'C')
+        self.network.move_referral('C', 'X')
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertTrue(self.network.add_referral('C', 'A'))
+            self.assertFalse(self.network.add_referral('B', 'X'))
+        self.assertEqual(self.network.get_total_referral_count('C'), 2)
+
+    def test_removals_update_derived_state(self):
+        """
+        Tests that removals, promoting or detaching referrals, leave a rebuild's state.
+        """
+        rng = random.Random(2)
+        self.network.get_top_k_referrers(5)
+        self.network.get_depth(0)
+
+        for i in range(60):
+            self.network.remove_user(rng.choice(list(self.network.graph)), promote_referrals=i % 2 == 0)
+        self.assertMatchesRebuild()
+
+    def test_remove_promotes_in_place(self):
+        """
+        Tests that promoted referrals take the removed user's place and detached ones become roots.
+        """
+        network = self.network_class()
+        network.add_referrals([('A', 'B'), ('A', 'C'), ('A', 'D'), ('C', 'E'), ('C', 'F'), ('E', 'G')])
+
+        self.assertTrue(network.remove_user('C'))
+        self.assertEqual(network.get_direct_referrals('A'), ['B', 'E', 'F', 'D'])
+        self.assertEqual(network.get_total_referral_count('A'), 5)
+
+        self.assertTrue(network.remove_user('E', promote_referrals=False))
+        self.assertEqual(network.get_direct_referrals('A'), ['B', 'F', 'D'])
+        self.assertNotIn('G', network.referrers)
+        self.assertIsNone(network.get_referral_time('G'))
+        self.assertEqual(network.get_top_k_referrers(1), ['A'])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(network.remove_user('E'))
+
+
+class TestUniqueReachRanker(unittest.TestCase):
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.network = _random_forest(self.network_class, 25, 300, root_rate=0.2, span=30)
+        self.rng = random.Random(26)
+
+    def test_matches_full_recompute_under_inserts(self):
+        """
+        Tests that the repaired ranking equals the greedy rerun after every batch of inserts.
+        """
+        ranker = self.network.unique_reach_ranker
+        self.assertEqual(ranker.get_influencers(), self.network.get_influencers_by_unique_reach())
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for batch in range(20):
+                for _ in range(15):
+                    # New leaves, new roots and whole trees attached below other trees
+                    self.network.add_referral(self.rng.randrange(300 + batch), self.rng.randrange(320))
+                self.assertEqual(ranker.get_influencers(), self.network.get_influencers_by_unique_reach())
+                self.assertEqual(ranker.get_influencers(5), self.network.get_influencers_by_unique_reach(5))
+        self.assertEqual(list(ranker), self.network.get_influencers_by_unique_reach())
+        self.assertEqual(len(ranker), len(self.network.get_influencers_by_unique_reach()))
+
+    def test_matches_full_recompute_after_moves(self):
+        """
+        Tests that moved networks re-rank both the old and the new tree.
+        """
+        ranker = self.network.unique_reach_ranker
+        users = list(self.network.graph)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(50):
+                self.network.move_referral(self.rng.choice(users), self.rng.choice(users))
+                self.assertEqual(ranker.get_influencers(), self.network.get_influencers_by_unique_reach())
+
+    def test_removals(self):
+        """
+        Tests that removed users leave the ranking and detached referrals can enter it.
+        """
+        ranker = self.network.unique_reach_ranker
+        for i in range(40):
+            user = self.rng.choice(list(self.network.graph))
+            self.network.remove_user(user, promote_referrals=i % 2 == 0)
+            self.assertEqual(ranker.get_influencers(), self.network.get_influencers_by_unique_reach())
+
+        self.network.add_referral('late', 'later')
+        self.assertEqual(ranker.get_influencers(), self.network.get_influencers_by_unique_reach())
+
+    def test_empty_network(self):
+        """
+        Tests that an empty network ranks no one until referrals arrive.
+        """
+        network = self.network_class()
+        ranker = network.unique_reach_ranker
+        self.assertEqual(ranker.get_influencers(), [])
+
+        network.add_user('A')
+        network.add_referral('B', 'C')
+        self.assertEqual(ranker.get_influencers(), ['B'])
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
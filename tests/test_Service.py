@@ -0,0 +1,248 @@
+import asyncio
+import json
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from source.Optimization import min_bonus_for_target
+from source.ReferralNetwork import ReferralNetwork
+from source.Service import ReadWriteLock, ReferralService, generate_load
+from source.Simulation import days_to_target, simulate
+from source.WriteAheadLog import WriteAheadLog
+
+class TestReadWriteLock(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for the asyncio readers-writer lock.
+    """
+
+    async def test_readers_share_writers_exclude(self):
+        """
+        Tests that readers overlap, and a writer waits for them and then runs alone.
+        """
+        lock = ReadWriteLock()
+        events = []
+
+        async def reader(name):
+            async with lock.read():
+                events.append(f'{name} in')
+                await asyncio.sleep(0.01)
+                events.append(f'{name} out')
+
+        async def writer():
+            await asyncio.sleep(0.001)
+            async with lock.write():
+                events.append('writer in')
+                await asyncio.sleep(0.01)
+                events.append('writer out')
+
+        await asyncio.gather(reader('r1'), reader('r2'), writer())
+
+        self.assertEqual(events[:2], ['r1 in', 'r2 in'])
+        self.assertEqual(events[-2:], ['writer in', 'writer out'])
+
+    async def test_waiting_writer_blocks_new_readers(self):
+        """
+        Tests that a reader arriving after a waiting writer runs after that writer.
+        """
+        lock = ReadWriteLock()
+        events = []
+
+        async def first_reader():
+            async with lock.read():
+                await asyncio.sleep(0.02)
+                events.append('first reader')
+
+        async def writer():
+            await asyncio.sleep(0.005)
+            async with lock.write():
+                events.append('writer')
+
+        async def late_reader():
+            await asyncio.sleep(0.01)
+            async with lock.read():
+                events.append('late reader')
+
+        await asyncio.gather(first_reader(), writer(), late_reader())
+
+        self.assertEqual(events, ['first reader', 'writer', 'late reader'])
+
+
+class TestReferralService(unittest.IsolatedAsyncioTestCase):
+    """
+    Tests for the query service over JSON lines and HTTP.
+    """
+
+    async def asyncSetUp(self):
+
+        self.network = ReferralNetwork()
+        self.network.add_referrals([('A', 'B'), ('B', 'C'), ('A', 'D'), ('E', 'F')])
+        self.service = ReferralService(self.network, workers=1)
+        await self.service.start()
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.service.port)
+
+    async def asyncTearDown(self):
+
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.service.close()
+
+    async def request(self, **request):
+
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def http(self, request_line, body=b''):
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.service.port)
+        writer.write(f'{request_line} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await writer.wait_closed()
+        head, _, payload = response.partition(b'\r\n\r\n')
+        return head.split(b'\r\n')[0].decode(), json.loads(payload)
+
+    async def test_reads(self):
+        """
+        Tests the reach, referral, top-k, downstream and stats queries.
+        """
+        self.assertEqual(await self.request(id=1, op='reach', user='A'), {'id': 1, 'result': 3})
+        self.assertEqual((await self.request(op='direct_referrals', user='A'))['result'], ['B', 'D'])
+        self.assertEqual((await self.request(op='top_k', k=2))['result'], ['A', 'B'])
+        self.assertTrue((await self.request(op='is_downstream', user='C', ancestor='A'))['result'])
+        self.assertEqual((await self.request(op='stats'))['result'], {'users': 6, 'referrals': 4, 'version': 0})
+
+    async def test_errors(self):
+        """
+        Tests that bad requests get an error response and leave the connection usable.
+        """
+        self.assertIn('Unknown operation', (await self.request(id=7, op='nope'))['error'])
+        self.assertEqual(await self.request(id=8, op='reach'), {'id': 8, 'error': 'Missing parameter: user'})
+
+        self.writer.write(b'not json\n')
+        self.assertIn('error', json.loads(await self.reader.readline()))
+        self.assertEqual((await self.request(op='reach', user='B'))['result'], 1)
+
+    async def test_writes_are_batched(self):
+        """
+        Tests that concurrent writes are applied in batches and report rejections.
+        """
+        results = await asyncio.gather(
+            *(self.service.handle('add_referral', {'referrer': 'C', 'candidate': f'new{i}'}) for i in range(50)),
+            self.service.handle('add_referral', {'referrer': 'C', 'candidate': 'A'}),
+            self.service.handle('add_referral', {'referrer': 'F', 'candidate': 'B'}),
+        )
+
+        self.assertTrue(all(result == {'accepted': True} for result in results[:50]))
+        self.assertEqual(results[50], {'accepted': False, 'reason': 'cycle'})
+        self.assertEqual(results[51], {'accepted': False, 'reason': 'already_referred'})
+        self.assertLess(self.service.write_batches, 10)
+        self.assertEqual(self.network.get_total_referral_count('A'), 53)
+        self.assertEqual(self.service.version, self.service.write_batches)
+
+    async def test_analytics_run_on_snapshots(self):
+        """
+        Tests that the pool analytics match the network and follow later writes.
+        """
+        unique_reach = await self.request(op='unique_reach', k=2)
+        flow = await self.request(op='flow_centrality')
+
+        self.assertEqual(unique_reach['result'], self.network.get_influencers_by_unique_reach(2))
+        self.assertEqual(flow['result'], self.network.get_influencers_by_flow_centrality())
+
+        await self.request(op='add_referral', referrer='F', candidate='G')
+        await self.request(op='add_referral', referrer='G', candidate='H')
+        self.assertEqual((await self.request(op='unique_reach', k=1))['result'], self.network.get_influencers_by_unique_reach(1))
+        self.assertEqual((await self.request(op='flow_centrality', k=1))['result'], self.network.get_influencers_by_flow_centrality()[:1])
+        self.assertEqual(len(self.service._snapshots), 1)
+
+    async def test_simulation_queries(self):
+        """
+        Tests the simulation and bonus queries against the library functions.
+        """
+        self.assertEqual((await self.request(op='simulate', p=0.1, days=20))['result'], simulate(0.1, 20))
+        self.assertEqual((await self.request(op='days_to_target', p=0.1, target=500))['result'], days_to_target(0.1, 500))
+
+        bonus = await self.request(op='min_bonus', days=30, target=1000, adoption=[[0, 0], [1000, 1]])
+        self.assertEqual(bonus['result'], min_bonus_for_target(30, 1000, lambda bonus: min(bonus, 1000) / 1000))
+
+    async def test_http(self):
+        """
+        Tests GET query strings, POST bodies and HTTP status codes.
+        """
+        self.assertEqual(await self.http('GET /reach?user=A'), ('HTTP/1.1 200 OK', {'result': 3}))
+        self.assertEqual(await self.http('GET /top_k?k=1'), ('HTTP/1.1 200 OK', {'result': ['A']}))
+        self.assertEqual(
+            await self.http('POST /add_referral', json.dumps({'referrer': 'D', 'candidate': 'X'}).encode()),
+            ('HTTP/1.1 200 OK', {'result': {'accepted': True}}),
+        )
+        self.assertEqual((await self.http('GET /reach'))[0], 'HTTP/1.1 400 Bad Request')
+        self.assertEqual((await self.http('GET /nope'))[0], 'HTTP/1.1 404 Not Found')
+
+    async def test_writes_are_logged_before_acknowledged(self):
+        """
+        Tests that with a write-ahead log every batch is committed before it is answered.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            log = WriteAheadLog(directory, sync_interval=60, fsync=False)
+            service = ReferralService(log.recover(), workers=1, log=log)
+            await service.start()
+            try:
+                results = await asyncio.gather(*(service.handle('add_referral', {'referrer': 'A', 'candidate': i}) for i in range(20)))
+                self.assertTrue(all(result['accepted'] for result in results))
+                self.assertEqual(log.commits, service.write_batches)
+            finally:
+                await service.close()
+                log.close()
+
+            log = WriteAheadLog(directory)
+            recovered = log.recover()
+            log.close()
+            self.assertEqual(recovered.get_direct_referrals('A'), list(range(20)))
+
+    async def test_commits_do_not_block_the_event_loop(self):
+        """
+        Tests that the event loop keeps running while a write batch waits for a slow fsync.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            # Every append is past the sync interval, so the log commits as the write is applied
+            log = WriteAheadLog(directory, sync_interval=0)
+            service = ReferralService(log.recover(), workers=1, log=log)
+            await service.start()
+            try:
+                ticks = []
+
+                async def ticker():
+                    while True:
+                        ticks.append(time.monotonic())
+                        await asyncio.sleep(0.005)
+
+                with mock.patch('source.WriteAheadLog.os.fsync', side_effect=lambda descriptor: time.sleep(0.3)):
+                    task = asyncio.create_task(ticker())
+                    result = await service.handle('add_referral', {'referrer': 'A', 'candidate': 'B'})
+                    task.cancel()
+
+                self.assertTrue(result['accepted'])
+                self.assertGreaterEqual(log.commits, 1)
+                self.assertLess(max(later - earlier for earlier, later in zip(ticks, ticks[1:])), 0.15)
+            finally:
+                await service.close()
+                log.close()
+
+    async def test_load_generator(self):
+        """
+        Tests that the load generator completes its requests and reports latencies.
+        """
+        report = await generate_load('127.0.0.1', self.service.port, requests=300, concurrency=8, users=50)
+
+        self.assertEqual(report.requests, 300)
+        self.assertEqual(report.errors, 0)
+        self.assertGreater(report.throughput, 0)
+        self.assertLessEqual(report.p50, report.p99)
+        self.assertGreater(len(self.network.graph), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
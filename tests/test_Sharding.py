@@ -0,0 +1,83 @@
+import unittest
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.Generators import preferential_attachment_forest
+from source.ReferralNetwork import ReferralNetwork
+from source.Sharding import ShardedAnalytics, _balance_trees
+
+class TestShardedAnalytics(unittest.TestCase):
+    """
+    Tests that the sharded rankings equal the single-process ones.
+    """
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.network = self.network_class()
+        self.network.add_referrals(preferential_attachment_forest(2000, seed=4, root_probability=0.05))
+        self.network.add_user('loner')
+
+    def assertMatchesNetwork(self, analytics):
+
+        self.assertEqual(analytics.get_top_k_referrers(1), self.network.get_top_k_referrers(1))
+        self.assertEqual(analytics.get_top_k_referrers(100), self.network.get_top_k_referrers(100))
+        self.assertEqual(analytics.get_top_k_referrers(len(self.network.graph)), self.network.get_top_k_referrers(len(self.network.graph)))
+        self.assertEqual(analytics.get_influencers_by_unique_reach(), self.network.get_influencers_by_unique_reach())
+        self.assertEqual(analytics.get_influencers_by_unique_reach(10), self.network.get_influencers_by_unique_reach(10))
+        self.assertEqual(analytics.get_influencers_by_flow_centrality(), self.network.get_influencers_by_flow_centrality())
+        self.assertEqual(analytics.get_influencers_by_flow_centrality(10), self.network.get_influencers_by_flow_centrality()[:10])
+
+    def test_single_process(self):
+        """
+        Tests the shards ranked in this process.
+        """
+        with ShardedAnalytics(self.network, workers=1, shards=6) as analytics:
+            self.assertMatchesNetwork(analytics)
+
+    def test_process_pool(self):
+        """
+        Tests the shards ranked by worker processes over shared memory.
+        """
+        with ShardedAnalytics(self.network, workers=2) as analytics:
+            self.assertEqual(len(analytics.shards), 8)
+            self.assertMatchesNetwork(analytics)
+
+    def test_shards_are_balanced(self):
+        """
+        Tests that every tree lands in exactly one shard and shard sizes stay close.
+        """
+        with ShardedAnalytics(self.network, workers=1, shards=4) as analytics:
+            roots = [user_id for shard in analytics.shards for user_id in shard]
+            expected_roots = [user_id for user_id, user in enumerate(self.network.graph) if user not in self.network.referrers]
+            self.assertEqual(sorted(roots), expected_roots)
+
+            sizes = [sum(self.network.get_total_referral_count(analytics.names[root_id]) + 1 for root_id in shard) for shard in analytics.shards]
+            largest_tree = max(self.network.get_total_referral_count(user) + 1 for user in self.network.graph)
+            self.assertEqual(sum(sizes), len(self.network.graph))
+            self.assertLessEqual(max(sizes) - min(sizes), largest_tree)
+
+        self.assertEqual(_balance_trees([-1, 0, -1], [1, 0, 0], 8), [[0], [2]])
+
+    def test_closed_analytics(self):
+        """
+        Tests that rankings need open analytics, and that closing twice is harmless.
+        """
+        analytics = ShardedAnalytics(self.network_class(), workers=1)
+        self.assertEqual(analytics.get_influencers_by_unique_reach(), [])
+        analytics.close()
+        analytics.close()
+        with self.assertRaises(RuntimeError):
+            analytics.get_top_k_referrers(3)
+
+
+class TestCompactShardedAnalytics(TestShardedAnalytics):
+    """
+    Runs the sharded analytics tests against the array-backed backend.
+    """
+
+    network_class = CompactReferralNetwork
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,12 @@
+import math
 import unittest
+import warnings
+from collections import deque
 
-from source.Simulation import simulate, days_to_target
+from unittest import mock
+
+from source import Simulation
+from source.Simulation import GrowthCurveCache, SimulationConfig, simulate, days_to_target, simulate_batch
 
 class TestSimulation(unittest.TestCase):
     """
@@ -89,5 +95,217 @@ class TestSimulation(unittest.TestCase):
         """
         self.assertEqual(days_to_target(p=0, target_total=1), -1)
 
+class TestCohortEngine(unittest.TestCase):
+    """
+    Cross-checks the ring-buffer engine against the original per-day cohort deque.
+    """
+
+    def _reference_simulate(self, p, days):
+        # The original implementation, which re-ages every cohort each day
+        active_cohorts = deque([(100, 0)])
+        total_active_referrers = 100.0
+        cumulative_referrals = 0.0
+        totals = []
+        for _ in range(days):
+            if total_active_referrers < 1:
+                totals.append(cumulative_referrals)
+                continue
+            new_referrals_today = total_active_referrers * p
+            cumulative_referrals += new_referrals_today
+            totals.append(cumulative_referrals)
+            temp_cohorts = deque()
+            for count, referrals_made in active_cohorts:
+                if referrals_made + p < 10:
+                    temp_cohorts.append((count, referrals_made + p))
+                else:
+                    total_active_referrers -= count
+            active_cohorts = temp_cohorts
+            if new_referrals_today > 0:
+                active_cohorts.append((new_referrals_today, 0.0))
+                total_active_referrers += new_referrals_today
+        return totals
+
+    def test_simulate_matches_reference(self):
+        """
+        Tests probabilities whose lifetimes hit float rounding (0.1 needs 101 additions to reach 10),
+        retire every day (p >= 10) or outlive the horizon.
+        """
+        for p in [0.0001, 0.01, 0.1, 0.2, 1 / 3, 0.7, 1.0, 2.5, 9.99, 10.0, 11.0]:
+            self.assertEqual(simulate(p, 150), self._reference_simulate(p, 150), f"p={p}")
+
+    def test_days_to_target_matches_reference(self):
+        """
+        Tests that days_to_target agrees with the first day the reference curve reaches the target.
+        """
+        for p in [0.01, 0.1, 0.35, 2.0]:
+            curve = self._reference_simulate(p, 1000)
+            for target in [1, 100, 1000, 10 ** 5]:
+                expected = next((day for day, total in enumerate(curve, start=1) if total >= target), -1)
+                self.assertEqual(days_to_target(p, target), expected, f"p={p}, target={target}")
+
+class TestGrowthCurveCache(unittest.TestCase):
+    """
+    Tests for the LRU cache of growth curves behind days_to_target.
+    """
+
+    def test_hits_misses_and_lazy_extension(self):
+        """
+        Tests that repeated queries for one p reuse its curve, extending it only as needed.
+        """
+        cache = GrowthCurveCache()
+
+        self.assertEqual(cache.days_to_target(0.1, 21), 2)
+        self.assertEqual(cache.info().cached_days, 2 + 101)  # two curve days plus the 101-slot ring buffer
+        self.assertEqual(cache.days_to_target(0.1, 10), 1)
+        self.assertEqual(cache.days_to_target(0.1, 30), 3)
+        self.assertEqual(cache.days_to_target(0.2, 30), 2)
+
+        info = cache.info()
+        self.assertEqual((info.hits, info.misses, info.curves), (2, 2, 2))
+
+    def test_unreachable_targets_finalise_the_curve(self):
+        """
+        Tests that a curve which hits MAX_SIMULATION_DAYS drops its engine and keeps answering.
+        """
+        cache = GrowthCurveCache()
+
+        self.assertEqual(cache.days_to_target(0.0001, 10 ** 6), -1)
+        self.assertEqual(cache.info().cached_days, Simulation.MAX_SIMULATION_DAYS)
+        self.assertEqual(cache.days_to_target(0.0001, 10), days_to_target(0.0001, 10))
+
+    def test_memory_cap_evicts_least_recently_used(self):
+        """
+        Tests that curves are evicted oldest-first once the stored days exceed the cap.
+        """
+        cache = GrowthCurveCache(max_cached_days=2500)
+
+        # Each of these curves runs the full MAX_SIMULATION_DAYS without reaching the target
+        cache.days_to_target(0.0001, 10 ** 6)
+        cache.days_to_target(0.0002, 10 ** 6)
+        cache.days_to_target(0.0001, 10 ** 6)
+        cache.days_to_target(0.0003, 10 ** 6)
+
+        info = cache.info()
+        self.assertEqual(info.cached_days, 2 * Simulation.MAX_SIMULATION_DAYS)
+        self.assertEqual((info.evictions, info.curves), (1, 2))
+        self.assertEqual(cache.days_to_target(0.0001, 1), days_to_target(0.0001, 1))
+        self.assertEqual(cache.info().hits, 2)
+
+    def test_within_days_limits_extension(self):
+        """
+        Tests that a deadline stops the curve from being simulated past it.
+        """
+        cache = GrowthCurveCache()
+
+        self.assertEqual(cache.days_to_target(0.1, 10 ** 5, within_days=20), -1)
+        self.assertEqual(cache.info().cached_days, 20 + 101)
+        self.assertEqual(cache.days_to_target(0.1, 30, within_days=2), -1)
+        self.assertEqual(cache.days_to_target(0.1, 30, within_days=3), 3)
+        self.assertEqual(cache.days_to_target(0.1, 10 ** 5), days_to_target(0.1, 10 ** 5))
+
+    def test_constants_are_part_of_the_key(self):
+        """
+        Tests that changing the simulation constants does not reuse stale curves.
+        """
+        cache = GrowthCurveCache()
+        cache.days_to_target(0.1, 30)
+        with mock.patch.object(Simulation, 'INITIAL_REFERRERS', 1000):
+            self.assertEqual(cache.days_to_target(0.1, 30), 1)
+        self.assertEqual(cache.info().misses, 2)
+
+class TestSimulationConfig(unittest.TestCase):
+    """
+    Tests for passing the simulation parameters as a config object.
+    """
+
+    def test_default_config_matches_module_constants(self):
+        """
+        Tests that the default config reproduces the behaviour without one.
+        """
+        config = SimulationConfig()
+        self.assertEqual(simulate(0.3, 50, config), simulate(0.3, 50))
+        self.assertEqual(days_to_target(0.3, 5000, config), days_to_target(0.3, 5000))
+
+    def test_config_replaces_constants(self):
+        """
+        Tests that a config gives the same results as patching the module constants.
+        """
+        config = SimulationConfig(initial_referrers=20, referral_capacity=3, max_simulation_days=40)
+        with mock.patch.multiple(Simulation, INITIAL_REFERRERS=20, REFERRAL_CAPACITY=3, MAX_SIMULATION_DAYS=40):
+            expected_curve = simulate(0.7, 60)
+            expected_days = [days_to_target(0.7, target) for target in (1, 100, 10 ** 4, 10 ** 9)]
+            expected_batch = simulate_batch([0.1, 0.7], 60)
+
+        self.assertEqual(simulate(0.7, 60, config), expected_curve)
+        self.assertEqual([days_to_target(0.7, target, config) for target in (1, 100, 10 ** 4, 10 ** 9)], expected_days)
+        self.assertEqual([list(row) for row in simulate_batch([0.1, 0.7], 60, config)], [list(row) for row in expected_batch])
+
+    def test_configs_get_separate_cached_curves(self):
+        """
+        Tests that the growth curve cache keys curves by config.
+        """
+        cache = GrowthCurveCache()
+        cache.days_to_target(0.1, 30)
+        self.assertEqual(cache.days_to_target(0.1, 30, SimulationConfig(initial_referrers=1000)), 1)
+        self.assertEqual(cache.days_to_target(0.1, 30, SimulationConfig()), 3)
+        self.assertEqual((cache.info().hits, cache.info().misses), (1, 2))
+
+class TestSimulateBatch(unittest.TestCase):
+    """
+    Tests for the lockstep batch simulation.
+    """
+
+    def test_matches_scalar_simulation(self):
+        """
+        Tests every scenario against simulate(), including zero, tiny and capacity-exhausting p.
+        """
+        ps = [0, -1, 0.0001, 0.01, 0.1, 0.25, 0.5, 1.0, 3.3, 5.0, 10.0, 12.0]
+        days = 60
+
+        results = simulate_batch(ps, days)
+
+        self.assertEqual(len(results), len(ps))
+        for p, row in zip(ps, results):
+            expected = simulate(p, days)
+            self.assertEqual(len(row), days)
+            for expected_total, actual_total in zip(expected, row):
+                self.assertAlmostEqual(expected_total, float(actual_total), delta=1e-9 * max(1.0, expected_total))
+
+    def test_overflow_matches_scalar_simulation(self):
+        """
+        Tests that scenarios overflowing to inf and then nan follow simulate() day by day,
+        without NumPy warnings.
+        """
+        ps = [2.0, 10.0, 50.0]
+        days = 1000
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            results = simulate_batch(ps, days)
+
+        for p, row in zip(ps, results):
+            for expected_total, actual_total in zip(simulate(p, days), row):
+                if math.isnan(expected_total):
+                    self.assertTrue(math.isnan(actual_total))
+                else:
+                    self.assertEqual(expected_total, float(actual_total))
+
+    def test_per_scenario_horizons(self):
+        """
+        Tests that shorter horizons are padded with NaN up to the longest one.
+        """
+        results = simulate_batch([0.1, 0.1, 0.1], [3, 0, 5])
+
+        self.assertEqual([float(total) for total in results[0][:3]], simulate(0.1, 3))
+        self.assertTrue(all(math.isnan(total) for total in results[0][3:]))
+        self.assertTrue(all(math.isnan(total) for total in results[1]))
+        self.assertAlmostEqual(float(results[2][4]), simulate(0.1, 5)[-1])
+
+    def test_empty_batch(self):
+        """
+        Tests that an empty batch returns no rows.
+        """
+        self.assertEqual(len(simulate_batch([], 10)), 0)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
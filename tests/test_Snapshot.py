@@ -0,0 +1,137 @@
+import contextlib
+import io
+import os
+import random
+import struct
+import tempfile
+import unittest
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.ReferralNetwork import ReferralNetwork
+
+class TestSnapshot(unittest.TestCase):
+    """
+    Tests for saving and loading binary snapshots of both backends.
+    """
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'network.snapshot')
+
+        rng = random.Random(3)
+        self.referrals = []
+        for i in range(1, 300):
+            referrer = rng.randrange(i)
+            # Mix str and int names, and referrals made out of insertion order
+            self.referrals.append((f"user{referrer}" if referrer % 3 else referrer, f"user{i}" if i % 3 else i))
+        self.referrals.reverse()
+
+    def tearDown(self):
+
+        self.directory.cleanup()
+
+    def _build(self, network_class):
+        network = network_class()
+        network.add_user('isolated')
+        network.add_referrals(self.referrals)
+        return network
+
+    def test_dict_backend_round_trip(self):
+        """
+        Tests that a saved and reloaded ReferralNetwork is identical, including dict order.
+        """
+        network = self._build(ReferralNetwork)
+        network.save(self.path)
+        loaded = ReferralNetwork.load(self.path)
+
+        self.assertEqual(list(loaded.graph.items()), list(network.graph.items()))
+        self.assertEqual(list(loaded.referrers.items()), list(network.referrers.items()))
+        self.assertEqual(loaded.reach_counts, network.reach_counts)
+        self.assertEqual(loaded.get_influencers_by_unique_reach(), network.get_influencers_by_unique_reach())
+
+    def test_loaded_dict_network_stays_writable(self):
+        """
+        Tests that a reloaded network keeps enforcing the constraints and counting reach.
+        """
+        network = ReferralNetwork()
+        network.add_referral('A', 'B')
+        network.add_referral('B', 'C')
+        network.save(self.path)
+        loaded = ReferralNetwork.load(self.path)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(loaded.add_referral('C', 'A'))
+        self.assertTrue(loaded.add_referral('C', 'D'))
+        self.assertEqual(loaded.get_total_referral_count('A'), 3)
+
+    def test_memory_mapped_compact_network(self):
+        """
+        Tests that a memory-mapped compact network answers every query like the original,
+        and refuses writes.
+        """
+        network = self._build(ReferralNetwork)
+        network.save(self.path)
+        mapped = CompactReferralNetwork.load(self.path)
+
+        self.assertEqual(dict(mapped.graph), network.graph)
+        self.assertEqual(dict(mapped.referrers), network.referrers)
+        self.assertEqual(mapped.get_total_referral_count('user7'), network.get_total_referral_count('user7'))
+        self.assertEqual(mapped.get_total_referral_count(3), network.get_total_referral_count(3))
+        self.assertEqual(mapped.get_total_referral_count('unknown'), 0)
+        self.assertEqual(mapped.get_top_k_referrers(25), network.get_top_k_referrers(25))
+        self.assertEqual(mapped.get_influencers_by_flow_centrality(), network.get_influencers_by_flow_centrality())
+
+        with self.assertRaises(TypeError):
+            mapped.add_referral('user1', 'new user')
+
+    def test_compact_round_trip_without_mmap(self):
+        """
+        Tests that a compact network loaded into private memory can keep growing.
+        """
+        network = self._build(CompactReferralNetwork)
+        network.save(self.path)
+        loaded = CompactReferralNetwork.load(self.path, use_mmap=False)
+
+        self.assertEqual(dict(loaded.graph), dict(network.graph))
+        self.assertEqual(dict(loaded.reach_counts), dict(network.reach_counts))
+
+        root = network.get_top_k_referrers(1)[0]
+        leaf = next(user for user in network.graph if not network.graph[user] and user in network.referrers)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertFalse(loaded.add_referral(leaf, root))
+        self.assertTrue(loaded.add_referral(leaf, 'new user'))
+        self.assertEqual(loaded.get_total_referral_count(root), network.get_total_referral_count(root) + 1)
+
+    def test_rejects_corrupted_or_foreign_files(self):
+        """
+        Tests the magic, version and checksum checks.
+        """
+        network = ReferralNetwork()
+        network.add_referral('A', 'B')
+        network.save(self.path)
+        with open(self.path, 'rb') as file:
+            original = file.read()
+
+        corrupted = bytearray(original)
+        corrupted[-1] ^= 0xFF
+        newer_version = bytearray(original)
+        struct.pack_into('<H', newer_version, 4, 99)
+
+        for data in (bytes(corrupted), bytes(newer_version), b'not a snapshot at all, just text'):
+            with open(self.path, 'wb') as file:
+                file.write(data)
+            with self.assertRaises(ValueError):
+                ReferralNetwork.load(self.path)
+
+    def test_unsupported_user_names(self):
+        """
+        Tests that names which cannot be encoded are refused at save time.
+        """
+        network = ReferralNetwork()
+        network.add_referral(('tuple', 'name'), 'B')
+        with self.assertRaises(ValueError):
+            network.save(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
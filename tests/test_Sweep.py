@@ -0,0 +1,93 @@
+import csv
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from source.Simulation import SimulationConfig, simulate
+from source.Sweep import SWEEP_FIELDS, pyarrow, run_sweep, write_sweep_csv, write_sweep_parquet
+
+class TestSweep(unittest.TestCase):
+    """
+    Tests for the parameter sweep runner and its writers.
+    """
+
+    def setUp(self):
+
+        self.grid = dict(ps=[0, 0.05, 0.3, 1.5], days=[0, 1, 7, 40], capacities=[1, 2.5, 10], initial_referrers=[1, 100])
+
+    def _expected(self, result):
+
+        curve = simulate(result.p, result.days, SimulationConfig(result.initial_referrers, result.referral_capacity))
+        return curve[-1] if curve else 0.0
+
+    def test_covers_grid_and_matches_simulate(self):
+        """
+        Tests that every grid point is reported once with the total simulate() gives.
+        """
+        results = list(run_sweep(**self.grid, workers=1))
+
+        points = {(r.p, r.referral_capacity, r.initial_referrers, r.days) for r in results}
+        self.assertEqual(len(results), 4 * 4 * 3 * 2)
+        self.assertEqual(len(points), len(results))
+        for result in results:
+            self.assertEqual(result.total_referrals, self._expected(result), result)
+
+    def test_process_pool_gives_same_results(self):
+        """
+        Tests that fanning the groups out over processes does not change the results.
+        """
+        with mock.patch('source.Sweep.GROUPS_PER_TASK', 2):
+            parallel = sorted(run_sweep(**self.grid, workers=2))
+        self.assertEqual(parallel, sorted(run_sweep(**self.grid, workers=1)))
+
+    def test_equivalent_scenarios_are_simulated_once(self):
+        """
+        Tests that capacities giving the same cohort lifetime share one simulation.
+        """
+        with mock.patch('source.Sweep.simulate', wraps=simulate) as wrapped:
+            results = list(run_sweep([0.5], [10, 20, 30], capacities=[4.6, 4.8, 5.0, 9.0], workers=1))
+
+        # 4.6 / 4.8 / 5.0 all retire cohorts after 10 days at p=0.5, 9.0 after 18
+        self.assertEqual(wrapped.call_count, 2)
+        self.assertEqual(len(results), 12)
+
+    def test_write_csv(self):
+        """
+        Tests that the CSV writer streams a header and one row per result.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sweep.csv')
+            count = write_sweep_csv(run_sweep([0.1, 0.2], [5, 10], workers=1), path)
+
+            with open(path, newline='') as file:
+                rows = list(csv.reader(file))
+
+        self.assertEqual(count, 4)
+        self.assertEqual(tuple(rows[0]), SWEEP_FIELDS)
+        self.assertEqual(float(rows[1][-1]), simulate(0.1, 5)[-1])
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_write_parquet(self):
+        """
+        Tests that the Parquet writer round-trips the results.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sweep.parquet')
+            results = list(run_sweep(**self.grid, workers=1))
+            count = write_sweep_parquet(iter(results), path, batch_size=10)
+            table = pyarrow.parquet.read_table(path)
+
+        self.assertEqual(count, len(results))
+        self.assertEqual(table.column('total_referrals').to_pylist(), [r.total_referrals for r in results])
+
+    def test_parquet_requires_pyarrow(self):
+        """
+        Tests that writing Parquet without pyarrow raises ImportError.
+        """
+        with mock.patch('source.Sweep.pyarrow', None):
+            with self.assertRaises(ImportError):
+                write_sweep_parquet([], 'unused.parquet')
+
+if __name__ == '__main__':
+    unittest.main()
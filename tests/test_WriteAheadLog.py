@@ -0,0 +1,229 @@
+import os
+import tempfile
+import time
+import unittest
+
+from source.CompactReferralNetwork import CompactReferralNetwork
+from source.Generators import preferential_attachment_forest
+from source.ReferralNetwork import ReferralNetwork
+from source.WriteAheadLog import WriteAheadLog
+
+class TestWriteAheadLog(unittest.TestCase):
+    """
+    Tests for logging, replaying and compacting accepted referrals.
+    """
+
+    network_class = ReferralNetwork
+
+    def setUp(self):
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.referrals = list(preferential_attachment_forest(500, seed=3))
+
+    def open_log(self, **options):
+
+        log = WriteAheadLog(self.directory.name, fsync=False, **options)
+        self.addCleanup(log.close)
+        return log
+
+    def assertSameNetwork(self, network, expected):
+
+        self.assertEqual(list(network.graph), list(expected.graph))
+        self.assertEqual({user: list(referrals) for user, referrals in network.graph.items()}, {user: list(referrals) for user, referrals in expected.graph.items()})
+        self.assertEqual(list(network.referrers.items()), list(expected.referrers.items()))
+        self.assertEqual(dict(network.reach_counts), dict(expected.reach_counts))
+
+    def build_expected(self):
+
+        expected = self.network_class()
+        expected.add_user('loner')
+        expected.add_referrals(self.referrals + [(0, 1), ('loner', 0)])
+        return expected
+
+    def fill(self, network):
+
+        network.add_user('loner')
+        network.add_referrals(self.referrals)
+        network.add_referrals([(0, 1), ('loner', 0)])  # both rejected
+
+    def test_replay_restores_network(self):
+        """
+        Tests that recovering replays every logged user and accepted referral in order.
+        """
+        log = self.open_log()
+        self.fill(log.recover(self.network_class))
+        log.close()
+
+        recovered = self.open_log().recover(self.network_class)
+
+        self.assertSameNetwork(recovered, self.build_expected())
+
+    def test_group_commit(self):
+        """
+        Tests that appends are buffered into a few commits and flushed on commit().
+        """
+        log = self.open_log(sync_interval=60)
+        network = log.recover(self.network_class)
+        network.add_referrals(self.referrals)
+
+        self.assertEqual(log.commits, 0)
+        log.commit()
+        self.assertEqual(log.commits, 1)
+        self.assertEqual(log.records, len(network.graph) + len(self.referrals))
+
+        log = self.open_log(sync_interval=60, max_buffer_bytes=256)
+        log.recover(self.network_class).add_referrals([(f'x{i}', f'y{i}') for i in range(100)])
+        self.assertGreater(log.commits, 10)
+
+    def test_idle_append_becomes_durable(self):
+        """
+        Tests that a lone append is committed once sync_interval passes without further writes.
+        """
+        log = self.open_log(sync_interval=0.05)
+        network = log.recover(self.network_class)
+        network.add_referral('A', 'B')
+        self.assertEqual(log.commits, 0)
+
+        deadline = time.monotonic() + 5
+        while log.commits == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(log.commits, 1)
+
+        # Read back without closing, as a crash would leave the file
+        recovered = self.open_log().recover(self.network_class)
+        self.assertEqual(recovered.get_direct_referrals('A'), ['B'])
+
+    def test_torn_commit_is_dropped(self):
+        """
+        Tests that a partially written last frame is discarded and later appends survive.
+        """
+        log = self.open_log(sync_interval=60)
+        network = log.recover(self.network_class)
+        network.add_referrals(self.referrals)
+        log.commit()
+        network.add_referral('late', 'lost')
+        log.commit()
+        path = log._file.name
+        log._file.close()
+        log._file = None
+
+        # Cut the last frame short, as a crash during its write would
+        with open(path, 'r+b') as file:
+            file.truncate(os.path.getsize(path) - 3)
+
+        log = self.open_log()
+        recovered = log.recover(self.network_class)
+        self.assertNotIn('late', recovered.graph)
+        recovered.add_referral('after', 'crash')
+        log.close()
+
+        recovered = self.open_log().recover(self.network_class)
+        self.assertEqual(recovered.get_direct_referrals('after'), ['crash'])
+        self.assertEqual(len(recovered.referrers), len(self.referrals) + 1)
+
+    def test_compaction(self):
+        """
+        Tests that compaction starts a new generation from a snapshot and drops old files.
+        """
+        log = self.open_log(compact_every=300)
+        self.fill(log.recover(self.network_class))
+        log.close()
+
+        self.assertGreater(log.generation, 0)
+        self.assertEqual(sorted(name.split('-')[0] for name in os.listdir(self.directory.name)), ['log', 'snapshot'])
+
+        recovered = self.open_log().recover(self.network_class)
+        self.assertSameNetwork(recovered, self.build_expected())
+
+    def test_crash_after_compaction_snapshot(self):
+        """
+        Tests that a snapshot written just before a crash is recovered with an empty log.
+        """
+        log = self.open_log(compact_every=None)
+        network = log.recover(self.network_class)
+        network.add_referrals(self.referrals)
+        log.commit()
+        network.save(os.path.join(self.directory.name, f'snapshot-{1:020d}.snapshot'))
+        log.close()
+
+        log = self.open_log()
+        recovered = log.recover(self.network_class)
+
+        self.assertEqual(log.generation, 1)
+        self.assertEqual(log.records, 0)
+        self.assertEqual(len(recovered.referrers), len(self.referrals))
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, f'log-{0:020d}.wal')))
+
+    def test_referral_times_are_replayed(self):
+        """
+        Tests that referral times are logged and restored by replay and by compaction.
+        """
+        for compact_every in (None, 50):
+            with self.subTest(compact_every=compact_every):
+                log = self.open_log(compact_every=compact_every)
+                network = log.recover(self.network_class)
+                network.add_referrals((referrer, candidate, float(i)) for i, (referrer, candidate) in enumerate(self.referrals))
+                log.close()
+
+                recovered = self.open_log().recover(self.network_class)
+                self.assertEqual([recovered.get_referral_time(candidate) for _, candidate in self.referrals], [float(i) for i in range(len(self.referrals))])
+                self.assertEqual(recovered.window(100, 200).get_top_k_referrers(5), network.window(100, 200).get_top_k_referrers(5))
+
+    def test_untimed_records_replay(self):
+        """
+        Tests that referral records written without a time still replay.
+        """
+        log = self.open_log()
+        network = log.recover(self.network_class)
+        network.add_user('A')
+        log.append_user('B')
+        log.append_referral('A', 'B')
+        log.close()
+
+        recovered = self.open_log().recover(self.network_class)
+        self.assertEqual(recovered.get_direct_referrals('A'), ['B'])
+        self.assertIsNone(recovered.get_referral_time('B'))
+
+    def test_moves_and_removals_are_replayed(self):
+        """
+        Tests that moves and removals are logged and replayed in order with the referrals,
+        and survive a compaction into a snapshot.
+        """
+        log = self.open_log()
+        network = log.recover(self.network_class)
+        network.add_referrals(self.referrals)
+        network.move_referral(5, 'newcomer', 7.0)
+        network.add_referral(5, 'late')
+        network.remove_user(1)
+        log.compact()
+        network.remove_user(2, promote_referrals=False)
+        network.add_referral('late', 'later', 8.0)
+        log.close()
+
+        recovered = self.open_log().recover(self.network_class)
+        self.assertSameNetwork(recovered, network)
+        self.assertEqual(recovered.get_referral_time(5), 7.0)
+        self.assertEqual(recovered.unique_reach_ranker.get_influencers(), network.get_influencers_by_unique_reach())
+
+    def test_rejects_foreign_files(self):
+        """
+        Tests that a log file with the wrong magic raises ValueError.
+        """
+        with open(os.path.join(self.directory.name, f'log-{0:020d}.wal'), 'wb') as file:
+            file.write(b'NOPE' + bytes(100))
+
+        with self.assertRaises(ValueError):
+            WriteAheadLog(self.directory.name).recover(self.network_class)
+
+
+class TestCompactWriteAheadLog(TestWriteAheadLog):
+    """
+    Runs the write-ahead log tests against the array-backed backend.
+    """
+
+    network_class = CompactReferralNetwork
+
+
+if __name__ == '__main__':
+    unittest.main()